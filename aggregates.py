@@ -0,0 +1,110 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Attributes averaged per best position for the overall attributes radar plot
+POSITION_ATTRIBUTES = ['Heading Accuracy', 'Short Passing', 'Dribbling', 'Curve', 'FK Accuracy', 'Long Passing',
+                       'Ball Control', 'Sprint Speed', 'Shot Power', 'Jumping']
+
+# Columns averaged per group, for each grouping key used by the figures
+MEAN_COLUMNS = {
+    'Nationality': ['OVA'],
+    'Club': ['OVA'],
+    'BP': POSITION_ATTRIBUTES,
+    'Age': [],
+}
+
+_summaries = {}
+# Reentrant, a dataframe collected while the lock is held runs its _forget finalizer in the same thread
+_summaries_lock = threading.RLock()
+
+
+def _forget(frame_id: int):
+    with _summaries_lock:
+        for cache_key in [k for k in _summaries if k[0] == frame_id]:
+            del _summaries[cache_key]
+
+
+def group_summary(fifa: pd.DataFrame, key: str):
+    """
+    Returns the player count and the mean of the MEAN_COLUMNS of every group of a key, computed in a single
+    vectorized groupby pass. Summaries are memoized for as long as the dataframe is alive.
+    :param fifa: The dataframe containing the FIFA game data
+    :param key: Column to group by
+    :return: A dataframe with the key column, a 'Counts' column and one column per averaged attribute
+    """
+    with _summaries_lock:
+        summary = _summaries.get((id(fifa), key))
+    if summary is None:
+        aggregations = {'Counts': ('Name', 'count')}
+        aggregations.update({column: (column, 'mean') for column in MEAN_COLUMNS.get(key, [])})
+        summary = fifa.groupby(key).agg(**aggregations).reset_index()
+        remember(fifa, key, summary)
+    return summary
+
+
+def remember(fifa: pd.DataFrame, key: str, summary: pd.DataFrame):
+    """
+    Memoizes a summary computed elsewhere, e.g. maintained incrementally by incremental.RunningAggregates
+    :param fifa: The dataframe the summary describes
+    :param key: Column the summary groups by
+    :param summary: Summary in the format of group_summary
+    """
+    with _summaries_lock:
+        if not any(k[0] == id(fifa) for k in _summaries):
+            weakref.finalize(fifa, _forget, id(fifa))
+        _summaries[(id(fifa), key)] = summary
+
+
+def group_totals(rows: pd.DataFrame, key: str, sign=1.0):
+    """
+    Returns the row count, player count and the sum and count of every MEAN_COLUMNS attribute per group of a key.
+    Totals are mergeable: the totals of two sets of rows add up to the totals of their union, and rows weighted
+    by a sign of -1 take out what they put in.
+    :param rows: Rows of the FIFA game data
+    :param key: Column to group by
+    :param sign: Weight of the rows, a scalar or one weight per row
+    :return: A dataframe indexed by the key with 'Rows', 'Counts' and '<attribute> sum'/'<attribute> count' columns
+    """
+    sign = np.broadcast_to(np.asarray(sign, dtype=np.float64), len(rows))
+    columns = {key: rows[key].to_numpy(), 'Rows': sign, 'Counts': rows['Name'].notna().to_numpy() * sign}
+    for column in MEAN_COLUMNS.get(key, []):
+        values = rows[column].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        columns[f'{column} sum'] = np.where(present, values, 0.0) * sign
+        columns[f'{column} count'] = present * sign
+    return pd.DataFrame(columns).groupby(key).sum()
+
+
+def totals_summary(totals: pd.DataFrame, key: str):
+    """
+    Converts the totals of group_totals to the format of group_summary
+    :param totals: Totals of a key
+    :param key: Column grouped by
+    :return: A dataframe with the key column, a 'Counts' column and one column per averaged attribute
+    """
+    summary = pd.DataFrame({'Counts': totals['Counts'].round().astype(np.int64)}, index=totals.index)
+    for column in MEAN_COLUMNS.get(key, []):
+        summary[column] = totals[f'{column} sum'] / totals[f'{column} count'].replace(0, np.nan)
+    return summary.rename_axis(key).reset_index()
+
+
+def top_groups(fifa: pd.DataFrame, key: str, n: int = 20):
+    """
+    Returns the n groups of a key with the most players
+    :param fifa: The dataframe containing the FIFA game data
+    :param key: Column to group by
+    :param n: Number of groups to return
+    :return: A dataframe with the key and 'Counts' columns, sorted by descending count
+    """
+    return group_summary(fifa, key)[[key, 'Counts']].nlargest(n, 'Counts')
+
+
+def invalidate(fifa: pd.DataFrame):
+    """
+    Drops the memoized summaries of a dataframe, to be called after it is modified in place
+    :param fifa: The dataframe containing the FIFA game data
+    """
+    _forget(id(fifa))
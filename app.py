@@ -1,15 +1,27 @@
+import startup
 import os
-import pandas as pd
+import json
+import numpy as np
 import figures as dv
+import metrics
+import photos
+from datasets import DatasetRegistry, parse_dataset_config
+from figure_cache import FigureCache
+from incremental import FIGURE_COLUMNS
+from lod import parse_relayout
+from payload import compact_figure, enable_compression
+from rendering import placeholder_figure
+from squad import MAX_SQUAD, find_replacements
+from top_players import DEFAULT_AGE_CUTOFF, MAX_AGE, MAX_N, chart_template
 
-import plotly.express as px
 import dash_bootstrap_components as dbc
-import dash_bootstrap_templates as dbt
 
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
+from dash import Dash, ctx, dcc, html, no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import warnings
 warnings.filterwarnings("ignore")
+startup.mark("imports")
 
 # Text field
 def init_text_field(value: str, reference: str):
@@ -37,19 +49,21 @@ def init_text_field(value: str, reference: str):
 
 
 # Figure Card
-def init_figure(id: str, plot: str):
+def init_figure(id: str, plot=None):
     """
     Creates a 'dbc' card-component and inserts the figure into it
     :param id: component ID
-    :param plot: plot to be drawn
+    :param plot: plot to be drawn, a placeholder is drawn until a callback fills the figure when not given
     :return: figure UI Component
     """
     return html.Div([
         dbc.Card(
             dbc.CardBody([
-                dcc.Graph(
-                    id=id,
-                    figure=plot,
+                dcc.Loading(
+                    dcc.Graph(
+                        id=id,
+                        figure=plot if plot is not None else placeholder_figure(),
+                    )
                 )
             ])
         ),
@@ -58,69 +72,163 @@ def init_figure(id: str, plot: str):
 
 # Initialize the app & building components
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
-
-# Theme Switcher
-default_theme = "zephyr"
-dark_theme = "vapor"
-theme_switcher = dbt.ThemeSwitchAIO(
-    aio_id="theme",
-    themes=[dbc.themes.BOOTSTRAP, dbc.themes.SLATE]
-)
-
-# Dataset
-df = pd.read_csv(os.path.join("assets", "cleaned_fifa21_male2.csv"))
-
-sorted = df.sort_values(by='OVA',ascending=False)
-names = sorted['Name'].values[:100]
-# Plots and Figures
-plot_bar_nation_wise_participation = dv.nation_wise_participation(
-    df
-)
-
-plot_scatter_nation_wise_over_performing_players = dv.nation_over_performing_players(
-    df
-)
-
-plot_scatter_club_wise_players = dv.club_wise_player(
-    df
+server = app.server
+
+# Payload reduction: typed-array figures and compressed responses
+compact_payloads = os.environ.get("FIFA_COMPACT_PAYLOADS", "1") == "1"
+if compact_payloads:
+    enable_compression(app.server)
+
+# Request latencies and instrumented spans on /metrics, FIFA_PROFILE_DIR turns on the slow request profiler
+profile_dir = os.environ.get("FIFA_PROFILE_DIR")
+metrics.install(app.server, profiler=metrics.SlowRequestProfiler(
+    profile_dir,
+    sample_rate=float(os.environ.get("FIFA_PROFILE_SAMPLE_RATE", "0.1")),
+    slow_seconds=float(os.environ.get("FIFA_PROFILE_SLOW_MS", "500")) / 1000,
+) if profile_dir else None)
+
+# Serialized figures, shared with the other workers through the on-disk store
+figure_cache = FigureCache(compact=compact_payloads,
+                           max_disk_bytes=int(float(os.environ.get("FIFA_FIGURE_CACHE_MB", "512")) * 2 ** 20))
+
+# Background jobs: similar-player figures missing from the figure cache are built in separate processes with their
+# results in a local diskcache, so slow ones do not hold the server threads, and Dash terminates the job of a request
+# superseded by a newer one from the same page. Without the dash[diskcache] extras they are built in the request.
+try:
+    import diskcache
+    from dash import DiskcacheManager
+    background_manager = DiskcacheManager(diskcache.Cache(os.environ.get("FIFA_JOB_CACHE_DIR", ".job_cache")))
+except ImportError:
+    background_manager = None
+metrics.REGISTRY.add_collector(lambda: [
+    ("figure_cache_hits_total", "counter", "Figures served from the cache", figure_cache.hits),
+    ("figure_cache_disk_hits_total", "counter", "Figures served from the on-disk cache", figure_cache.disk_hits),
+    ("figure_cache_misses_total", "counter", "Figures built on a cache miss", figure_cache.misses),
+    ("figure_cache_disk_bytes", "gauge", "Size of the on-disk figure cache", figure_cache.stats()["disk_bytes"]),
+])
+
+# Plots and Figures of every dataset, built by callbacks on first request and shared by every session
+section_figures = {
+    "nation_wise_participation": dv.nation_wise_participation,
+    "over_performing_players": dv.nation_over_performing_players,
+    "club_wise_players": dv.club_wise_player,
+    "club_wise_over_performing_players": dv.club_wise_over_performing_players,
+    "height_weight_variation": dv.height_vs_weight_variation,
+    "player_position": dv.players_position,
+    "player_age_distribution": dv.age_distribution,
+    "market_value_and_wage": dv.distibution_of_market_value_and_wage,
+    "best_players": dv.best_players,
+    "highest_potential": dv.highest_potential,
+    "overall_attributes": dv.overall_attributes,
+}
+
+# Top player charts, re-sliced in the browser (see assets/top_players.js) as their controls change
+clientside_figures = ["best_players", "highest_potential"]
+
+# Datasets, e.g. FIFA_DATASETS="fifa21=assets/cleaned_fifa21_male2.csv,fifa22=assets/fifa22.csv". Each one is loaded
+# on first use with its similarity engine and figures, and the least recently used ones are dropped from memory
+# above FIFA_DATASET_MEMORY_MB. Delta files of a dataset are picked up from FIFA_DELTA_DIR/<key>. Datasets start from
+# their snapshot in FIFA_SNAPSHOT_DIR when it is current, an empty FIFA_SNAPSHOT_DIR turns snapshots off.
+datasets = DatasetRegistry(
+    section_figures,
+    figure_cache,
+    max_bytes=int(float(os.environ.get("FIFA_DATASET_MEMORY_MB", "1024")) * 2 ** 20),
+    delta_dir=os.environ.get("FIFA_DELTA_DIR"),
+    snapshot_dir=os.environ.get("FIFA_SNAPSHOT_DIR", ".snapshots") or None,
 )
+for key, path in parse_dataset_config(os.environ.get("FIFA_DATASETS", "")) or [
+        ("fifa21", os.environ.get("FIFA_DATASET", os.path.join("assets", "cleaned_fifa21_male2.csv")))]:
+    datasets.register(key, path)
+metrics.REGISTRY.add_collector(lambda: [
+    ("dataset_loads_total", "counter", "Datasets loaded", datasets.loads),
+    ("dataset_evictions_total", "counter", "Datasets dropped from memory", datasets.evictions),
+    ("dataset_memory_bytes", "gauge", "Estimated memory of the loaded datasets", datasets.stats()["memory_bytes"]),
+])
+startup.mark("app setup")
+
+if datasets.delta_dir:
+    @app.server.before_request
+    def apply_roster_deltas():
+        datasets.poll(float(os.environ.get("FIFA_DELTA_POLL_SECONDS", "5")))
+
+def player_photo_url(dataset_key: str, player_id: int):
+    """
+    Returns the URL of the photo of a player, for the thumbnail route. Only loaded datasets are looked up, a photo
+    request does not load (or keep) a roster.
+    :param dataset_key: Key of the dataset
+    :param player_id: ID of the player
+    :return: URL of the photo, None for an unknown or unloaded dataset or an unknown player
+    """
+    dataset = datasets.peek(dataset_key) if dataset_key in datasets else None
+    if dataset is None:
+        return None
+    state = dataset.state
+    if player_id not in state.engine.name_index:
+        return None
+    photo = state.fifa['Player Photo'].iat[state.engine.name_index.row_of(player_id)]
+    return photos.photo_url(photo) if isinstance(photo, str) else None
 
-plot_scatter_club_wise_over_performing_players = dv.club_wise_over_performing_players(
-    df
-)
 
-plot_scatter_height_vs_weight_variation = dv.height_vs_weight_variation(
-    df
-)
+# Player photo thumbnails on /photos/<dataset>/<player ID>.png, cached by the browser
+photos.install(app.server, player_photo_url)
 
-plot_bar_player_position = dv.players_position(
-    df
-)
+# Global filters applied to every section chart, by component ID and filtered column
+categorical_filters = {"filter_club": "Club", "filter_nationality": "Nationality", "filter_position": "BP"}
+range_filters = {"filter_age": "Age", "filter_ova": "OVA"}
+filter_inputs = [Input(component_id, "value") for component_id in [*categorical_filters, *range_filters]]
 
-plot_histogram_age_distribution = dv.age_distribution(
-    df
-)
 
-plot_scatter_market_value_and_wage = dv.distibution_of_market_value_and_wage(
-    df
-)
+def filter_state(values):
+    """
+    Maps the values of the filter components to the filters of filters.FilterIndex
+    :param values: Values of the components of filter_inputs
+    :return: Dict of filters by column
+    """
+    return dict(zip([*categorical_filters.values(), *range_filters.values()], values))
 
-plot_scatter_best_players = dv.best_players(
-    df
-)
 
-plot_scatter_highest_potential = dv.highest_potential(
-    df
-)
+def similarity_constraints(options, max_age, max_value):
+    """
+    Maps the constraint components of the similar player finder to the constraints of datasets.Dataset.similar_players
+    :param options: Values checked in the similar_constraints checklist
+    :param max_age: Largest age of the similar players, None for no limit
+    :param max_value: Largest Value of the similar players in millions of €, None for no limit
+    :return: Dict of 'where', 'same' and 'not_same' constraints
+    """
+    where = {}
+    if max_age is not None:
+        where["Age"] = [None, max_age]
+    if max_value is not None:
+        where["Value in €"] = [None, max_value * 1e6]
+    return {
+        "where": where,
+        "same": ["BP"] if "same_position" in (options or []) else [],
+        "not_same": ["Club"] if "other_club" in (options or []) else [],
+    }
+
+
+def filtered_figure(dataset, graph_id: str, builder, filters: dict):
+    """
+    Returns a section figure of the rows passing the filters, cached like the other figures under the active filters
+    :param dataset: The selected datasets.Dataset
+    :param graph_id: ID of the graph component
+    :param builder: Figure builder taking the roster
+    :param filters: Filters by column, see filter_state
+    :return: The figure, the unfiltered one from the dataset registry when no filter is active
+    """
+    state = dataset.state
+    active = state.filters.normalize(filters)
+    if not active:
+        return dataset.registry.get(graph_id)
+    return figure_cache.figure(builder.__name__, {"graph_id": graph_id, "filters": active},
+                               state.fingerprint(builder.__name__), lambda: builder(state.filters.roster(filters)))
 
-plot_radar_overall_attributes = dv.overall_attributes(
-    df
-)
 
-plot_get_similar_players = dv.get_similar_players(
-    df,
-    names[0]
-)
+# Player search, the dropdown starts with the best players and is filled by the search callback as the user types
+default_dataset = datasets.get()
+name_options = default_dataset.engine.name_index.options(default_dataset.engine.name_index.search('', limit=100),
+                                                         default_dataset.roster['Club'].to_numpy())
+startup.mark("default dataset")
 
 # Application layout
 app.layout = html.Div([
@@ -145,7 +253,33 @@ app.layout = html.Div([
                     class_name="center-flex",
                 )
             ),
+            # Dataset selector, every chart below is drawn from the selected roster
+            dbc.Row(
+                dbc.Col(
+                    dcc.Dropdown(
+                    id="dataset",
+                    options=datasets.options(),
+                    value=datasets.default,
+                    clearable=False,
+            ),
+                width={"size": 3},
+            ), justify="center"),
             html.Br(),
+            # Global filters, filled from the selected dataset
+            dbc.Row([
+                dbc.Col(
+                    dcc.Dropdown(id=component_id, options=[], multi=True, placeholder=f"All {label}"),
+                    width=3,
+                ) for component_id, label in [("filter_club", "clubs"), ("filter_nationality", "nations"),
+                                              ("filter_position", "positions")]
+            ], justify="center", class_name="mb-2"),
+            dbc.Row([
+                dbc.Col([
+                    html.Span(label),
+                    dcc.RangeSlider(id=component_id, min=0, max=100, step=1, value=[0, 100], marks=None,
+                                    tooltip={"placement": "bottom", "always_visible": False}),
+                ], width=4) for component_id, label in [("filter_age", "Age"), ("filter_ova", "Overall rating")]
+            ], justify="center"),
             html.Br(),
             # 2-Text Header Rows
             dbc.Row([
@@ -167,8 +301,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "nation_wise_participation",
-                        plot_bar_nation_wise_participation
+                        "nation_wise_participation"
                     )
                 ],
                     id="barPlot_nationWiseParticipation",
@@ -176,8 +309,7 @@ app.layout = html.Div([
                 ),
                 dbc.Col([
                     init_figure(
-                        "over_performing_players",
-                        plot_scatter_nation_wise_over_performing_players
+                        "over_performing_players"
                     )
                 ],
                     id="scatterPlot_nationWiseOverPerformers",
@@ -207,8 +339,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "club_wise_players",
-                        plot_scatter_club_wise_players
+                        "club_wise_players"
                     )
                 ],
                     id="scatterPlot_clubWisePlayers",
@@ -216,8 +347,7 @@ app.layout = html.Div([
                 ),
                 dbc.Col([
                     init_figure(
-                        "club_wise_over_performing_players",
-                        plot_scatter_club_wise_over_performing_players
+                        "club_wise_over_performing_players"
                     )
                 ],
                     id="scatterPlot_clubWiseOverPerformers",
@@ -241,8 +371,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "height_weight_variation",
-                        plot_scatter_height_vs_weight_variation
+                        "height_weight_variation"
                     )
                 ],
                     id="scatterPlot_heightVsWeightVariation",
@@ -273,8 +402,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "player_position",
-                        plot_bar_player_position
+                        "player_position"
                     )
                 ],
                     id="barPlot_playerPosition",
@@ -282,8 +410,7 @@ app.layout = html.Div([
                 ),
                 dbc.Col([
                     init_figure(
-                        "player_age_distribution",
-                        plot_histogram_age_distribution
+                        "player_age_distribution"
                     )
                 ],
                     id="histogramPlot_playerAgeDistribution",
@@ -307,8 +434,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "market_value_and_wage",
-                        plot_scatter_market_value_and_wage
+                        "market_value_and_wage"
                     )
                 ],
                     id="scatterPlot_marketValueAndWage",
@@ -339,8 +465,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "best_players",
-                        plot_scatter_best_players
+                        "best_players"
                     )
                 ],
                     id="scatterPlot_bestPlayers",
@@ -348,14 +473,33 @@ app.layout = html.Div([
                 ),
                 dbc.Col([
                     init_figure(
-                        "highest_potential",
-                        plot_scatter_highest_potential
+                        "highest_potential"
                     )
                 ],
                     id="scatterPlot_highestPotential",
                     width=6
                 ),
             ], align='center'),
+            # Controls of the top player charts, applied in the browser to the extract of the selected rows
+            dcc.Store(id="top_players"),
+            dbc.Row([
+                dbc.Col([
+                    html.Span("Players"),
+                    dcc.Slider(id="best_players_n", min=10, max=MAX_N, step=10, value=100, marks=None,
+                               tooltip={"placement": "bottom", "always_visible": False}),
+                    dcc.Dropdown(id="best_players_positions", options=[], multi=True, placeholder="All positions"),
+                ], width=6),
+                dbc.Col([
+                    html.Span("Players"),
+                    dcc.Slider(id="highest_potential_n", min=10, max=MAX_N, step=10, value=50, marks=None,
+                               tooltip={"placement": "bottom", "always_visible": False}),
+                    html.Span("Younger than"),
+                    dcc.Slider(id="highest_potential_age", min=17, max=MAX_AGE, step=1, value=DEFAULT_AGE_CUTOFF,
+                               marks=None, tooltip={"placement": "bottom", "always_visible": False}),
+                    dcc.Dropdown(id="highest_potential_positions", options=[], multi=True,
+                                 placeholder="All positions"),
+                ], width=6),
+            ], class_name="mt-2"),
             html.Br(),
             html.Br(),
             
@@ -373,8 +517,7 @@ app.layout = html.Div([
             dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "overall_attributes",
-                        plot_radar_overall_attributes
+                        "overall_attributes"
                     )
                 ],
                     id="radarPlot_overallAttributes",
@@ -399,17 +542,64 @@ app.layout = html.Div([
                 dbc.Col(
                     dcc.Dropdown(
                     id="name",
-                    options=names,
-                    value=names[0],
+                    options=name_options,
+                    value=name_options[0]['value'],
                     maxHeight=300,
             ),
                 width={"size": 3},
                 class_name="mb-2",
+            ),
+                dbc.Col(
+                    dcc.RadioItems(
+                    id="similarity_mode",
+                    options=[
+                        {'label': ' Exact', 'value': 'exact'},
+                        {'label': ' Approximate', 'value': 'approximate'},
+                    ],
+                    value='exact',
+                    inline=True,
+                    inputStyle={'margin-left': '10px'},
+            ),
+                width={"size": 3},
+                class_name="mb-2",
             ),
+                dbc.Col([
+                    html.Div(id="similar_players_status", className="text-muted"),
+                    dcc.Store(id="similar_players_job"),
+                ],
+                width={"size": 3},
+                class_name="mb-2",
+            ),
+            ], align='center'),
+            # Constraints of the similar players Row, the value in millions of €
+            dbc.Row([
+                dbc.Col(
+                    dcc.Checklist(
+                    id="similar_constraints",
+                    options=[
+                        {'label': ' Same position', 'value': 'same_position'},
+                        {'label': ' Other club', 'value': 'other_club'},
+                    ],
+                    value=[],
+                    inline=True,
+                    inputStyle={'margin-left': '10px'},
+            ),
+                width={"size": 4},
+                class_name="mb-2",
+            ),
+                dbc.Col([
+                    html.Span("Max age"),
+                    dbc.Input(id="similar_max_age", type="number", min=16, step=1, debounce=True),
+                ], width=3, class_name="mb-2"),
+                dbc.Col([
+                    html.Span("Max value (€M)"),
+                    dbc.Input(id="similar_max_value", type="number", min=0, step=0.5, debounce=True),
+                ], width=3, class_name="mb-2"),
+            ], align='center'),
+            dbc.Row([
                 dbc.Col([
                     init_figure(
-                        "similar_players",
-                        plot_get_similar_players
+                        "similar_players"
                     )
                 ],
                     id="plot_FindSimilarPlayers",
@@ -417,27 +607,349 @@ app.layout = html.Div([
                     align='center'
                 ),
             ], align='center'),
+            html.Br(),
+            html.Br(),
+
+            # 1-Text Header Row
+            dbc.Row([
+                dbc.Col([
+                    init_text_field(
+                        "Squad Replacement Finder",
+                        "#table_SquadReplacements"
+                    )
+                ], width=12)
+            ], align='center'),
+            html.Br(),
+            # Squad and cost constraints Row, amounts in millions of € (thousands for the wage)
+            dbc.Row([
+                dbc.Col(
+                    dcc.Dropdown(id="squad", options=name_options, value=[], multi=True, maxHeight=300,
+                                 placeholder=f"Squad, up to {MAX_SQUAD} players"),
+                    width=12,
+                    class_name="mb-2",
+                ),
+                dbc.Col([
+                    html.Span("Replacements per player"),
+                    dcc.Slider(id="squad_k", min=1, max=10, step=1, value=3, marks=None,
+                               tooltip={"placement": "bottom", "always_visible": False}),
+                ], width=3),
+                dbc.Col([
+                    html.Span("Max value (€M)"),
+                    dbc.Input(id="squad_max_value", type="number", min=0, step=0.5, debounce=True),
+                ], width=3),
+                dbc.Col([
+                    html.Span("Max wage (€K)"),
+                    dbc.Input(id="squad_max_wage", type="number", min=0, step=1, debounce=True),
+                ], width=3),
+                dbc.Col([
+                    html.Span("Total budget (€M)"),
+                    dbc.Input(id="squad_budget", type="number", min=0, step=1, debounce=True),
+                ], width=3),
+            ], align='center'),
+            dbc.Row([
+                dbc.Col([
+                    init_figure(
+                        "squad_replacements",
+                        placeholder_figure("Pick the players of a squad")
+                    )
+                ],
+                    id="table_SquadReplacements",
+                    width=12,
+                    align='center'
+                ),
+            ], align='center', class_name="mt-2"),
 
         ], style={'background-color': '#fafafa'})
     )
 ]
 #, className="dbc all-row-margin container"
 )
+startup.mark("layout")
+
+
+# Scatter charts with level-of-detail rendering, redrawn for the view on zoom and pan
+lod_builders = {
+    "height_weight_variation": dv.height_vs_weight_variation,
+    "market_value_and_wage": dv.distibution_of_market_value_and_wage,
+}
 
 
 # Method Callbacks
+def section_callback(graph_id: str):
+    """
+    Returns the callback serving a section figure of the selected dataset
+    :param graph_id: ID of the graph component
+    :return: Callback function
+    """
+    def serve_figure(dataset_key, *filter_values):
+        return filtered_figure(datasets.get(dataset_key), graph_id, section_figures[graph_id],
+                               filter_state(filter_values))
+    serve_figure.__name__ = f'serve_{graph_id}'
+    return serve_figure
+
+
+for graph_id in section_figures:
+    if graph_id in lod_builders or graph_id in clientside_figures:
+        continue
+    app.callback(
+        Output(graph_id, "figure"),
+        Input("dataset", "value"),
+        *filter_inputs,
+    )(metrics.timed("callback", callback=f"serve_{graph_id}")(section_callback(graph_id)))
+
+
 @app.callback(
-    Output("similar_players", "figure"),
+    Output("top_players", "data"),
+    Input("dataset", "value"),
+    *filter_inputs,
+)
+@metrics.timed("callback", callback="serve_top_players")
+def serve_top_players(dataset_key, *filter_values):
+    # Shipped once per dataset and filters, the top player controls then re-slice it without a round trip
+    dataset = datasets.get(dataset_key)
+    extract = dataset.top_players(filter_state(filter_values))
+    return dict(extract, templates={graph_id: chart_template(dataset.registry.get(graph_id))
+                                    for graph_id in clientside_figures})
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace="top_players", function_name="best_players"),
+    Output("best_players", "figure"),
+    Input("top_players", "data"),
+    Input("best_players_n", "value"),
+    Input("best_players_positions", "value"),
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="top_players", function_name="highest_potential"),
+    Output("highest_potential", "figure"),
+    Input("top_players", "data"),
+    Input("highest_potential_n", "value"),
+    Input("highest_potential_age", "value"),
+    Input("highest_potential_positions", "value"),
+)
+
+
+def lod_callback(graph_id: str):
+    """
+    Returns the callback redrawing a level-of-detail scatter chart for the view in its relayoutData
+    :param graph_id: ID of the graph component
+    :return: Callback function
+    """
+    def update_lod_figure(relayout_data, dataset_key, *filter_values):
+        dataset = datasets.get(dataset_key)
+        filters = filter_state(filter_values)
+        view = parse_relayout(relayout_data) if ctx.triggered_id == graph_id else (None, None)
+        if view is None:
+            raise PreventUpdate
+        x_range, y_range = view
+        builder = lod_builders[graph_id]
+        if x_range is None and y_range is None:
+            return filtered_figure(dataset, graph_id, builder, filters)
+        # The state is read once, as in filtered_figure, so the zoomed view comes from a single version of the roster
+        state = dataset.state
+        roster = state.filters.subset(filters, FIGURE_COLUMNS[builder.__name__])
+        fig = builder(roster, x_range=x_range, y_range=y_range)
+        return compact_figure(json.loads(fig.to_json())) if compact_payloads else fig
+    update_lod_figure.__name__ = f'update_{graph_id}'
+    return update_lod_figure
+
+
+for graph_id in lod_builders:
+    app.callback(
+        Output(graph_id, "figure"),
+        Input(graph_id, "relayoutData"),
+        Input("dataset", "value"),
+        *filter_inputs,
+    )(metrics.timed("callback", callback=f"update_{graph_id}")(lod_callback(graph_id)))
+
+
+similar_players_inputs = [
     Input("name" , "value"),
-    # Input(dbt.ThemeSwitchAIO.ids.switch("theme"), "value")
+    Input("similarity_mode", "value"),
+    Input("similar_constraints", "value"),
+    Input("similar_max_age", "value"),
+    Input("similar_max_value", "value"),
+]
+
+
+def similar_players_figure(name, mode, options, max_age, max_value, dataset_key, cached_only=False):
+    """
+    Returns the similar players radar plot of a player, from the figure cache or built on a miss
+    :param name: ID of the selected player
+    :param mode: Search mode, see similarity.SimilarityEngine.query
+    :param options: Values checked in the similar_constraints checklist
+    :param max_age: Largest age of the similar players, None for no limit
+    :param max_value: Largest Value of the similar players in millions of €, None for no limit
+    :param dataset_key: Key of the selected dataset
+    :param cached_only: Whether None is returned on a miss instead of building the figure
+    :return: The figure
+    """
+    dataset = datasets.get(dataset_key)
+    # Everything is read from one version of the roster, a delta applied meanwhile is not mixed in
+    state = dataset.state
+    engine = state.engine
+    # The selected player may have been removed by a roster update, or belong to the previous dataset
+    if name is None or name not in engine.name_index:
+        raise PreventUpdate
+
+    # Constrained searches only score the players meeting the constraints, resolved with the filter indexes
+    constraints = similarity_constraints(options, max_age, max_value)
+    params = {"player": name, "mode": mode, "photos": "thumbnails", **constraints}
+    fingerprint = state.fingerprint("get_similar_players")
+    if cached_only:
+        figure_json = figure_cache.get(figure_cache.key("get_similar_players", params, fingerprint))
+        return None if figure_json is None else json.loads(figure_json)
+
+    # The photos are referenced by URL, the browser loads them from the thumbnail route once the plot is drawn
+    def thumbnail(player_id, url):
+        return app.get_relative_path(f"/photos/{dataset.key}/{int(player_id)}.png?v={photos.photo_version(url)}")
+
+    return figure_cache.figure(
+        "get_similar_players", params, fingerprint,
+        lambda: dv.get_similar_players(state.fifa, name, engine, mode, photo_source=thumbnail,
+                                       similar=dataset.similar_players(name, 3, mode=mode, state=state,
+                                                                       **constraints)[0])
+    )
+
+
+@app.callback(
+    Output("similar_players", "figure"),
+    Output("similar_players_job", "data"),
+    *similar_players_inputs,
+    State("dataset", "value"),
+)
+@metrics.timed("callback", callback="update_figure")
+def update_figure(name, mode, options, max_age, max_value, dataset_key):
+    # Cached figures are served by this process, so their latency and cache hits are in its metrics. Only a miss
+    # starts a background job, whose build and serialization spans stay in the job process.
+    args = [name, mode, options, max_age, max_value, dataset_key]
+    if background_manager is None:
+        return similar_players_figure(*args), no_update
+    figure = similar_players_figure(*args, cached_only=True)
+    if figure is not None:
+        return figure, no_update
+    metrics.count("similar_player_jobs_total", "Similar player figures built by a background job")
+    return no_update, args
+
+
+if background_manager is not None:
+    @app.callback(
+        Output("similar_players", "figure", allow_duplicate=True),
+        Input("similar_players_job", "data"),
+        running=[(Output("similar_players_status", "children"), "Finding similar players...", "")],
+        # A new pick served from the cache does not start a job, so it cancels the job of the previous one
+        cancel=similar_players_inputs,
+        background=True,
+        manager=background_manager,
+        prevent_initial_call=True,
+    )
+    def build_similar_players(job):
+        if not job:
+            raise PreventUpdate
+        return similar_players_figure(*job)
+
+
+@app.callback(
+    Output("squad_replacements", "figure"),
+    Input("squad", "value"),
+    Input("squad_k", "value"),
+    Input("squad_max_value", "value"),
+    Input("squad_max_wage", "value"),
+    Input("squad_budget", "value"),
+    State("dataset", "value"),
+)
+@metrics.timed("callback", callback="update_squad_replacements")
+def update_squad_replacements(squad, k, max_value, max_wage, budget, dataset_key):
+    # Every squad player is answered by one batched query, see squad.find_replacements
+    if not squad:
+        return placeholder_figure("Pick the players of a squad")
+    state = datasets.get(dataset_key).state
+    replacements = find_replacements(
+        state.fifa, state.engine, squad[:MAX_SQUAD], k=k or 3,
+        max_value=None if max_value is None else max_value * 1e6,
+        max_wage=None if max_wage is None else max_wage * 1e3,
+        budget=None if budget is None else budget * 1e6,
+    )
+    if replacements.empty:
+        return placeholder_figure("No player fits the constraints")
+    return dv.squad_replacements(replacements)
+
+
+@app.callback(
+    *[Output(component_id, prop) for component_id in categorical_filters for prop in ["options", "value"]],
+    *[Output(component_id, prop) for component_id in range_filters for prop in ["min", "max", "value"]],
+    *[Output(f"{graph_id}_positions", prop) for graph_id in clientside_figures for prop in ["options", "value"]],
+    Input("dataset", "value"),
+)
+@metrics.timed("callback", callback="reset_filters")
+def reset_filters(dataset_key):
+    # Filters start over with the values and ranges of the selected dataset
+    filters = datasets.get(dataset_key).filters
+    values = []
+    for column in categorical_filters.values():
+        values += [filters.options(column), []]
+    for column in range_filters.values():
+        low, high = filters.ranges[column].bounds
+        low, high = int(np.floor(low)), int(np.ceil(high))
+        values += [low, high, [low, high]]
+    for _ in clientside_figures:
+        values += [filters.options("BP"), []]
+    return values
+
+
+@app.callback(
+    Output("name", "options"),
+    Output("name", "value"),
+    Input("dataset", "value"),
+    Input("name", "search_value"),
+    State("name", "value"),
+)
+@metrics.timed("callback", callback="search_players")
+def search_players(dataset_key, search_value, name):
+    state = datasets.get(dataset_key).state
+    index = state.engine.name_index
+    clubs = state.fifa['Club'].to_numpy()
+    if ctx.triggered_id == "dataset":
+        # A new dataset starts over from its best players
+        options = index.options(index.search('', limit=100), clubs)
+        return options, options[0]['value'] if options else None
+    if not search_value:
+        raise PreventUpdate
+    rows = list(index.search(search_value, limit=20))
+    if name is not None and name in index and index.row_of(name) not in rows:
+        rows.append(index.row_of(name))
+    return index.options(rows, clubs), no_update
+
+
+@app.callback(
+    Output("squad", "options"),
+    Output("squad", "value"),
+    Input("dataset", "value"),
+    Input("squad", "search_value"),
+    State("squad", "value"),
 )
-def update_figure(name):
-    # template = default_theme if toggle else dark_theme
-    plot_get_similar_players = dv.get_similar_players(df, name)
-    return plot_get_similar_players
+@metrics.timed("callback", callback="search_squad")
+def search_squad(dataset_key, search_value, squad):
+    state = datasets.get(dataset_key).state
+    index = state.engine.name_index
+    clubs = state.fifa['Club'].to_numpy()
+    if ctx.triggered_id == "dataset":
+        # The squad of the previous dataset does not carry over
+        return index.options(index.search('', limit=100), clubs), []
+    if not search_value:
+        raise PreventUpdate
+    # The picked players stay in the options, a multi-value dropdown drops the values it has no option for
+    rows = list(index.search(search_value, limit=20))
+    for player in squad or []:
+        if player in index and index.row_of(player) not in rows:
+            rows.append(index.row_of(player))
+    return index.options(rows, clubs), no_update
+
+
+startup.mark("callbacks")
 
 
 # Run the application
 if __name__ == "__main__":
-    server = app.server
     app.run_server(debug=True)
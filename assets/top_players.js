@@ -0,0 +1,69 @@
+// Clientside callbacks of the top player charts, re-sliced from the extract of top_players.top_players_extract
+(function () {
+    // Largest marker size of plotly express scatter plots, the size reference maps the largest value to it
+    var SIZE_MAX = 20;
+
+    function cell(extract, column, row) {
+        var value = extract.columns[column][row];
+        var values = extract.values[column];
+        if (values === undefined) {
+            return value;
+        }
+        return value < 0 ? null : values[value];
+    }
+
+    function draw(extract, chart, column, hover, n, positions, ageCutoff) {
+        if (!extract) {
+            return window.dash_clientside.no_update;
+        }
+        var columns = extract.columns;
+        var selected = null;
+        if (positions && positions.length) {
+            selected = new Set(positions.map(function (position) { return extract.values.BP.indexOf(position); }));
+        }
+        var rows = [];
+        var ranked = extract[chart];
+        for (var i = 0; i < ranked.length && rows.length < n; i++) {
+            var row = ranked[i];
+            if (selected !== null && !selected.has(columns.BP[row])) {
+                continue;
+            }
+            if (ageCutoff !== null && !(columns.Age[row] < ageCutoff)) {
+                continue;
+            }
+            rows.push(row);
+        }
+
+        var x = rows.map(function (row) { return columns.Age[row]; });
+        var y = rows.map(function (row) { return columns[column][row]; });
+        var template = extract.templates[chart];
+        var trace = Object.assign({type: 'scatter', mode: 'markers'}, template.data[0], {
+            x: x,
+            y: y,
+            customdata: rows.map(function (row) {
+                return hover.map(function (name) { return cell(extract, name, row); });
+            }),
+            hovertemplate: ['Age=%{marker.color}', column + '=%{marker.size}'].concat(hover.map(function (name, j) {
+                return name + '=%{customdata[' + j + ']}';
+            })).join('<br>') + '<extra></extra>'
+        });
+        trace.marker = Object.assign({}, trace.marker, {
+            color: x,
+            size: y,
+            sizeref: y.length ? Math.max.apply(null, y) / (SIZE_MAX * SIZE_MAX) : 1
+        });
+        return {data: [trace], layout: template.layout};
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        top_players: {
+            best_players: function (extract, n, positions) {
+                return draw(extract, 'best_players', 'OVA', ['Name', 'Club', 'BP'], n, positions, null);
+            },
+            highest_potential: function (extract, n, ageCutoff, positions) {
+                return draw(extract, 'highest_potential', 'POT',
+                            ['Name', 'Nationality', 'BP', 'OVA', 'Value', 'Release Clause'], n, positions, ageCutoff);
+            }
+        }
+    });
+})();
@@ -0,0 +1,466 @@
+"""
+Benchmarks for the dashboard.
+
+Run with:
+python benchmark.py ann --sizes 17000 100000 500000
+python benchmark.py aggregation --sizes 17000 100000 500000
+python benchmark.py payload assets/cleaned_fifa21_male2.csv
+python benchmark.py figures --sizes 17000 100000 500000 1000000 --out results.json --baseline baseline.json
+python benchmark.py streaming --sizes 100000 500000 --chunksize 50000
+python benchmark.py filters --sizes 100000 1000000
+python benchmark.py squad --sizes 17000 100000 500000 --squad 25
+python benchmark.py constrained --sizes 17000 100000 500000 --k 10
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import figures as dv
+from aggregates import POSITION_ATTRIBUTES
+from dataset import load_dataset, parse_units
+from filters import FilterIndex
+from payload import figure_size_report
+from similarity import ExactIndex, IVFIndex, SimilarityEngine
+from squad import find_replacements
+from streaming import DEFAULT_CHUNKSIZE, stream_roster
+from synthetic import synthetic_roster
+
+FIGURE_BUILDERS = [dv.nation_wise_participation, dv.nation_over_performing_players, dv.club_wise_player,
+                   dv.club_wise_over_performing_players, dv.height_vs_weight_variation, dv.players_position,
+                   dv.age_distribution, dv.distibution_of_market_value_and_wage, dv.best_players,
+                   dv.highest_potential, dv.overall_attributes]
+
+# Relative growth over the baseline above which a metric counts as a regression
+REGRESSION_THRESHOLDS = {'wall_s': 0.25, 'peak_mb': 0.25, 'figure_bytes': 0.05}
+# Wall time changes below this many seconds are noise, whatever their relative size
+MIN_WALL_DELTA_S = 0.01
+
+
+def synthetic_vectors(n_rows: int, n_features: int = 34, n_clusters: int = 50, seed: int = 0):
+    """
+    Generates L2-normalized attribute vectors that cluster like player roles do
+    :param n_rows: Number of players
+    :param n_features: Number of attributes per player
+    :param n_clusters: Number of player archetypes
+    :param seed: Seed of the random generator
+    :return: A contiguous (n_rows, n_features) float32 array
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(0.2, 0.9, size=(n_clusters, n_features))
+    rows = centers[rng.integers(0, n_clusters, n_rows)] + rng.normal(0, 0.08, size=(n_rows, n_features))
+    rows = np.clip(rows, 0, 1)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return np.ascontiguousarray(rows, dtype=np.float32)
+
+
+def _mean_latency_ms(index, matrix: np.ndarray, queries: np.ndarray, k: int, **search_params):
+    results = []
+    start = time.perf_counter()
+    for q in queries:
+        results.append(index.search(matrix[q], k, exclude=q, **search_params)[0])
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def ann_benchmark(sizes, k: int = 10, n_queries: int = 200, n_probes=(1, 4, 8, 16, 32)):
+    """
+    Compares the approximate index against the exact search
+    :param sizes: Roster sizes to benchmark
+    :param k: Number of neighbours per query
+    :param n_queries: Number of random queries per roster size
+    :param n_probes: n_probe settings of the approximate index
+    :return: One dict per (size, mode) with build time, mean query latency and recall@k
+    """
+    rows = []
+    for size in sizes:
+        matrix = synthetic_vectors(size)
+        queries = np.random.default_rng(1).choice(size, size=min(n_queries, size), replace=False)
+
+        start = time.perf_counter()
+        exact = ExactIndex(matrix)
+        exact_build = time.perf_counter() - start
+        exact_latency, truth = _mean_latency_ms(exact, matrix, queries, k)
+        rows.append(dict(size=size, mode='exact', build_s=exact_build, latency_ms=exact_latency, recall=1.0))
+
+        start = time.perf_counter()
+        ivf = IVFIndex(matrix)
+        ivf_build = time.perf_counter() - start
+        for n_probe in n_probes:
+            latency, found = _mean_latency_ms(ivf, matrix, queries, k, n_probe=n_probe)
+            recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, truth)])
+            rows.append(dict(size=size, mode=f'ivf n_lists={ivf.n_lists} n_probe={n_probe}', build_s=ivf_build,
+                             latency_ms=latency, recall=recall))
+    return rows
+
+
+def _legacy_aggregations(fifa: pd.DataFrame):
+    # The groupby().apply(lambda) and merge chains the figures used before the aggregates module
+    for key in ['Nationality', 'Club', 'BP', 'Age']:
+        fifa.groupby(key).apply(lambda x: x['Name'].count()).reset_index(name='Counts')
+    for key in ['Nationality', 'Club']:
+        avg = fifa.groupby(key).apply(lambda x: np.average(x['OVA'])).reset_index(name='Overall Ratings')
+        cnt = fifa.groupby(key).apply(lambda x: x['OVA'].count()).reset_index(name='Player Counts')
+        pd.merge(avg, cnt, how='inner', left_on=key, right_on=key)
+    merged = None
+    for attribute in POSITION_ATTRIBUTES:
+        means = fifa.groupby('BP').apply(lambda x: np.average(x[attribute])).reset_index(name=attribute)
+        merged = means if merged is None else pd.merge(merged, means, how='inner', left_on='BP', right_on='BP')
+
+
+def _aggregations(fifa: pd.DataFrame):
+    aggregates.invalidate(fifa)
+    for key in ['Nationality', 'Club', 'BP', 'Age']:
+        aggregates.group_summary(fifa, key)
+
+
+def aggregation_benchmark(sizes, repeat: int = 3):
+    """
+    Times the aggregations behind the grouped figures, before and after the aggregates module
+    :param sizes: Roster sizes to benchmark
+    :param repeat: Number of runs, the fastest one is reported
+    :return: One dict per size with both timings and the speed-up
+    """
+    rows = []
+    for size in sizes:
+        fifa = synthetic_roster(size)
+        timings = {}
+        for label, run in [('groupby_apply_s', _legacy_aggregations), ('single_pass_s', _aggregations)]:
+            best = np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run(fifa)
+                best = min(best, time.perf_counter() - start)
+            timings[label] = best
+        rows.append(dict(size=size, **timings, speedup=timings['groupby_apply_s'] / timings['single_pass_s']))
+    return rows
+
+
+def payload_report(csv_path: str):
+    """
+    Builds the dashboard figures from a roster and reports the payload size of each
+    :param csv_path: Path of the roster CSV
+    :return: One dict per figure, see payload.figure_size_report
+    """
+    fifa = load_dataset(csv_path)
+    return figure_size_report({builder.__name__: builder(fifa) for builder in FIGURE_BUILDERS})
+
+
+def _measure(run, memory: bool = True):
+    """
+    Runs a function once for its wall time and, when memory is set, a second time under tracemalloc for its peak
+    allocation, so the tracing overhead does not skew the timing
+    """
+    gc.collect()
+    start = time.perf_counter()
+    result = run()
+    wall = time.perf_counter() - start
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result, wall, peak
+
+
+def figures_benchmark(sizes, memory: bool = True, seed: int = 0):
+    """
+    Times every figure builder and the similar-player query on synthetic rosters
+    :param sizes: Roster sizes to benchmark
+    :param memory: Whether to record the peak memory of each step with tracemalloc
+    :param seed: Seed of the synthetic rosters
+    :return: One dict per (size, step) with the wall time in s, the peak memory in MB and the size of the
+             serialized figure in bytes (None for steps that do not produce a figure)
+    """
+    rows = []
+    for size in sizes:
+        raw = synthetic_roster(size, seed)
+        fifa, wall, peak = _measure(lambda: parse_units(raw.copy()), memory)
+        del raw
+        rows.append(dict(size=size, name='parse_units', wall_s=wall, peak_mb=peak, figure_bytes=None))
+
+        for builder in FIGURE_BUILDERS:
+            def run():
+                aggregates.invalidate(fifa)
+                return builder(fifa)
+            fig, wall, peak = _measure(run, memory)
+            rows.append(dict(size=size, name=builder.__name__, wall_s=wall, peak_mb=peak,
+                             figure_bytes=len(fig.to_json().encode('utf-8'))))
+
+        engine, wall, peak = _measure(lambda: SimilarityEngine(fifa), memory)
+        rows.append(dict(size=size, name='similarity_engine', wall_s=wall, peak_mb=peak, figure_bytes=None))
+        player = int(fifa['OVA'].to_numpy().argmax())
+        _, wall, peak = _measure(lambda: engine.query(player, k=3), memory)
+        rows.append(dict(size=size, name='similar_players_query', wall_s=wall, peak_mb=peak, figure_bytes=None))
+        del engine, fifa
+    return rows
+
+
+def streaming_benchmark(sizes, chunksize: int = DEFAULT_CHUNKSIZE, seed: int = 0):
+    """
+    Builds every figure from a synthetic roster CSV read whole and streamed in chunks
+    :param sizes: Roster sizes to benchmark
+    :param chunksize: Number of rows per chunk of the streamed reads
+    :param seed: Seed of the synthetic rosters
+    :return: One dict per size with the wall time and peak memory of both paths and whether they drew the
+             same figures
+    """
+    def build(fifa):
+        return [builder(fifa).to_json() for builder in FIGURE_BUILDERS]
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, f'roster-{size}.csv')
+            synthetic_roster(size, seed).to_csv(path, index=False)
+            whole, whole_wall, whole_peak = _measure(lambda: build(parse_units(pd.read_csv(path))))
+            streamed, stream_wall, stream_peak = _measure(lambda: build(stream_roster(path, chunksize)[0]))
+            rows.append(dict(size=size, file_mb=os.path.getsize(path) / 2 ** 20, whole_s=whole_wall,
+                             whole_peak_mb=whole_peak, streamed_s=stream_wall, streamed_peak_mb=stream_peak,
+                             identical=whole == streamed))
+            os.remove(path)
+    return rows
+
+
+def filters_benchmark(sizes, seed: int = 0):
+    """
+    Times the filter indexes of synthetic rosters: their build, and the masks and stand-in rosters of a narrow,
+    a range and a wide filter
+    :param sizes: Roster sizes to benchmark
+    :param seed: Seed of the synthetic rosters
+    :return: One dict per (size, filter) with the matching players and the timings in ms
+    """
+    rows = []
+    for size in sizes:
+        fifa = parse_units(synthetic_roster(size, seed))
+        index, build, _ = _measure(lambda: FilterIndex(fifa), memory=False)
+        clubs = fifa['Club'].value_counts().index.tolist()
+        cases = {
+            'one club': {'Club': clubs[:1]},
+            'age 20-25': {'Age': [20, 25]},
+            'wide': {'Club': clubs[:len(clubs) // 2], 'OVA': [60, 99]},
+        }
+        for name, filters in cases.items():
+            mask, mask_s, _ = _measure(lambda: index.mask(filters), memory=False)
+            _, view_s, _ = _measure(lambda: index.build_view(mask), memory=False)
+            rows.append(dict(size=size, filter=name, players=int(mask.sum()), index_build_ms=build * 1000,
+                             mask_ms=mask_s * 1000, view_ms=view_s * 1000))
+    return rows
+
+
+def squad_benchmark(sizes, squad_size: int = 25, k: int = 3, repeat: int = 20, seed: int = 0):
+    """
+    Times the replacements of a squad found with one batched query against a single similar player lookup and one
+    lookup per squad player, on synthetic rosters, with and without Value and budget caps
+    :param sizes: Roster sizes to benchmark
+    :param squad_size: Number of squad players
+    :param k: Number of replacements per player
+    :param repeat: Number of timed runs averaged
+    :param seed: Seed of the synthetic rosters and of the squad draw
+    :return: One dict per (size, constraints) with the mean latencies in ms
+    """
+    rows = []
+    for size in sizes:
+        fifa = parse_units(synthetic_roster(size, seed))
+        engine = SimilarityEngine(fifa)
+        squad = np.random.default_rng(seed).choice(fifa['ID'].to_numpy(), size=squad_size, replace=False).tolist()
+        squad_rows = [engine.name_index.row_of(player) for player in squad]
+        value = float(fifa['Value in €'].median())
+        for name, caps in {'none': {}, 'value + budget': {'max_value': value, 'budget': value * squad_size}}.items():
+            def mean_ms(run):
+                run()
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    run()
+                return (time.perf_counter() - start) / repeat * 1000
+            rows.append(dict(
+                size=size, constraints=name,
+                single_query_ms=mean_ms(lambda: engine.query(squad_rows[0], k)),
+                one_by_one_ms=mean_ms(lambda: [engine.query(row, k) for row in squad_rows]),
+                squad_of_1_ms=mean_ms(lambda: find_replacements(fifa, engine, squad[:1], k, **caps)),
+                squad_ms=mean_ms(lambda: find_replacements(fifa, engine, squad, k, **caps)),
+            ))
+    return rows
+
+
+def constrained_benchmark(sizes, k: int = 10, n_queries: int = 50, oversample: int = 10, seed: int = 0):
+    """
+    Compares constrained similar player searches scoring only the candidates resolved by the filter indexes with
+    unconstrained searches of oversample * k players post-filtered by the constraints, on synthetic rosters
+    :param sizes: Roster sizes to benchmark
+    :param k: Number of similar players
+    :param n_queries: Number of players searched per constraint
+    :param oversample: Factor of k searched before post-filtering
+    :param seed: Seed of the synthetic rosters and of the query draw
+    :return: One dict per (size, constraints) with the mean latencies in ms and the share of the queries the
+             post-filtered search answers with fewer than k players although k qualify
+    """
+    rows = []
+    for size in sizes:
+        fifa = parse_units(synthetic_roster(size, seed))
+        engine = SimilarityEngine(fifa)
+        index = FilterIndex(fifa)
+        queries = np.random.default_rng(seed).choice(size, size=n_queries, replace=False)
+        value = float(fifa['Value in €'].median())
+        cases = {
+            'under 23': lambda row: ({'Age': [None, 22]}, None),
+            'same position': lambda row: ({'BP': [fifa['BP'].iat[row]]}, None),
+            'value below median': lambda row: ({'Value in €': [None, value]}, None),
+            'other club': lambda row: ({}, {'Club': [fifa['Club'].iat[row]]}),
+            'all four': lambda row: ({'Age': [None, 22], 'BP': [fifa['BP'].iat[row]], 'Value in €': [None, value]},
+                                     {'Club': [fifa['Club'].iat[row]]}),
+        }
+        for name, constraints in cases.items():
+            masks = [index.mask(*constraints(row)) for row in queries]
+            start = time.perf_counter()
+            for row, (where, exclude) in zip(queries, map(constraints, queries)):
+                engine.query_among(row, np.flatnonzero(index.mask(where, exclude)), k)
+            prefiltered = (time.perf_counter() - start) / n_queries
+            short = 0
+            start = time.perf_counter()
+            for row, mask in zip(queries, masks):
+                found, _ = engine.query(row, oversample * k)
+                short += len(found[mask[found]][:k]) < min(k, int(mask.sum()) - int(mask[row]))
+            postfiltered = (time.perf_counter() - start) / n_queries
+            rows.append(dict(size=size, constraints=name, candidates=int(np.mean([mask.sum() for mask in masks])),
+                             prefiltered_ms=prefiltered * 1000, postfiltered_ms=postfiltered * 1000,
+                             postfiltered_short=short / n_queries))
+    return rows
+
+
+def write_results(path: str, rows):
+    """
+    Writes benchmark rows to a JSON results file, along with the versions they were measured with
+    :param path: Path of the results file
+    :param rows: Rows of figures_benchmark
+    """
+    meta = dict(created=datetime.datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                numpy=np.__version__, pandas=pd.__version__, machine=platform.machine())
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(meta=meta, results=rows), f, indent=1)
+
+
+def read_results(path: str):
+    """
+    Reads the rows of a JSON results file
+    :param path: Path of the results file
+    :return: Rows as written by write_results
+    """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['results']
+
+
+def compare_to_baseline(rows, baseline, thresholds: dict = None):
+    """
+    Compares benchmark rows against the rows of a baseline run, matched by size and step
+    :param rows: Rows of the current run
+    :param baseline: Rows of the baseline run
+    :param thresholds: Relative growth allowed per metric, REGRESSION_THRESHOLDS by default
+    :return: One dict per metric that grew more than its threshold
+    """
+    thresholds = REGRESSION_THRESHOLDS if thresholds is None else thresholds
+    previous = {(row['size'], row['name']): row for row in baseline}
+    regressions = []
+    for row in rows:
+        before = previous.get((row['size'], row['name']))
+        if before is None:
+            continue
+        for metric, threshold in thresholds.items():
+            old, new = before.get(metric), row.get(metric)
+            if old is None or new is None or old <= 0:
+                continue
+            if metric == 'wall_s' and new - old < MIN_WALL_DELTA_S:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append(dict(size=row['size'], name=row['name'], metric=metric, baseline=old,
+                                        current=new, change=f'{new / old - 1:+.1%}'))
+    return regressions
+
+
+def print_table(rows):
+    """
+    Prints benchmark rows as an aligned text table
+    :param rows: List of dicts sharing the same keys
+    """
+    columns = list(rows[0])
+    cells = [[f'{r[c]:.4f}' if isinstance(r[c], float) else str(r[c]) for c in columns] for r in rows]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in cells:
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    ann = subparsers.add_parser('ann', help='recall@k, latency and build time of the approximate index')
+    ann.add_argument('--sizes', type=int, nargs='+', default=[17000, 100000, 500000])
+    ann.add_argument('--k', type=int, default=10)
+    ann.add_argument('--queries', type=int, default=200)
+    aggregation = subparsers.add_parser('aggregation', help='groupby-apply chains against single-pass summaries')
+    aggregation.add_argument('--sizes', type=int, nargs='+', default=[17000, 100000, 500000])
+    payload = subparsers.add_parser('payload', help='JSON, compacted and gzipped size of every figure')
+    payload.add_argument('csv', nargs='?', default='assets/cleaned_fifa21_male2.csv')
+    figures = subparsers.add_parser('figures', help='wall time, peak memory and figure size of every builder')
+    figures.add_argument('--sizes', type=int, nargs='+', default=[17000, 100000, 500000, 1000000])
+    figures.add_argument('--out', help='JSON results file to write')
+    figures.add_argument('--baseline', help='JSON results file to compare against, exits with 1 on a regression')
+    figures.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    for metric, threshold in REGRESSION_THRESHOLDS.items():
+        figures.add_argument(f'--{metric.replace("_", "-")}-threshold', type=float, default=threshold,
+                             dest=f'{metric}_threshold', help=f'allowed relative growth of {metric}')
+    streaming = subparsers.add_parser('streaming', help='peak memory of whole and chunked reads of a roster CSV')
+    streaming.add_argument('--sizes', type=int, nargs='+', default=[100000, 500000])
+    streaming.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    filters = subparsers.add_parser('filters', help='build and query time of the dashboard filter indexes')
+    filters.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    squad = subparsers.add_parser('squad', help='batched squad replacements against one lookup per player')
+    squad.add_argument('--sizes', type=int, nargs='+', default=[17000, 100000, 500000])
+    squad.add_argument('--squad', type=int, default=25)
+    squad.add_argument('--k', type=int, default=3)
+    constrained = subparsers.add_parser('constrained', help='prefiltered against post-filtered constrained searches')
+    constrained.add_argument('--sizes', type=int, nargs='+', default=[17000, 100000, 500000])
+    constrained.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.benchmark == 'ann':
+        print_table(ann_benchmark(args.sizes, k=args.k, n_queries=args.queries))
+    elif args.benchmark == 'aggregation':
+        print_table(aggregation_benchmark(args.sizes))
+    elif args.benchmark == 'payload':
+        print_table(payload_report(args.csv))
+    elif args.benchmark == 'streaming':
+        print_table(streaming_benchmark(args.sizes, args.chunksize))
+    elif args.benchmark == 'filters':
+        print_table(filters_benchmark(args.sizes))
+    elif args.benchmark == 'constrained':
+        print_table(constrained_benchmark(args.sizes, args.k))
+    elif args.benchmark == 'squad':
+        print_table(squad_benchmark(args.sizes, args.squad, args.k))
+    elif args.benchmark == 'figures':
+        results = figures_benchmark(args.sizes, memory=not args.no_memory)
+        print_table(results)
+        if args.out:
+            write_results(args.out, results)
+        if args.baseline:
+            regressions = compare_to_baseline(
+                results, read_results(args.baseline),
+                {metric: getattr(args, f'{metric}_threshold') for metric in REGRESSION_THRESHOLDS})
+            if regressions:
+                print('\nRegressions against', args.baseline)
+                print_table(regressions)
+                sys.exit(1)
+            print('\nNo regressions against', args.baseline)
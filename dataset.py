@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401  (Feather support)
+    CACHE_FORMAT = 'feather'
+except ImportError:
+    CACHE_FORMAT = 'pickle'
+
+# Bumped whenever parsing changes, so older caches are not reused
+LOADER_VERSION = 1
+
+# Numeric columns derived from the unit-bearing string columns of the CSV
+PARSED_COLUMNS = {
+    'Height': 'Ht in cm',
+    'Weight': 'Weight in lb',
+    'Value': 'Value in €',
+    'Wage': 'Wage in €',
+    'Release Clause': 'Release Clause in €',
+}
+
+_MONEY_MULTIPLIERS = {'': 1, 'K': 1e3, 'M': 1e6}
+
+
+def parse_height(height: pd.Series):
+    """
+    Converts heights written as feet and inches (5'11") to centimetres
+    :param height: Series of height strings
+    :return: Series of heights in cm
+    """
+    parts = height.str.extract(r"(\d+)'\s*(\d+)")
+    return (pd.to_numeric(parts[0]) * 12 + pd.to_numeric(parts[1])) * 2.54
+
+
+def parse_weight(weight: pd.Series):
+    """
+    Converts weights written in pounds (159lbs) to numbers
+    :param weight: Series of weight strings
+    :return: Series of weights in lb
+    """
+    return pd.to_numeric(weight.str.extract(r'([\d.]+)')[0])
+
+
+def parse_money(money: pd.Series):
+    """
+    Converts amounts written as €110.5M, €560K or €500 to euros
+    :param money: Series of amount strings
+    :return: Series of amounts in €
+    """
+    parts = money.str.extract(r'([\d.]+)\s*([KM]?)')
+    return pd.to_numeric(parts[0]) * parts[1].fillna('').map(_MONEY_MULTIPLIERS).astype(np.float64)
+
+
+_PARSERS = {
+    'Height': parse_height,
+    'Weight': parse_weight,
+    'Value': parse_money,
+    'Wage': parse_money,
+    'Release Clause': parse_money,
+}
+
+
+def parse_units(fifa: pd.DataFrame):
+    """
+    Adds the numeric columns of PARSED_COLUMNS to the dataframe
+    :param fifa: The dataframe containing the FIFA game data, as read from the CSV
+    :return: The same dataframe with the parsed columns added
+    """
+    for column, parsed in PARSED_COLUMNS.items():
+        if column in fifa.columns:
+            fifa[parsed] = _PARSERS[column](fifa[column].astype(str))
+    return fifa
+
+
+def artifact_stem(path: str):
+    """
+    Returns the prefix of the names of the files derived from a dataset file: its name and a digest of its absolute
+    path, so same-named files in different directories do not share (or remove) each other's derived files
+    :param path: Path of the CSV file
+    :return: Prefix, followed by the fingerprint in the derived file names
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}.{hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+
+
+def fingerprint(path: str):
+    """
+    Returns a key identifying the current content of a dataset file, from its path, size and modification time
+    :param path: Path of the CSV file
+    :return: Hex digest
+    """
+    stat = os.stat(path)
+    key = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{LOADER_VERSION}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_cache(fifa: pd.DataFrame, path: str):
+    tmp = f'{path}.tmp{os.getpid()}'
+    if CACHE_FORMAT == 'feather':
+        fifa.to_feather(tmp)
+    else:
+        fifa.to_pickle(tmp)
+    os.replace(tmp, path)
+
+
+def _read_cache(path: str):
+    if CACHE_FORMAT == 'feather':
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+def load_dataset(path: str, cache_dir: str = '.dataset_cache'):
+    """
+    Loads a roster CSV with its unit-bearing columns parsed. The parsed dataframe is stored in a binary
+    cache keyed by the fingerprint of the CSV, so later loads of an unchanged file skip the CSV parsing.
+    :param path: Path of the CSV file
+    :param cache_dir: Directory of the binary cache, None disables the cache
+    :return: The parsed dataframe
+    """
+    if cache_dir is None:
+        return parse_units(pd.read_csv(path))
+
+    stem = artifact_stem(path)
+    cache_path = os.path.join(cache_dir, f'{stem}-{fingerprint(path)}.{CACHE_FORMAT}')
+    if os.path.exists(cache_path):
+        try:
+            return _read_cache(cache_path)
+        except Exception:
+            os.remove(cache_path)
+
+    fifa = parse_units(pd.read_csv(path))
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(glob.escape(cache_dir), f'{glob.escape(stem)}-*.{CACHE_FORMAT}')):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    _write_cache(fifa, cache_path)
+    return fifa
@@ -0,0 +1,330 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from dataset import fingerprint, load_dataset
+from feature_store import load_engine
+from incremental import RosterUpdater
+from neighbours import load_table, table_path
+from rendering import FigureRegistry
+from snapshot import load_snapshot
+from top_players import CODED_COLUMNS, COLUMNS, top_players_extract
+
+
+def parse_dataset_config(text: str):
+    """
+    Parses a list of datasets of the form 'fifa21=assets/cleaned_fifa21_male2.csv,fifa21w=assets/female.csv'
+    :param text: Comma-separated key=path entries, a bare path is keyed by its file name
+    :return: List of (key, path) pairs
+    """
+    entries = []
+    for entry in text.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key, sep, path = entry.partition('=')
+        if not sep:
+            key, path = os.path.splitext(os.path.basename(entry))[0], entry
+        entries.append((key.strip(), path.strip()))
+    return entries
+
+
+class Dataset:
+    """
+    A roster with everything derived from it: the similarity engine, the section figures and the updater
+    applying its delta files
+    """
+
+    def __init__(self, key: str, path: str, figures: dict, figure_cache=None, delta_dir: str = None,
+                 snapshot_dir: str = None):
+        """
+        Loads the roster from its snapshot (see snapshot.py) or its binary cache (see dataset.load_dataset) and maps
+        its feature store
+        :param key: Key of the dataset
+        :param path: Path of the roster CSV
+        :param figures: Builders of the section figures by graph ID, each taking the roster
+        :param figure_cache: FigureCache the figures are stored in
+        :param delta_dir: Directory of the delta files of this dataset, None when it is not updated
+        :param snapshot_dir: Directory of the startup snapshots, None to always load from the CSV caches
+        """
+        self.key = key
+        self.path = path
+        snapshot = None if snapshot_dir is None else load_snapshot(path, snapshot_dir)
+        self.from_snapshot = snapshot is not None
+        self.fifa = load_dataset(path) if snapshot is None else snapshot['fifa']
+        self.fingerprint = fingerprint(path)
+        engine = load_engine(path, self.fifa, name_index=None if snapshot is None else snapshot['name_index'])
+        if snapshot is not None and snapshot['index_params'] == engine.index_params:
+            engine.indexes.update(snapshot['indexes'])
+        if os.path.exists(table_path(path)):
+            engine.attach_neighbours(*load_table(table_path(path)))
+        self.registry = FigureRegistry(figure_cache, lambda builder: self.updater.fingerprint(builder))
+        for graph_id, builder in figures.items():
+            self.registry.register(graph_id, builder, self.fifa)
+        if snapshot is not None and snapshot['compact'] == getattr(figure_cache, 'compact', None):
+            self.registry.preload(snapshot['figures'])
+        self.updater = RosterUpdater(self.fifa, engine, figure_cache, self.registry, self.fingerprint,
+                                     filters=None if snapshot is None else snapshot['filters'])
+        self.delta_dir = delta_dir
+        if delta_dir is not None:
+            self.updater.poll(delta_dir)
+        self._top_players = OrderedDict()
+        self._top_players_lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        The current version of the roster with its engine, filter indexes and figure fingerprints, see
+        incremental.RosterState. Readers needing more than one of them take the state once, so a delta applied
+        meanwhile is not mixed in.
+        """
+        return self.updater.state
+
+    @property
+    def roster(self):
+        """
+        The roster, including the applied delta files
+        """
+        return self.state.fifa
+
+    @property
+    def engine(self):
+        """
+        Similarity engine of the roster
+        """
+        return self.state.engine
+
+    @property
+    def filters(self):
+        """
+        Filter indexes of the roster, built on first use and again after a roster update
+        """
+        return self.state.filters
+
+    def top_players(self, filters: dict = None, cache_size: int = 32):
+        """
+        Returns the extract the top player charts are re-sliced from in the browser, see
+        top_players.top_players_extract, for the rows passing the filters
+        :param filters: See filters.FilterIndex.normalize
+        :param cache_size: Number of extracts kept
+        :return: The extract, cached per filters and version of the charts
+        """
+        state = self.state
+        index = state.filters
+        key = (index.normalize(filters), state.fingerprint('best_players'), state.fingerprint('highest_potential'))
+        with self._top_players_lock:
+            extract = self._top_players.get(key)
+            if extract is not None:
+                self._top_players.move_to_end(key)
+                return extract
+        with metrics.span('top_players_extract', dataset=self.key):
+            extract = top_players_extract(index.subset(filters, COLUMNS + CODED_COLUMNS))
+        with self._top_players_lock:
+            self._top_players[key] = extract
+            while len(self._top_players) > cache_size:
+                self._top_players.popitem(last=False)
+        return extract
+
+    def similar_players(self, player, k: int = 3, where: dict = None, same=(), not_same=(), exclude: dict = None,
+                        mode: str = 'exact', state=None):
+        """
+        Returns the players most similar to a player amongst those meeting structured constraints. The constraints
+        are resolved to candidate rows with the filter indexes and only the candidates are scored, so k players are
+        returned whenever k of them qualify.
+        :param player: ID of the player, or name (or part of the name)
+        :param k: Number of similar players to return
+        :param where: Filters of the candidates, see filters.FilterIndex.normalize, e.g. {'Age': [None, 22],
+                      'Value in €': [None, 10e6]}
+        :param same: Columns whose value the candidates share with the player, e.g. ['BP']
+        :param not_same: Categorical columns whose value the candidates do not share with the player, e.g. ['Club']
+        :param exclude: Values left out by categorical column, see filters.FilterIndex.mask
+        :param mode: Search mode of unconstrained searches, see similarity.SimilarityEngine.query. Constrained
+                     searches are exact.
+        :param state: Version of the roster to search, see Dataset.state, the current one by default
+        :return: Row indexes and cosine similarities, ordered from the most to the least similar
+        """
+        state = state or self.state
+        engine, index = state.engine, state.filters
+        row = engine.find(player)
+        filters = dict(where or {})
+        exclude = {column: list(values) for column, values in (exclude or {}).items()}
+        for column in same:
+            value = index.fifa[column].iat[row]
+            filters[column] = [value, value] if column in index.ranges else [value]
+        for column in not_same:
+            exclude[column] = exclude.get(column, []) + [index.fifa[column].iat[row]]
+        mask = index.mask(filters, exclude)
+        if mask is None:
+            return engine.query(row, k, mode)
+        with metrics.span('constrained_search', dataset=self.key):
+            return engine.query_among(row, np.flatnonzero(mask), k)
+
+    def poll(self, min_interval: float = 0.0):
+        """
+        Applies the delta files added since the last poll
+        :param min_interval: Seconds since the previous poll below which the directory is not listed again
+        :return: See incremental.RosterUpdater.poll
+        """
+        if self.delta_dir is None:
+            return {}
+        return self.updater.poll(self.delta_dir, min_interval)
+
+    def memory_bytes(self):
+        """
+        Returns an estimate of the memory held by the dataset. Memory-mapped arrays are left out, the page
+        cache holds them and the kernel can drop them.
+        :return: Size in bytes
+        """
+        state = self.state
+        engine = state.engine
+        size = int(state.fifa.memory_usage(deep=True).sum())
+        for array in [engine.matrix, engine.norms, engine.ids, engine.names]:
+            if not isinstance(array, np.memmap):
+                size += array.nbytes
+        if engine.names.dtype == object:
+            size += sum(len(name) + 50 for name in engine.names)
+        return size + engine.name_index.memory_bytes()
+
+
+class DatasetRegistry:
+    """
+    Registered rosters, loaded on first use and kept in a least-recently-used cache bounded by a memory budget.
+    An evicted dataset reloads from its binary cache and feature store, not from the CSV.
+    """
+
+    def __init__(self, figures: dict, figure_cache=None, max_bytes: int = 2 ** 30, delta_dir: str = None,
+                 snapshot_dir: str = None):
+        """
+        :param figures: Builders of the section figures by graph ID, each taking the roster
+        :param figure_cache: FigureCache the figures of every dataset are stored in
+        :param max_bytes: Memory budget of the loaded datasets, the most recently used one is always kept
+        :param delta_dir: Directory holding one directory of delta files per dataset key
+        :param snapshot_dir: Directory of the startup snapshots of the datasets, None to not use them
+        """
+        self.figures = figures
+        self.figure_cache = figure_cache
+        self.max_bytes = max_bytes
+        self.delta_dir = delta_dir
+        self.snapshot_dir = snapshot_dir
+        self.paths = OrderedDict()
+        self.labels = {}
+        self._loaded = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, key: str, path: str, label: str = None):
+        """
+        Registers a roster, it is loaded on first use
+        :param key: Key of the dataset, e.g. 'fifa21'
+        :param path: Path of the roster CSV
+        :param label: Name shown in the dataset selector, the key by default
+        """
+        self.paths[key] = path
+        self.labels[key] = label or key
+        self._load_locks[key] = threading.Lock()
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, key: str):
+        return key in self.paths
+
+    @property
+    def default(self):
+        """
+        Key of the first registered dataset
+        """
+        return next(iter(self.paths))
+
+    def options(self):
+        """
+        Returns the options of the dataset selector
+        :return: List of {'label', 'value'} dicts
+        """
+        return [{'label': self.labels[key], 'value': key} for key in self.paths]
+
+    def loaded(self):
+        """
+        Returns the keys of the loaded datasets, from the least to the most recently used
+        """
+        with self._lock:
+            return list(self._loaded)
+
+    def peek(self, key: str = None):
+        """
+        Returns a dataset if it is in memory, without loading it or marking it as used
+        :param key: Key of the dataset, the default one when not given
+        :return: The Dataset, None when it is not loaded
+        """
+        key = self.default if key is None else key
+        with self._lock:
+            return self._loaded.get(key)
+
+    def get(self, key: str = None):
+        """
+        Returns a dataset, loading it if it is not in memory. Concurrent first requests wait for a single load.
+        :param key: Key of the dataset, the default one when not given
+        :return: The Dataset
+        """
+        key = self.default if key is None else key
+        if key not in self.paths:
+            raise KeyError(key)
+        with self._lock:
+            dataset = self._loaded.get(key)
+            if dataset is not None:
+                self._loaded.move_to_end(key)
+                return dataset
+        with self._load_locks[key]:
+            with self._lock:
+                dataset = self._loaded.get(key)
+            if dataset is None:
+                with metrics.span('dataset_load', dataset=key):
+                    dataset = Dataset(key, self.paths[key], self.figures, self.figure_cache,
+                                      None if self.delta_dir is None else os.path.join(self.delta_dir, key),
+                                      self.snapshot_dir)
+                size = dataset.memory_bytes()
+                with self._lock:
+                    self._loaded[key] = dataset
+                    self._sizes[key] = size
+                    self.loads += 1
+                    self._evict()
+        return dataset
+
+    def poll(self, min_interval: float = 0.0):
+        """
+        Applies the delta files added since the last poll to the loaded datasets, without marking them as used.
+        The memory of the datasets that changed is measured again, a grown dataset may evict others.
+        :param min_interval: Seconds since the previous poll below which a directory is not listed again
+        """
+        with self._lock:
+            loaded = list(self._loaded.items())
+        for key, dataset in loaded:
+            results = dataset.poll(min_interval)
+            if not any('error' not in result for result in results.values()):
+                continue
+            size = dataset.memory_bytes()
+            with self._lock:
+                if self._loaded.get(key) is dataset:
+                    self._sizes[key] = size
+                    self._evict()
+
+    def _evict(self):
+        while len(self._loaded) > 1 and sum(self._sizes.values()) > self.max_bytes:
+            key, _ = self._loaded.popitem(last=False)
+            del self._sizes[key]
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Returns the load and eviction counters and the memory held by the loaded datasets
+        :return: Dict of counters
+        """
+        with self._lock:
+            return {'loads': self.loads, 'evictions': self.evictions, 'loaded': len(self._loaded),
+                    'memory_bytes': sum(self._sizes.values())}
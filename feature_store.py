@@ -0,0 +1,135 @@
+"""
+On-disk store of the similarity features of a roster, opened memory-mapped so every worker and batch job
+maps the same physical pages without deserializing anything.
+
+A store is a directory of .npy files plus a header.json written last. The header carries the store version
+and the fingerprint of the source CSV, a store with a missing or different header is stale and rebuilt.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+from dataset import artifact_stem, fingerprint, load_dataset
+from similarity import SimilarityEngine
+
+# Bumped whenever the layout of the store changes
+STORE_VERSION = 1
+
+_ARRAYS = ['matrix', 'norms', 'ids', 'names', 'rank', 'minmax']
+
+
+def store_path(csv_path: str, root: str = '.feature_store'):
+    """
+    Returns the directory of the feature store of a roster
+    :param csv_path: Path of the roster CSV
+    :param root: Directory holding the feature stores
+    :return: Path of the store directory
+    """
+    return os.path.join(root, f'{artifact_stem(csv_path)}-{fingerprint(csv_path)}')
+
+
+def write_store(path: str, engine: SimilarityEngine, source_fingerprint: str):
+    """
+    Writes the arrays of a similarity engine to a feature store
+    :param path: Store directory
+    :param engine: Engine built from the roster
+    :param source_fingerprint: Fingerprint of the roster CSV
+    """
+    tmp = f'{path}.tmp{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'matrix.npy'), np.ascontiguousarray(engine.matrix, dtype=np.float32))
+    np.save(os.path.join(tmp, 'norms.npy'), np.asarray(engine.norms, dtype=np.float32))
+    np.save(os.path.join(tmp, 'ids.npy'), np.asarray(engine.ids, dtype=np.int64))
+    np.save(os.path.join(tmp, 'names.npy'), np.asarray(engine.names, dtype=str))
+    rank = engine.rank if engine.rank is not None else np.zeros(len(engine))
+    np.save(os.path.join(tmp, 'rank.npy'), np.asarray(rank, dtype=np.float32))
+    np.save(os.path.join(tmp, 'minmax.npy'), np.stack([engine.col_min, engine.col_max]).astype(np.float64))
+    header = {
+        'version': STORE_VERSION,
+        'source_fingerprint': source_fingerprint,
+        'n_rows': len(engine),
+        'feature_names': engine.feature_names,
+    }
+    with open(os.path.join(tmp, 'header.json'), 'w', encoding='utf-8') as f:
+        json.dump(header, f, indent=2)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+
+
+def open_store(path: str, source_fingerprint: str = None):
+    """
+    Opens a feature store with its arrays memory-mapped read-only
+    :param path: Store directory
+    :param source_fingerprint: Expected fingerprint of the roster CSV, not checked when None
+    :return: Dict of the header and arrays, or None when the store is missing or stale
+    """
+    try:
+        with open(os.path.join(path, 'header.json'), encoding='utf-8') as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if header.get('version') != STORE_VERSION:
+        return None
+    if source_fingerprint is not None and header.get('source_fingerprint') != source_fingerprint:
+        return None
+    store = {'header': header}
+    try:
+        for name in _ARRAYS:
+            store[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if store['matrix'].shape[0] != header['n_rows']:
+        return None
+    return store
+
+
+def engine_from_store(store: dict, name_index=None, **index_params):
+    """
+    Creates a similarity engine over the memory-mapped arrays of a store
+    :param store: Store returned by open_store
+    :param name_index: Name index of the players, built from the store's names when not given
+    :param index_params: Keyword arguments passed to the approximate index when it is built
+    :return: The engine
+    """
+    return SimilarityEngine.from_arrays(
+        matrix=store['matrix'],
+        norms=store['norms'],
+        feature_names=store['header']['feature_names'],
+        names=store['names'],
+        ids=store['ids'],
+        rank=store['rank'],
+        col_min=store['minmax'][0],
+        col_max=store['minmax'][1],
+        name_index=name_index,
+        **index_params,
+    )
+
+
+def load_engine(csv_path: str, fifa=None, root: str = '.feature_store', name_index=None, **index_params):
+    """
+    Returns the similarity engine of a roster backed by its feature store, (re)building the store when it is
+    missing or stale
+    :param csv_path: Path of the roster CSV
+    :param fifa: The roster already loaded from csv_path, loaded when needed if not given
+    :param root: Directory holding the feature stores
+    :param name_index: Name index of the players, e.g. from a startup snapshot, built when not given
+    :param index_params: Keyword arguments passed to the approximate index when it is built
+    :return: The engine
+    """
+    source_fingerprint = fingerprint(csv_path)
+    path = store_path(csv_path, root)
+    store = open_store(path, source_fingerprint)
+    if store is None:
+        if fifa is None:
+            fifa = load_dataset(csv_path)
+        os.makedirs(root, exist_ok=True)
+        stem = artifact_stem(csv_path)
+        for stale in os.listdir(root):
+            if stale.rsplit('-', 1)[0] == stem and '.tmp' not in stale:
+                shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+        write_store(path, SimilarityEngine(fifa), source_fingerprint)
+        store = open_store(path, source_fingerprint)
+    return engine_from_store(store, name_index, **index_params)
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from metrics import span
+from payload import compact_figure
+
+
+class FigureCache:
+    """
+    Cache of serialized Plotly figures keyed by builder name, builder parameters and dataset fingerprint.
+    Figures are kept as JSON in a bounded in-memory LRU backed by an on-disk store, so warm entries survive
+    restarts and are shared by every worker process using the same directory. The on-disk store is bounded in bytes
+    with least-recently-used eviction, which also prunes the figures of superseded fingerprints.
+    """
+
+    def __init__(self, cache_dir: str = '.figure_cache', max_memory_items: int = 256, compact: bool = False,
+                 max_disk_bytes: int = 512 * 2 ** 20):
+        """
+        :param cache_dir: Directory of the on-disk store, None keeps figures in memory only
+        :param max_memory_items: Number of figures kept in memory
+        :param compact: Whether figures are stored compacted with payload.compact_figure
+        :param max_disk_bytes: Size of the on-disk store above which the least recently used figures are evicted
+        """
+        self.cache_dir = cache_dir
+        self.compact = compact
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_entries())
+
+    def key(self, builder: str, params: dict, fingerprint: str):
+        """
+        Returns the cache key of a figure
+        :param builder: Name of the figure builder
+        :param params: Parameters of the builder besides the dataset
+        :param fingerprint: Fingerprint of the dataset the figure is built from
+        :return: Key of the form '<builder>/<fingerprint digest>/<hex digest>'
+        """
+        payload = json.dumps([builder, params, fingerprint, self.compact], sort_keys=True, default=str)
+        return f"{builder}/{self._tag(fingerprint)}/{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def _tag(fingerprint: str):
+        # Groups the keys of one dataset version, so they can be dropped together
+        return hashlib.sha256(str(fingerprint).encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, *key.split('/')) + '.json'
+
+    def _disk_entries(self):
+        for directory, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(directory, name)
+
+    def _remember(self, key: str, figure_json: str):
+        with self._lock:
+            self._memory[key] = figure_json
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the JSON of a cached figure, or None on a miss
+        :param key: Cache key from FigureCache.key
+        :return: Figure JSON or None
+        """
+        with self._lock:
+            figure_json = self._memory.get(key)
+            if figure_json is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return figure_json
+        if self.cache_dir is not None:
+            try:
+                with open(self._path(key), encoding='utf-8') as f:
+                    figure_json = f.read()
+                try:
+                    os.utime(self._path(key))
+                except OSError:
+                    pass
+            except OSError:
+                figure_json = None
+            if figure_json is not None:
+                self._remember(key, figure_json)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return figure_json
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, figure_json: str):
+        """
+        Stores the JSON of a figure in memory and on disk
+        :param key: Cache key from FigureCache.key
+        :param figure_json: Serialized figure
+        """
+        self._remember(key, figure_json)
+        if self.cache_dir is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(figure_json)
+            size = os.path.getsize(tmp)
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp, path)
+            with self._lock:
+                self._disk_bytes += size
+                evict = self._disk_bytes > self.max_disk_bytes
+            if evict:
+                self._evict()
+
+    def _evict(self):
+        # Least recently used first, disk hits touch the files. Other workers write to the same directory, so the
+        # size is measured again rather than trusted.
+        entries = []
+        for path in self._disk_entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            # The directory of a superseded fingerprint goes with its last figure
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+
+    def invalidate(self, builder: str = None, fingerprint: str = None):
+        """
+        Drops the cached figures, or only those of one builder when a name is given. With a fingerprint, only the
+        in-memory figures of that version are dropped: its figures on disk are shared with the other workers and
+        datasets, and are pruned by the size budget once no longer used.
+        :param builder: Name of the figure builder
+        :param fingerprint: Fingerprint of the superseded version of the dataset
+        """
+        prefix = '' if builder is None else f'{builder}/'
+        if fingerprint is not None:
+            prefix += f'{self._tag(fingerprint)}/'
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(prefix)]:
+                del self._memory[key]
+        if self.cache_dir is not None and fingerprint is None:
+            target = self.cache_dir if builder is None else os.path.join(self.cache_dir, builder)
+            shutil.rmtree(target, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with self._lock:
+                self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_entries())
+
+    def figure(self, builder: str, params: dict, fingerprint: str, build):
+        """
+        Returns a figure from the cache, building and storing it on a miss
+        :param builder: Name of the figure builder
+        :param params: Parameters of the builder besides the dataset
+        :param fingerprint: Fingerprint of the dataset the figure is built from
+        :param build: Function without arguments returning the Plotly figure
+        :return: The figure as a dict, ready to be returned by a Dash callback
+        """
+        key = self.key(builder, params, fingerprint)
+        figure_json = self.get(key)
+        if figure_json is None:
+            with span('build', figure=builder):
+                fig = build()
+            with span('serialize', figure=builder):
+                figure_json = fig.to_json()
+                if self.compact:
+                    figure_json = json.dumps(compact_figure(json.loads(figure_json)), separators=(',', ':'),
+                                             ensure_ascii=False)
+            # Figures flagged as incomplete (e.g. with placeholder photos) are served but not stored
+            if not (fig.layout.meta or {}).get('incomplete'):
+                self.put(key, figure_json)
+        return json.loads(figure_json)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters
+        :return: Dict of counters
+        """
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'memory_items': len(self._memory), 'disk_bytes': self._disk_bytes}
@@ -1,10 +1,15 @@
 import pandas as pd
-import numpy as np
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
-import plotly.express as px
-import urllib.request
-from PIL import Image
+import plotly.graph_objects as go
+from aggregates import POSITION_ATTRIBUTES, group_summary, top_groups
+from lod import lod_scatter
+from photos import PhotoService, default_photo_service, photo_url
+from similarity import SimilarityEngine
+
+# plotly.express is imported by the builders on first use: it takes a tenth of a second to import, and a process
+# serving cached or snapshotted figures never needs it
+
+# Corners of the similar players radar plot the four photos are drawn in
+PHOTO_POSITIONS = [(0.1, 0.0), (0.1, 0.8), (0.9, 0.0), (0.9, 0.8)]
 
 
 def nation_wise_participation(fifa: pd.DataFrame):
@@ -13,9 +18,9 @@ def nation_wise_participation(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A bar plot of the top 20 nations with the highest number of players in the FIFA game.
     """
-    nat_cnt = fifa.groupby('Nationality').apply(lambda x: x['Name'].count()).reset_index(name='Counts')
-    nat_cnt.sort_values(by='Counts', ascending=False, inplace=True)
-    top_20_nat_cnt = nat_cnt[:20]
+    import plotly.express as px
+
+    top_20_nat_cnt = top_groups(fifa, 'Nationality', 20)
     fig = px.bar(top_20_nat_cnt, x='Nationality', y='Counts', color='Counts',
                  title='Nation-wise Distribution of Players in FIFA for Top 20 Nations')
     return fig
@@ -27,9 +32,10 @@ def nation_over_performing_players(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A scatter plot of the Nationwise Player counts and Average Potential
     """
-    cnt_best_avg = fifa.groupby('Nationality').apply(lambda x: np.average(x['OVA'])).reset_index(name='Overall Ratings')
-    cnt_best_cnt = fifa.groupby('Nationality').apply(lambda x: x['OVA'].count()).reset_index(name='Player Counts')
-    snt_best_avg_cnt = pd.merge(cnt_best_avg, cnt_best_cnt, how='inner', left_on='Nationality', right_on='Nationality')
+    import plotly.express as px
+
+    snt_best_avg_cnt = group_summary(fifa, 'Nationality').rename(
+        columns={'OVA': 'Overall Ratings', 'Counts': 'Player Counts'})
     sel_best_avg_cnt = snt_best_avg_cnt[snt_best_avg_cnt['Player Counts'] >= 200]
     sel_best_avg_cnt.sort_values(by=['Overall Ratings', 'Player Counts'], ascending=[False, False])
     fig = px.scatter(sel_best_avg_cnt, x='Overall Ratings', y='Player Counts', color='Player Counts',
@@ -44,9 +50,9 @@ def club_wise_player(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A scatter plot of the Clubwise Player counts in FIFA 21
     """
-    clb_cnt = fifa.groupby('Club').apply(lambda x: x['Name'].count()).reset_index(name='Counts')
-    clb_cnt.sort_values(by='Counts', ascending=False, inplace=True)
-    top_20_clb_cnt = clb_cnt[:20]
+    import plotly.express as px
+
+    top_20_clb_cnt = top_groups(fifa, 'Club', 20)
     fig = px.bar(top_20_clb_cnt, x='Club', y='Counts', color='Counts',
                  title='Club-wise Distribution of Players in FIFA for Top 20 Clubs')
     return fig
@@ -58,9 +64,10 @@ def club_wise_over_performing_players(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A scatter plot of the Clubwise Player counts and Average Potential
     """
-    cnt_best_avg = fifa.groupby('Club').apply(lambda x: np.average(x['OVA'])).reset_index(name='Overall Ratings')
-    cnt_best_cnt = fifa.groupby('Club').apply(lambda x: x['OVA'].count()).reset_index(name='Player Counts')
-    snt_best_avg_cnt = pd.merge(cnt_best_avg, cnt_best_cnt, how='inner', left_on='Club', right_on='Club')
+    import plotly.express as px
+
+    snt_best_avg_cnt = group_summary(fifa, 'Club').rename(
+        columns={'OVA': 'Overall Ratings', 'Counts': 'Player Counts'})
     sel_best_avg_cnt = snt_best_avg_cnt[snt_best_avg_cnt['Player Counts'] >= 25]
     sel_best_avg_cnt.sort_values(by=['Overall Ratings', 'Player Counts'], ascending=[False, False])
     fig = px.scatter(sel_best_avg_cnt, x='Overall Ratings', y='Player Counts', color='Player Counts',
@@ -71,20 +78,19 @@ def club_wise_over_performing_players(fifa: pd.DataFrame):
 
 ## player stats
 
-def height_vs_weight_variation(fifa: pd.DataFrame):
+def height_vs_weight_variation(fifa: pd.DataFrame, x_range=None, y_range=None):
     """
     This function returns a scatter plot of the Height vs Weight Variation of the players in the FIFA game.
-    :param fifa: The dataframe containing the FIFA game data
+    Zoomed-out views with many players are drawn as a density, see lod.lod_scatter.
+    :param fifa: The dataframe containing the FIFA game data, with the parsed columns of dataset.load_dataset
+    :param x_range: Weight range in view, None for all players
+    :param y_range: Height range in view, None for all players
     :return: A scatter plot of the Height vs Weight Variation of the players in the FIFA game.
     """
-    props = fifa[['Name', 'Nationality', 'Club', 'Height', 'Weight']]
-    props['Ht in ft'] = pd.to_numeric(props['Height'].str[0])
-    props['Ht in in'] = pd.to_numeric(props['Height'].str.split("\'").str[1].str.strip('"'))
-    props['Ht in cm'] = (props['Ht in ft'] * 12 + props['Ht in in']) * 2.54
-    props['Weight in lb'] = pd.to_numeric(props['Weight'].str.strip('lbs'))
-    fig = px.scatter(props, x='Weight in lb', y='Ht in cm', color='Ht in cm', size='Weight in lb',
-                     hover_data=['Name', 'Nationality', 'Club'],
-                     title='Overall Height vs Weight Variation of the players in FIFA 21')
+    fig = lod_scatter(fifa, x='Weight in lb', y='Ht in cm', color='Ht in cm', size='Weight in lb',
+                      hover_data=['Name', 'Nationality', 'Club'],
+                      title='Overall Height vs Weight Variation of the players in FIFA 21',
+                      x_range=x_range, y_range=y_range)
     return fig
 
 
@@ -94,9 +100,9 @@ def players_position(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A bar plot of the top 20 positions with the highest number of players in the FIFA game.
     """
-    pos_cnt = fifa.groupby('BP').apply(lambda x: x['Name'].count()).reset_index(name='Counts')
-    pos_cnt.sort_values(by='Counts', ascending=False, inplace=True)
-    top_20_pos_cnt = pos_cnt[:20]
+    import plotly.express as px
+
+    top_20_pos_cnt = top_groups(fifa, 'BP', 20)
     fig = px.bar(top_20_pos_cnt, x='BP', y='Counts', color='Counts', title='Top 20 Position-wise Player counts in FIFA')
     return fig
 
@@ -107,33 +113,26 @@ def age_distribution(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A histogram of the Age distribution of the players in the FIFA game.
     """
-    age_cnt = fifa.groupby('Age').apply(lambda x: x['Name'].count()).reset_index(name='Counts')
+    import plotly.express as px
+
+    age_cnt = group_summary(fifa, 'Age')
     fig = px.bar(age_cnt, x='Age', y='Counts', color='Counts', title='Agewise Player distribution in FIFA')
     return fig
 
 
-def distibution_of_market_value_and_wage(fifa: pd.DataFrame):
+def distibution_of_market_value_and_wage(fifa: pd.DataFrame, x_range=None, y_range=None):
     """
     This function returns a scatter plot of the Market Value and Wage distribution of the players in the FIFA game.
-    :param fifa: The dataframe containing the FIFA game data
+    Zoomed-out views with many players are drawn as a density, see lod.lod_scatter.
+    :param fifa: The dataframe containing the FIFA game data, with the parsed columns of dataset.load_dataset
+    :param x_range: Value range in view, None for all players
+    :param y_range: Wage range in view, None for all players
     :return: A scatter plot of the Market Value and Wage distribution of the players in the FIFA game.
     """
-    cost_prop = fifa[['Name', 'Club', 'Nationality', 'Wage', 'Value', 'BP']]
-    cost_prop['MultW'] = np.where(cost_prop.Wage.str[-1] == 'K', 1000, 1)
-    cost_prop['Wage'] = cost_prop.Wage.str.strip('K')
-    cost_prop['Wage'] = cost_prop.Wage.str.strip('€')
-    cost_prop['Wage'] = pd.to_numeric(cost_prop['Wage'])
-    cost_prop['Wage in €'] = cost_prop['Wage'] * cost_prop['MultW']
-    cost_prop['MultV'] = np.where(cost_prop.Value.str[-1] == 'K', 1000,
-                                  np.where(cost_prop.Value.str[-1] == 'M', 1000000, 1))
-    cost_prop['Value'] = cost_prop.Value.str.strip('€')
-    cost_prop['Value'] = cost_prop.Value.str.strip('K')
-    cost_prop['Value'] = cost_prop.Value.str.strip('M')
-    cost_prop['Value'] = pd.to_numeric(cost_prop['Value'])
-    cost_prop['Value in €'] = cost_prop['Value'] * cost_prop['MultV']
-    fig = px.scatter(cost_prop, x='Value in €', y='Wage in €', color='Value in €', size='Wage in €',
-                     hover_data=['Name', 'Club', 'Nationality', 'BP'],
-                     title='Value vs Wage Presentation of all the Players')
+    fig = lod_scatter(fifa, x='Value in €', y='Wage in €', color='Value in €', size='Wage in €',
+                      hover_data=['Name', 'Club', 'Nationality', 'BP'],
+                      title='Value vs Wage Presentation of all the Players',
+                      x_range=x_range, y_range=y_range)
     return fig
 
 
@@ -143,9 +142,10 @@ def best_players(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A scatter plot of the top 100 players in the FIFA game.
     """
-    top_play = fifa[['Name', 'OVA', "Age", 'Club', 'BP']]
-    top_play.sort_values(by='OVA', ascending=False, inplace=True)
-    top_30_play = top_play[:100]
+    import plotly.express as px
+
+    # Ties are kept in roster order, so streaming.stream_roster picks the same players
+    top_30_play = fifa[['Name', 'OVA', "Age", 'Club', 'BP']].nlargest(100, 'OVA')
     fig = px.scatter(top_30_play, x='Age', y='OVA', color='Age', size='OVA', hover_data=['Name', 'Club', 'BP'],
                      title='Top Football Players in the FIFA 21')
     return fig
@@ -157,12 +157,13 @@ def highest_potential(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A scatter plot of the top 50 players with the highest potential in the FIFA game.
     """
+    import plotly.express as px
+
     cond_1 = fifa['OVA'] != fifa['POT']
     cond_2 = fifa['Age'] < 25
     fifa_fil = fifa[cond_1 & cond_2]
     pot_play = fifa_fil[['Name', 'Age', 'Nationality', 'Club', 'POT', 'BP', 'OVA', 'Value', 'Release Clause']]
-    pot_play.sort_values(by='POT', ascending=False, inplace=True)
-    top_pot_play = pot_play[:50]
+    top_pot_play = pot_play.nlargest(50, 'POT')
     fig = px.scatter(top_pot_play, x='Age', y='POT', size='POT', color='Age',
                      hover_data=['Name', 'Age', 'Nationality', 'BP', 'OVA', 'Value', 'Release Clause'],
                      title='Age vs Maximum Potential Distribution of the young Players')
@@ -175,27 +176,9 @@ def overall_attributes(fifa: pd.DataFrame):
     :param fifa: The dataframe containing the FIFA game data
     :return: A radar plot of the overall attributes of the players in the FIFA game.
     """
-    pos_head = fifa.groupby('BP').apply(lambda x: np.average(x['Heading Accuracy'])).reset_index(
-        name='Heading Accuracy')
-    pos_sp = fifa.groupby('BP').apply(lambda x: np.average(x['Short Passing'])).reset_index(name='Short Passing')
-    pos_d = fifa.groupby('BP').apply(lambda x: np.average(x['Dribbling'])).reset_index(name='Dribbling')
-    pos_c = fifa.groupby('BP').apply(lambda x: np.average(x['Curve'])).reset_index(name='Curve')
-    pos_fk = fifa.groupby('BP').apply(lambda x: np.average(x['FK Accuracy'])).reset_index(name='FK Accuracy')
-    pos_lp = fifa.groupby('BP').apply(lambda x: np.average(x['Long Passing'])).reset_index(name='Long Passing')
-    pos_bc = fifa.groupby('BP').apply(lambda x: np.average(x['Ball Control'])).reset_index(name='Ball Control')
-    pos_ss = fifa.groupby('BP').apply(lambda x: np.average(x['Sprint Speed'])).reset_index(name='Sprint Speed')
-    pos_spo = fifa.groupby('BP').apply(lambda x: np.average(x['Shot Power'])).reset_index(name='Shot Power')
-    pos_jm = fifa.groupby('BP').apply(lambda x: np.average(x['Jumping'])).reset_index(name='Jumping')
-
-    pos_overall1 = pd.merge(pos_head, pos_sp, how='inner', left_on='BP', right_on='BP')
-    pos_overall2 = pd.merge(pos_d, pos_c, how='inner', left_on='BP', right_on='BP')
-    pos_overall3 = pd.merge(pos_fk, pos_lp, how='inner', left_on='BP', right_on='BP')
-    pos_overall4 = pd.merge(pos_bc, pos_ss, how='inner', left_on='BP', right_on='BP')
-    pos_overall5 = pd.merge(pos_spo, pos_jm, how='inner', left_on='BP', right_on='BP')
-    pos_overall11 = pd.merge(pos_overall1, pos_overall2, how='inner', left_on='BP', right_on='BP')
-    pos_overall22 = pd.merge(pos_overall3, pos_overall4, how='inner', left_on='BP', right_on='BP')
-    pos_overall12 = pd.merge(pos_overall11, pos_overall22, how='inner', left_on='BP', right_on='BP')
-    pos_overall = pd.merge(pos_overall12, pos_overall5, how='inner', left_on='BP', right_on='BP')
+    import plotly.express as px
+
+    pos_overall = group_summary(fifa, 'BP')[['BP'] + POSITION_ATTRIBUTES]
 
     pos_overall_long = pos_overall.melt(id_vars=['BP'], var_name='Attribute', value_name='Value')
 
@@ -222,36 +205,47 @@ def overall_attributes(fifa: pd.DataFrame):
     return fig
 
 
-def get_similar_players(fifa: pd.DataFrame, player_name: str):
-    normalized_data = fifa
-    normalized_data = normalized_data.drop(columns=['Age', 'Nationality', 'Club', 'Value',
-            'Wage', 'Joined','Release Clause','Height', 'Weight', 'Name','Goalkeeping', 'GK Diving', 'GK Handling',
-            'GK Kicking', 'GK Positioning', 'GK Reflexes','Player Photo','Club Logo','Flag Photo','ID', 'OVA', 'BOV',
-            'BP', 'Position','POT', 'Team & Contract', 'foot', 'Growth', 'Loan Date End', 'Contract','W/F', 'SM', 'A/W',
-            'D/W', 'IR', 'PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY', 'Hits', 'LS','ST', 'RS', 'LW', 'LF', 'CF', 'RF', 'RW',
-            'LAM', 'CAM', 'RAM', 'LM','LCM', 'CM', 'RCM', 'RM', 'LWB', 'LDM', 'CDM', 'RDM', 'RWB', 'LB',
-            'LCB', 'CB', 'RCB', 'RB', 'GK', 'Gender','Total Stats', 'Base Stats','Vision'
-            ],axis=1)
-    scaler = MinMaxScaler()
-    scaled_values = scaler.fit_transform(normalized_data)
-    normalized_data.loc[:,:] = scaled_values
-    normalized_data['Name'] = fifa['Name']
-    col_name = "Name"
-    first_col = normalized_data.pop(col_name)
-    normalized_data.insert(0, col_name, first_col)
-    player_index = [list(normalized_data['Name']).index(x) for x in list(normalized_data['Name']) if player_name in x]
-    player_index = int(player_index[0])
-    df = normalized_data.iloc[:,1:]
-    cos = cosine_similarity(df, df)
-    player_cos = sorted(list(cos[player_index]))[-4:-1]
-    indexes = [list(cos[player_index]).index(x) for x in player_cos]
-    indexes.append(player_index)
-    nor_data= normalized_data.iloc[indexes].melt(id_vars=['Name'], var_name='Attribute', value_name='Value')
-    images = []
-    for img in fifa.iloc[indexes]['Player Photo'].values:
-        img = img.split('/')
-        img[2] = 'cdn.sofifa.net'
-        images.append('/'.join(img))
+def player_photo_images(sources):
+    """
+    Returns the player photos of the similar players radar plot as layout images
+    :param sources: PIL images or URLs of the photos, in the order of PHOTO_POSITIONS
+    :return: List of layout image dicts
+    """
+    fig = go.Figure()
+    for (x, y), source in zip(PHOTO_POSITIONS, sources):
+        fig.add_layout_image(dict(source=source, x=x, y=y, xref="paper", yref="paper", sizex=0.3, sizey=0.3,
+                                  xanchor="right", yanchor="bottom"))
+    return [image.to_plotly_json() for image in fig.layout.images]
+
+
+def get_similar_players(fifa: pd.DataFrame, player, engine: SimilarityEngine = None, mode: str = 'exact',
+                        photos: PhotoService = None, photo_source=None, similar=None):
+    """
+    This function returns a radar plot of a player and the three most similar players in the FIFA game.
+    :param fifa: The dataframe containing the FIFA game data
+    :param player: ID of the player to find similar players for, or their name
+    :param engine: Similarity engine built from the same dataframe, built on the fly when not given
+    :param mode: Search mode of the engine, 'exact' or 'approximate'
+    :param photos: Photo service the player photos are fetched with, a default one is used when not given
+    :param photo_source: Function taking a player ID and the photo URL and returning the URL the figure loads the
+                         photo from (e.g. a thumbnail route, see photos.install). When not given the photos are fetched
+                         and inlined in the figure.
+    :param similar: Rows of the similar players to draw, e.g. from a constrained search (see
+                    datasets.Dataset.similar_players), the three most similar players are searched when not given
+    :return: A radar plot of the player and the three most similar players in the FIFA game.
+    """
+    import plotly.express as px
+
+    if engine is None:
+        engine = SimilarityEngine(fifa)
+    player_index = engine.find(player)
+    if similar is None:
+        similar, _ = engine.query(player_index, k=3, mode=mode)
+    indexes = list(similar[::-1]) + [player_index]
+    nor_data = pd.DataFrame(engine.scaled_rows(indexes), columns=engine.feature_names)
+    nor_data.insert(0, 'Name', engine.names[indexes])
+    nor_data = nor_data.melt(id_vars=['Name'], var_name='Attribute', value_name='Value')
+    images = [photo_url(img) for img in fifa.iloc[indexes]['Player Photo'].values]
     fig = px.line_polar(
             nor_data,
             color='Name',
@@ -261,29 +255,46 @@ def get_similar_players(fifa: pd.DataFrame, player_name: str):
 
             line_close=True,
         )
-    x_intercept = [0.1,0.1,0.9,0.9]
-    y_intercept = [0.0,0.8,0.0,0.8]
-    for i in range(4):
-        url = images[i]
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'}
-        req = urllib.request.Request(url, headers=headers)
-        response = urllib.request.urlopen(req)
-        with open('1.png', 'wb') as f:
-            f.write(response.read())
-
-        pic = Image.open("1.png")
-        fig.add_layout_image(
-            dict(
-                source=pic,
-                x=x_intercept[i],
-                y=y_intercept[i],
-            ))
-    fig.update_layout_images(dict(
-        xref="paper",
-        yref="paper",
-        sizex=0.3,
-        sizey=0.3,
-        xanchor="right",
-        yanchor="bottom"
+    if photo_source is not None:
+        fig.update_layout(images=player_photo_images(
+            [photo_source(player_id, url) for player_id, url in zip(engine.ids[indexes], images)]))
+    else:
+        pictures = (photos or default_photo_service()).fetch_all(images)
+        fig.update_layout(images=player_photo_images(pictures),
+                          meta={'incomplete': any(pic.info.get('placeholder') for pic in pictures)})
+    return fig
+
+
+def _euros(values: pd.Series):
+    # Amounts in € written like the roster's Value and Wage columns
+    return [('' if pd.isna(value) else f'€{value / 1e6:.1f}M' if value >= 1e6 else f'€{value / 1e3:.0f}K')
+            for value in values]
+
+
+def squad_replacements(replacements: pd.DataFrame):
+    """
+    This function returns a table of the replacements found for every player of a squad.
+    :param replacements: Replacements as returned by squad.find_replacements
+    :return: A table with one row per squad player and replacement, the squad players in the order they were given.
+    """
+    fig = go.Figure(go.Table(
+        header=dict(values=['Player', 'Budget', '#', 'Replacement', 'Club', 'Position', 'Age', 'OVA', 'Value',
+                            'Wage', 'Similarity'],
+                    fill_color='#E8EAF6', align='left'),
+        cells=dict(values=[
+            replacements['Player'].where(replacements['Rank'] == 1, ''),
+            _euros(replacements['Budget'].where(replacements['Rank'] == 1)),
+            replacements['Rank'],
+            replacements['Name'],
+            replacements['Club'],
+            replacements['BP'],
+            replacements['Age'],
+            replacements['OVA'],
+            _euros(replacements['Value in €']),
+            _euros(replacements['Wage in €']),
+            replacements['Similarity'].round(3),
+        ], align='left'),
     ))
+    fig.update_layout(title='Squad Replacements', margin=dict(l=10, r=10, t=50, b=10),
+                      height=max(300, 60 + 24 * len(replacements)))
     return fig
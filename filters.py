@@ -0,0 +1,326 @@
+"""
+Global dashboard filters on club, nationality, position, age and overall rating, backed by indexes built once per
+roster: posting lists of the rows of every value of the categorical columns and sorted orders of the numeric ones.
+A filter change combines the masks of the active filters with bitwise ands and recomputes the figure summaries from
+the masked arrays, without scanning the roster's string columns. The same masks, with the Value and Wage ranges and
+excluded values, resolve the candidates of constrained similar player searches (see datasets.Dataset.similar_players).
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import lod
+from aggregates import MEAN_COLUMNS
+from streaming import SCATTERS, TOP_ROWS
+
+# Filters on the values of a column, given as a list of selected values
+CATEGORICAL_FILTERS = ['Club', 'Nationality', 'BP']
+
+# Filters on a column range, given as [min, max] with None for an open end
+RANGE_FILTERS = ['Age', 'OVA', 'Value in €', 'Wage in €']
+
+
+def _first_masked(order: np.ndarray, mask: np.ndarray, n: int):
+    # The first n rows of an order passing a mask, looked up in growing blocks rather than masking the whole order
+    found = []
+    start, block, count = 0, max(4 * n, 1024), 0
+    while start < len(order) and count < n:
+        rows = order[start:start + block]
+        rows = rows[mask[rows]]
+        found.append(rows)
+        count += len(rows)
+        start += block
+        block *= 4
+    return np.concatenate(found)[:n] if found else order[:0]
+
+
+class CategoricalIndex:
+    """
+    Dictionary codes of a column with, for every value, the sorted rows holding it: the compressed form of one
+    bitmap per value
+    """
+
+    def __init__(self, values: pd.Series):
+        """
+        :param values: Column of the roster
+        """
+        codes, self.values = pd.factorize(values, sort=True)
+        # Missing values get the code after the last value, so counting needs no validity mask
+        self.codes = np.where(codes < 0, len(self.values), codes).astype(np.int32)
+        order = np.argsort(self.codes, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.codes, minlength=len(self.values) + 1))])
+        self.rows = order[:self.offsets[-2]]
+        self._positions = {value: i for i, value in enumerate(self.values)}
+
+    def mask(self, selected, n_rows: int):
+        """
+        Returns the mask of the rows holding one of the selected values
+        :param selected: Values to keep
+        :param n_rows: Number of rows of the roster
+        :return: Boolean array
+        """
+        positions = np.array([self._positions[value] for value in selected if value in self._positions], dtype=np.intp)
+        if (self.offsets[positions + 1] - self.offsets[positions]).sum() > n_rows // 16:
+            # Selections covering much of the roster gather a lookup table with the codes instead
+            selected_codes = np.zeros(len(self.values) + 1, dtype=bool)
+            selected_codes[positions] = True
+            return selected_codes.take(self.codes)
+        mask = np.zeros(n_rows, dtype=bool)
+        for i in positions:
+            mask[self.rows[self.offsets[i]:self.offsets[i + 1]]] = True
+        return mask
+
+    def counts(self, codes: np.ndarray, weights: np.ndarray = None):
+        """
+        Returns the number of rows, or the sum of their weights, per value
+        :param codes: Codes of the rows to count, a subset of CategoricalIndex.codes
+        :param weights: Weight of every counted row
+        :return: Array with one entry per value
+        """
+        return np.bincount(codes, weights, minlength=len(self.values) + 1)[:-1]
+
+
+class SortedIndex:
+    """
+    Rows of a numeric column in ascending order of their values, missing values left out
+    """
+
+    def __init__(self, values: pd.Series):
+        """
+        :param values: Column of the roster
+        """
+        values = values.to_numpy(dtype=np.float64)
+        order = np.argsort(values, kind='stable')
+        self.order = order[:int(np.isfinite(values).sum())]
+        self.sorted = values[self.order]
+
+    @property
+    def bounds(self):
+        """
+        (min, max) of the column
+        """
+        return (self.sorted[0], self.sorted[-1]) if len(self.sorted) else (np.nan, np.nan)
+
+    def mask(self, low, high, n_rows: int):
+        """
+        Returns the mask of the rows with a value in [low, high]
+        :param low: Lower bound, None for no bound
+        :param high: Upper bound, None for no bound
+        :param n_rows: Number of rows of the roster
+        :return: Boolean array
+        """
+        start = 0 if low is None else np.searchsorted(self.sorted, low, side='left')
+        stop = len(self.sorted) if high is None else np.searchsorted(self.sorted, high, side='right')
+        mask = np.zeros(n_rows, dtype=bool)
+        mask[self.order[start:stop]] = True
+        return mask
+
+
+class FilterIndex:
+    """
+    Filter indexes of a roster, and the stand-in rosters of the filtered views
+    """
+
+    def __init__(self, fifa: pd.DataFrame, cache_size: int = 32, max_points: int = lod.LOD_MAX_POINTS,
+                 bins: int = lod.LOD_BINS):
+        """
+        :param fifa: The dataframe containing the FIFA game data, with the parsed columns of dataset.load_dataset
+        :param cache_size: Number of filtered views kept
+        :param max_points: Largest number of points drawn individually by the scatter charts, see lod.lod_scatter
+        :param bins: Number of bins per axis of the scatter densities
+        """
+        self.fifa = fifa
+        self.n_rows = len(fifa)
+        self.max_points = max_points
+        self.bins = bins
+        self.categorical = {column: CategoricalIndex(fifa[column]) for column in CATEGORICAL_FILTERS}
+        self.ranges = {column: SortedIndex(fifa[column]) for column in RANGE_FILTERS}
+
+        # Arrays the figure summaries are recomputed from
+        self.groups = {key: self.categorical.get(key) or CategoricalIndex(fifa[key]) for key in MEAN_COLUMNS}
+        # Weights of the group totals, None for the counts equal to the row counts as nothing is missing
+        self.weights = {'Counts': None if fifa['Name'].notna().all() else fifa['Name'].notna().to_numpy(np.float64)}
+        for column in {column for columns in MEAN_COLUMNS.values() for column in columns}:
+            values = fifa[column].to_numpy(dtype=np.float64)
+            present = ~np.isnan(values)
+            self.weights[f'{column} sum'] = np.where(present, values, 0.0)
+            self.weights[f'{column} count'] = None if present.all() else present.astype(np.float64)
+        self.totals = {key: self._group_totals(key, None) for key in self.groups}
+        # Eligible rows of the ranked figures in descending order, ties in roster order
+        self.ranked = {}
+        for name, (column, n, where) in TOP_ROWS.items():
+            values = fifa[column].to_numpy(dtype=np.float64)
+            eligible = ~np.isnan(values)
+            if where is not None:
+                eligible &= where(fifa).to_numpy(dtype=bool)
+            rows = np.flatnonzero(eligible)
+            self.ranked[name] = (rows[np.argsort(-values[rows], kind='stable')], n)
+        self.points = {}
+        for x, y in SCATTERS:
+            xs, ys = fifa[x].to_numpy(dtype=np.float64), fifa[y].to_numpy(dtype=np.float64)
+            finite = np.isfinite(xs) & np.isfinite(ys)
+            # None when every row has both coordinates, the filter mask then applies to the arrays as they are
+            self.points[(x, y)] = (None, xs, ys) if finite.all() else (np.flatnonzero(finite), xs[finite], ys[finite])
+
+        self._views = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._view_locks = {}
+
+    def __getstate__(self):
+        # Snapshots (see snapshot.py) keep the indexes, not the cached views and locks
+        state = self.__dict__.copy()
+        for name in ['_views', '_lock', '_view_locks']:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+        self._view_locks = {}
+
+    def options(self, column: str):
+        """
+        Returns the options of the selector of a categorical filter
+        :param column: Column filtered
+        :return: List of {'label', 'value'} dicts
+        """
+        return [{'label': str(value), 'value': value} for value in self.categorical[column].values]
+
+    def normalize(self, filters: dict):
+        """
+        Drops the inactive filters: empty selections and ranges covering the whole column
+        :param filters: Selected values by categorical column and [min, max] by range column
+        :return: Hashable key of the active filters, empty when the whole roster is shown
+        """
+        active = []
+        for column in CATEGORICAL_FILTERS:
+            selected = (filters or {}).get(column)
+            if selected:
+                active.append((column, tuple(sorted(selected, key=str))))
+        for column in RANGE_FILTERS:
+            selected = (filters or {}).get(column)
+            if selected:
+                low, high = self.ranges[column].bounds
+                if (selected[0] is not None and selected[0] > low) or (selected[1] is not None and selected[1] < high):
+                    active.append((column, (selected[0], selected[1])))
+        return tuple(active)
+
+    def mask(self, filters: dict, exclude: dict = None):
+        """
+        Returns the rows passing every active filter
+        :param filters: See FilterIndex.normalize
+        :param exclude: Values left out by categorical column, e.g. {'Club': ['FC Barcelona']}
+        :return: Boolean array, None when no filter is active and nothing is excluded
+        """
+        mask = None
+        for column, selected in self.normalize(filters):
+            if column in self.categorical:
+                part = self.categorical[column].mask(selected, self.n_rows)
+            else:
+                part = self.ranges[column].mask(*selected, self.n_rows)
+            mask = part if mask is None else np.logical_and(mask, part, out=mask)
+        for column, selected in (exclude or {}).items():
+            if selected:
+                part = np.logical_not(self.categorical[column].mask(selected, self.n_rows))
+                mask = part if mask is None else np.logical_and(mask, part, out=mask)
+        return mask
+
+    def subset(self, filters: dict, columns):
+        """
+        Returns some columns of the rows passing the filters, e.g. for a zoomed view of a scatter chart
+        :param filters: See FilterIndex.normalize
+        :param columns: Columns to return
+        :return: Dataframe, the whole roster when no filter is active
+        """
+        mask = self.mask(filters)
+        if mask is None:
+            return self.fifa
+        return self.fifa.iloc[np.flatnonzero(mask), self.fifa.columns.get_indexer(columns)]
+
+    def roster(self, filters: dict):
+        """
+        Returns the stand-in roster of a filtered view: the rows drawn by the ranked and scatter figures, with the
+        summaries of aggregates.group_summary and the densities of lod.lod_scatter of the filtered rows memoized
+        on it (see streaming.RosterSummary.frame). Views are cached, concurrent requests of a view wait for one build.
+        :param filters: See FilterIndex.normalize
+        :return: The dataframe to pass to the figure builders, None when no filter is active
+        """
+        key = self.normalize(filters)
+        if not key:
+            return None
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+            lock = self._view_locks.setdefault(key, threading.Lock())
+        with lock:
+            with self._lock:
+                view = self._views.get(key)
+            if view is None:
+                view = self.build_view(self.mask(filters))
+                with self._lock:
+                    self._views[key] = view
+                    while len(self._views) > self._cache_size:
+                        self._views.popitem(last=False)
+                    self._view_locks.pop(key, None)
+        return view
+
+    def _group_totals(self, key: str, rows):
+        # Row count, player count and attribute sums and counts per group, over the given rows or all of them
+        index = self.groups[key]
+        codes = index.codes if rows is None else index.codes.take(rows)
+        totals = {'Rows': index.counts(codes)}
+        for name in ['Counts'] + [f'{column} {kind}' for column in MEAN_COLUMNS[key] for kind in ['sum', 'count']]:
+            weights = self.weights[name]
+            totals[name] = None if weights is None else index.counts(codes, weights if rows is None else weights.take(rows))
+        return totals
+
+    def build_view(self, mask: np.ndarray):
+        """
+        Builds the stand-in roster of the rows of a mask, without caching it, see FilterIndex.roster
+        :param mask: Boolean mask of the roster rows, e.g. from FilterIndex.mask
+        :return: The dataframe to pass to the figure builders
+        """
+        # Integer rows are gathered several times faster than boolean masks
+        selected = np.flatnonzero(mask)
+        rows = []
+        for order, n in self.ranked.values():
+            rows.append(_first_masked(order, mask, n))
+        densities = []
+        for (x, y), (finite, xs, ys) in self.points.items():
+            points = selected if finite is None else np.flatnonzero(mask.take(finite))
+            if len(points) <= self.max_points:
+                rows.append(points if finite is None else finite.take(points))
+            else:
+                xs, ys = xs.take(points), ys.take(points)
+                densities.append((x, y, *lod.histogram2d(xs, ys, (xs.min(), xs.max()), (ys.min(), ys.max()),
+                                                         self.bins)))
+        fifa = self.fifa.take(np.unique(np.concatenate(rows))).reset_index(drop=True)
+
+        # Wide filters total the rows they leave out and subtract them from the totals of the roster
+        complement = len(selected) > self.n_rows // 2
+        if complement:
+            selected = np.flatnonzero(~mask)
+        for key, index in self.groups.items():
+            totals = self._group_totals(key, selected)
+            if complement:
+                totals = {name: None if part is None else self.totals[key][name] - part
+                          for name, part in totals.items()}
+            present = totals['Rows'] > 0
+            counts = totals['Rows'] if totals['Counts'] is None else totals['Counts']
+            summary = {key: index.values[present], 'Counts': counts[present].round().astype(np.int64)}
+            for column in MEAN_COLUMNS[key]:
+                counted = totals[f'{column} count']
+                counted = (totals['Rows'] if counted is None else counted)[present]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    summary[column] = np.where(counted > 0, totals[f'{column} sum'][present] / counted, np.nan)
+            aggregates.remember(fifa, key, pd.DataFrame(summary))
+        for x, y, counts, x_edges, y_edges in densities:
+            lod.remember_density(fifa, x, y, counts, x_edges, y_edges)
+        return fifa
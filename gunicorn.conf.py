@@ -0,0 +1,23 @@
+"""
+gunicorn settings of the production server, every setting is read from the environment.
+
+Run with:
+gunicorn -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+wsgi_app = "wsgi:application"
+
+# Load the dataset and warm up once in the master, workers share it copy-on-write. A background warm-up runs in every
+# worker instead, after the worker has loaded the dataset itself, see wsgi.py.
+preload_app = os.environ.get("FIFA_WARMUP_BACKGROUND", "0") != "1"
+
+bind = os.environ.get("FIFA_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("FIFA_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("FIFA_THREADS", 4))
+timeout = int(os.environ.get("FIFA_TIMEOUT", 60))
+max_requests = int(os.environ.get("FIFA_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("FIFA_MAX_REQUESTS_JITTER", 0))
+loglevel = os.environ.get("FIFA_LOG_LEVEL", "info")
+accesslog = os.environ.get("FIFA_ACCESS_LOG", "-")
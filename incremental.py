@@ -0,0 +1,344 @@
+"""
+Incremental roster updates: delta files of upserted or removed players applied to the running dashboard
+without recomputing the aggregations, the similarity matrix or the figures they do not affect.
+
+A delta file is a CSV with the columns of the roster, one row per upserted player. Rows with 'remove' in the
+optional Op column remove the player with their ID, the other columns of those rows may be left empty. Upserted
+rows have a value in every similarity feature, a file with blanks there is rejected.
+
+Delta files are published atomically: written under another name (e.g. 0003.csv.tmp) and renamed to .csv once
+complete. Files modified in the last DELTA_SETTLE_SECONDS are left for a later poll all the same, in case they are
+still being copied in.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import metrics
+from aggregates import MEAN_COLUMNS, POSITION_ATTRIBUTES, group_totals, totals_summary
+from dataset import parse_units
+from filters import FilterIndex
+
+DELTA_OP_COLUMN = 'Op'
+
+# Seconds since the last modification of a delta file below which it is not read yet
+DELTA_SETTLE_SECONDS = 2.0
+# Attempts at a delta file that fails before it is given up, the n-th retry waits DELTA_RETRY_SECONDS * 2 ** (n - 1)
+DELTA_MAX_ATTEMPTS = 5
+DELTA_RETRY_SECONDS = 5.0
+
+# Roster columns every figure is drawn from, a figure is rebuilt when one of them changes or players come and go
+FIGURE_COLUMNS = {
+    'nation_wise_participation': ['Name', 'Nationality'],
+    'nation_over_performing_players': ['Name', 'Nationality', 'OVA'],
+    'club_wise_player': ['Name', 'Club'],
+    'club_wise_over_performing_players': ['Name', 'Club', 'OVA'],
+    'height_vs_weight_variation': ['Name', 'Nationality', 'Club', 'Ht in cm', 'Weight in lb'],
+    'players_position': ['Name', 'BP'],
+    'age_distribution': ['Name', 'Age'],
+    'distibution_of_market_value_and_wage': ['Name', 'Club', 'Nationality', 'Wage in €', 'Value in €', 'BP'],
+    'best_players': ['Name', 'OVA', 'Age', 'Club', 'BP'],
+    'highest_potential': ['Name', 'Age', 'Nationality', 'Club', 'POT', 'BP', 'OVA', 'Value', 'Release Clause'],
+    'overall_attributes': ['BP'] + POSITION_ATTRIBUTES,
+}
+
+
+def read_delta(path: str, required=()):
+    """
+    Reads a delta file
+    :param path: Path of the delta CSV
+    :param required: Columns every upserted row has a value in, e.g. the similarity features
+    :return: (upserted rows with the parsed columns of dataset.PARSED_COLUMNS, IDs of the removed players)
+    """
+    delta = pd.read_csv(path)
+    removed = pd.Series(False, index=delta.index)
+    if DELTA_OP_COLUMN in delta.columns:
+        removed = delta[DELTA_OP_COLUMN].astype(str).str.strip().str.lower() == 'remove'
+        delta = delta.drop(columns=DELTA_OP_COLUMN)
+    upserted = parse_units(delta[~removed].reset_index(drop=True))
+    # An incomplete row would be applied with blanks in place of the player's values, the whole file is rejected
+    missing = [column for column in required if column not in upserted.columns]
+    if missing:
+        raise ValueError(f'{path}: missing columns {missing}')
+    blank = upserted[list(required)].isna().any(axis=1)
+    if blank.any():
+        raise ValueError(f'{path}: blank values in the rows of the players {upserted.loc[blank, "ID"].tolist()}')
+    return upserted, delta.loc[removed, 'ID'].to_numpy()
+
+
+class RunningAggregates:
+    """
+    Player counts and attribute sums per group of every grouping key of the figures, updated by adding and
+    subtracting the rows that change instead of grouping the whole roster again
+    """
+
+    def __init__(self, fifa: pd.DataFrame, keys=tuple(MEAN_COLUMNS)):
+        """
+        :param fifa: The dataframe containing the FIFA game data
+        :param keys: Columns to group by
+        """
+        self.keys = list(keys)
+        self.totals = {key: group_totals(fifa, key) for key in self.keys}
+
+    def update(self, removed: pd.DataFrame, added: pd.DataFrame):
+        """
+        Takes rows out of the totals and puts rows in
+        :param removed: Rows leaving the roster, including the previous version of updated rows
+        :param added: Rows entering the roster, including the new version of updated rows
+        :return: The keys whose totals changed
+        """
+        rows = pd.concat([removed, added], ignore_index=True)
+        sign = np.concatenate([np.full(len(removed), -1.0), np.ones(len(added))])
+        changed = []
+        for key in self.keys:
+            # Weighted by sign, so rows taken out and put in are summed in one grouping
+            change = group_totals(rows, key, sign)
+            change = change[(change != 0).any(axis=1)]
+            if len(change) == 0:
+                continue
+            totals = self.totals[key].add(change, fill_value=0)
+            self.totals[key] = totals[totals['Rows'] > 0]
+            changed.append(key)
+        return changed
+
+    def summary(self, key: str):
+        """
+        Returns the totals of a key in the format of aggregates.group_summary
+        :param key: Column grouped by
+        :return: A dataframe with the key column, a 'Counts' column and one column per averaged attribute
+        """
+        return totals_summary(self.totals[key], key)
+
+
+def _changed_columns(before: pd.DataFrame, after: pd.DataFrame):
+    changed = set()
+    for column in after.columns.intersection(before.columns):
+        old, new = before[column].to_numpy(), after[column].to_numpy()
+        if len(old) and not (pd.isna(old) & pd.isna(new) | (old == new)).all():
+            changed.add(column)
+    return changed
+
+
+class RosterState:
+    """
+    One version of the roster with the similarity engine and the filter indexes built from it and the fingerprints
+    its figures are cached under. An update publishes a new state instead of changing this one, so a reader taking
+    the state once never mixes two versions of the roster.
+    """
+
+    def __init__(self, fifa: pd.DataFrame, engine, fingerprint: str = '', versions: Counter = None, filters=None):
+        """
+        :param fifa: The dataframe containing the FIFA game data
+        :param engine: SimilarityEngine built from the same dataframe
+        :param fingerprint: Fingerprint of the dataset the roster was loaded from
+        :param versions: Version of every figure builder, counting the updates that invalidated its figures
+        :param filters: FilterIndex of the dataframe, built on first use when not given
+        """
+        self.fifa = fifa
+        self.engine = engine
+        self.base_fingerprint = fingerprint
+        self.versions = Counter() if versions is None else versions
+        self._filters = filters
+        self._lock = threading.Lock()
+
+    @property
+    def filters(self):
+        """
+        Filter indexes of the roster, built on first use
+        """
+        with self._lock:
+            if self._filters is None:
+                with metrics.span('filter_index_build'):
+                    self._filters = FilterIndex(self.fifa)
+            return self._filters
+
+    def fingerprint(self, builder: str):
+        """
+        Returns the fingerprint the figures of a builder are cached under
+        :param builder: Name of the figure builder
+        :return: The dataset fingerprint, followed by the version of the builder once it was invalidated
+        """
+        version = self.versions[builder]
+        return self.base_fingerprint if version == 0 else f'{self.base_fingerprint}+{version}'
+
+
+class RosterUpdater:
+    """
+    Applies delta files to the roster of the running dashboard: the grouped summaries behind the figures and the
+    similarity matrix are updated in place and only the cached figures drawing changed columns are invalidated.
+    Invalidated figures get a new version in their fingerprint, so workers that have not applied a delta yet
+    never store a stale figure under the key of an up-to-date one. The updated roster, engine and fingerprints are
+    built aside and published together as a new RosterState.
+    """
+
+    def __init__(self, fifa: pd.DataFrame, engine, figure_cache=None, registry=None, fingerprint: str = '',
+                 filters=None):
+        """
+        :param fifa: The dataframe containing the FIFA game data, with the parsed columns of dataset.load_dataset
+        :param engine: SimilarityEngine built from the same dataframe
+        :param figure_cache: FigureCache the figures are stored in
+        :param registry: FigureRegistry holding the section figures, rebound to the updated roster
+        :param fingerprint: Fingerprint of the dataset the roster was loaded from
+        :param filters: FilterIndex of the dataframe, built on first use when not given
+        """
+        self.state = RosterState(fifa, engine, fingerprint, filters=filters)
+        self.figure_cache = figure_cache
+        self.registry = registry
+        self.aggregates = RunningAggregates(fifa)
+        self.applied = []
+        self.failures = {}
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._last_poll = 0.0
+
+    @property
+    def fifa(self):
+        """
+        The roster of the current state
+        """
+        return self.state.fifa
+
+    @property
+    def engine(self):
+        """
+        The similarity engine of the current state
+        """
+        return self.state.engine
+
+    def fingerprint(self, builder: str):
+        """
+        Returns the fingerprint the figures of a builder are cached under in the current state
+        :param builder: Name of the figure builder
+        :return: See RosterState.fingerprint
+        """
+        return self.state.fingerprint(builder)
+
+    def apply(self, upserted: pd.DataFrame, removed_ids=()):
+        """
+        Applies upserted and removed players to the roster
+        :param upserted: Rows of new or changed players, with all the roster columns
+        :param removed_ids: IDs of the players to remove
+        :return: Dict with the number of 'added', 'updated' and 'removed' players, the 'rescaled' similarity
+                 features, the 'invalidated' figure builders and the 'grouping_keys' whose summaries changed
+        """
+        with self._lock, metrics.span('roster_update'):
+            state = self.state
+            old = state.fifa
+            upserted = upserted.drop_duplicates('ID', keep='last').reindex(columns=old.columns)
+            for column, dtype in old.dtypes.items():
+                if upserted[column].dtype != dtype:
+                    try:
+                        upserted[column] = upserted[column].astype(dtype)
+                    except (TypeError, ValueError):
+                        pass
+            ids = pd.Index(old['ID'].to_numpy())
+            upsert_rows = ids.get_indexer(upserted['ID'].to_numpy())
+            removed_rows = ids.get_indexer(np.asarray(removed_ids))
+            removed_rows = np.unique(removed_rows[removed_rows >= 0])
+            updated_rows = upsert_rows[upsert_rows >= 0]
+            dropped = np.union1d(removed_rows, updated_rows)
+            if len(dropped) == 0 and len(upserted) == 0:
+                return dict(added=0, updated=0, removed=0, rescaled=[], invalidated=[], grouping_keys=[])
+
+            keep = np.ones(len(old), dtype=bool)
+            keep[dropped] = False
+            leaving = old.iloc[dropped]
+            # Updated players move to the end of the roster with the new players, the similarity rows follow
+            fifa = pd.concat([old[keep], upserted], ignore_index=True)
+
+            changed_keys = self.aggregates.update(leaving, upserted)
+            for key in self.aggregates.keys:
+                aggregates.remember(fifa, key, self.aggregates.summary(key))
+
+            features = state.engine.feature_names
+            engine, rescaled = state.engine.update_rows(keep, leaving[features].to_numpy(dtype=np.float64),
+                                                        upserted[features].to_numpy(dtype=np.float64), fifa)
+
+            membership_changed = len(removed_rows) > 0 or len(updated_rows) < len(upserted)
+            changed = set(old.columns) if membership_changed else \
+                _changed_columns(old.iloc[updated_rows], upserted[upsert_rows >= 0])
+            invalidated = [builder for builder, columns in FIGURE_COLUMNS.items() if changed.intersection(columns)]
+            if changed.intersection(features + ['Name', 'Player Photo']) or rescaled:
+                invalidated.append('get_similar_players')
+            versions = state.versions.copy()
+            versions.update(invalidated)
+            new_state = RosterState(fifa, engine, state.base_fingerprint, versions)
+
+            def publish():
+                self.state = new_state
+
+            # The section figures are not built while the state is swapped, so none is cached from the old roster
+            # under the new fingerprint
+            if self.registry is not None:
+                self.registry.rebind(old, fifa, invalidated, publish)
+            else:
+                publish()
+            # The figures of the previous version become unreachable with the new fingerprint, only this worker's
+            # memory copies are dropped
+            if self.figure_cache is not None:
+                for builder in invalidated:
+                    self.figure_cache.invalidate(builder, state.fingerprint(builder))
+
+        metrics.count('roster_updates_total', 'Roster deltas applied')
+        return dict(added=len(upserted) - len(updated_rows), updated=len(updated_rows), removed=len(removed_rows),
+                    rescaled=rescaled, invalidated=invalidated, grouping_keys=changed_keys)
+
+    def apply_file(self, path: str):
+        """
+        Applies a delta file
+        :param path: Path of the delta CSV
+        :return: See RosterUpdater.apply
+        """
+        return self.apply(*read_delta(path, self.engine.feature_names))
+
+    def poll(self, directory: str, min_interval: float = 0.0):
+        """
+        Applies the delta files of a directory that were not applied yet, in file name order. Every worker
+        polling the same directory applies the same deltas in the same order: a file that is still settling or that
+        failed stops the poll, and later files wait for it. A failed file is retried with a backoff and given up
+        after DELTA_MAX_ATTEMPTS attempts.
+        :param directory: Directory of the delta CSVs
+        :param min_interval: Seconds since the previous poll below which the directory is not listed again
+        :return: Results of the applied deltas by file name, with an 'error' entry for the files that failed
+        """
+        now = time.monotonic()
+        if now - self._last_poll < min_interval or not self._poll_lock.acquire(blocking=False):
+            return {}
+        try:
+            self._last_poll = now
+            try:
+                names = sorted(name for name in os.listdir(directory) if name.endswith('.csv'))
+            except OSError:
+                return {}
+            results = {}
+            for name in names:
+                if name in self.applied:
+                    continue
+                path = os.path.join(directory, name)
+                attempts, retry_at = self.failures.get(name, (0, 0.0))
+                try:
+                    settled = time.time() - os.path.getmtime(path) >= DELTA_SETTLE_SECONDS
+                except OSError:
+                    settled = False
+                if not settled or now < retry_at:
+                    break
+                try:
+                    results[name] = self.apply_file(path)
+                except Exception as error:
+                    results[name] = {'error': repr(error)}
+                    metrics.count('roster_update_failures_total', 'Roster deltas that could not be applied')
+                    attempts += 1
+                    if attempts < DELTA_MAX_ATTEMPTS:
+                        self.failures[name] = (attempts, now + DELTA_RETRY_SECONDS * 2 ** (attempts - 1))
+                        break
+                    metrics.count('roster_update_abandoned_total', 'Roster deltas given up after every attempt')
+                self.failures.pop(name, None)
+                self.applied.append(name)
+            return results
+        finally:
+            self._poll_lock.release()
@@ -0,0 +1,177 @@
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# plotly.express is imported on first use, see figures.py
+
+# Above this many points in view, scatter charts are drawn as a binned density instead of individual points
+LOD_MAX_POINTS = 5000
+LOD_BINS = 120
+
+_densities = {}
+# Reentrant, a dataframe collected while the lock is held runs its _forget finalizer in the same thread
+_densities_lock = threading.RLock()
+
+
+def _forget(frame_id: int):
+    with _densities_lock:
+        for cache_key in [k for k in _densities if k[0] == frame_id]:
+            del _densities[cache_key]
+
+
+def remember_density(frame: pd.DataFrame, x: str, y: str, counts: np.ndarray, x_edges: np.ndarray,
+                     y_edges: np.ndarray):
+    """
+    Memoizes the full-extent density of a scatter computed elsewhere, e.g. binned chunk by chunk by
+    streaming.stream_roster, so lod_scatter draws it instead of binning the rows of the frame
+    :param frame: The dataframe the density describes
+    :param x: Column on the x axis
+    :param y: Column on the y axis
+    :param counts: Player counts per bin, as returned by np.histogram2d
+    :param x_edges: Bin edges of the x axis
+    :param y_edges: Bin edges of the y axis
+    """
+    with _densities_lock:
+        if not any(k[0] == id(frame) for k in _densities):
+            weakref.finalize(frame, _forget, id(frame))
+        _densities[(id(frame), x, y)] = (counts, x_edges, y_edges)
+
+
+def _bin_indices(values: np.ndarray, edges: np.ndarray):
+    # Arithmetic binning, corrected by one bin where rounding crosses an edge as np.histogram does, instead of the
+    # searchsorted of np.histogram2d
+    bins = len(edges) - 1
+    indices = ((values - edges[0]) * (bins / (edges[-1] - edges[0]))).astype(np.intp)
+    np.clip(indices, 0, bins - 1, out=indices)
+    indices -= values < edges[indices]
+    indices += (values >= edges[indices + 1]) & (indices < bins - 1)
+    return indices
+
+
+def histogram2d(xs: np.ndarray, ys: np.ndarray, x_range, y_range, bins: int = LOD_BINS):
+    """
+    Same counts and edges as np.histogram2d with equal-width bins, for points inside the ranges, several times faster
+    :param xs: x coordinates, all within x_range
+    :param ys: y coordinates, all within y_range
+    :param x_range: [min, max] of the x axis
+    :param y_range: [min, max] of the y axis
+    :param bins: Number of bins per axis
+    :return: (counts of shape (bins, bins), x edges, y edges)
+    """
+    edges = []
+    for low, high in [x_range, y_range]:
+        low, high = float(low), float(high)
+        if low == high:
+            low, high = low - 0.5, high + 0.5
+        edges.append(np.linspace(low, high, bins + 1))
+    flat = _bin_indices(xs, edges[0]) * bins + _bin_indices(ys, edges[1])
+    counts = np.bincount(flat, minlength=bins * bins).reshape(bins, bins).astype(np.float64)
+    return counts, edges[0], edges[1]
+
+
+def density_figure(counts: np.ndarray, x_edges: np.ndarray, y_edges: np.ndarray, x: str, y: str, title: str):
+    """
+    Returns the heatmap drawn by lod_scatter for views with too many points
+    :param counts: Player counts per bin, as returned by np.histogram2d
+    :param x_edges: Bin edges of the x axis
+    :param y_edges: Bin edges of the y axis
+    :param x: Column on the x axis
+    :param y: Column on the y axis
+    :param title: Title of the plot
+    :return: The figure
+    """
+    fig = go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=np.where(counts.T > 0, counts.T, np.nan),
+        colorscale='Plasma',
+        colorbar=dict(title='Players'),
+        hovertemplate=f'{x}: %{{x:.3s}}<br>{y}: %{{y:.3s}}<br>Players: %{{z}}<extra></extra>',
+    ))
+    fig.update_layout(title=f'{title} ({int(counts.sum())} players, zoom in for details)', xaxis_title=x,
+                      yaxis_title=y)
+    return fig
+
+
+def parse_relayout(relayout_data: dict):
+    """
+    Extracts the axis ranges from the relayoutData of a graph
+    :param relayout_data: relayoutData property of a dcc.Graph
+    :return: (x_range, y_range) with None for an axis showing its full extent, or None when the event
+             did not change the view (e.g. an autosize)
+    """
+    if not relayout_data:
+        return None, None
+    ranges = {}
+    changed = False
+    for axis in ['xaxis', 'yaxis']:
+        if f'{axis}.autorange' in relayout_data:
+            ranges[axis] = None
+            changed = True
+        elif f'{axis}.range[0]' in relayout_data:
+            ranges[axis] = [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+            changed = True
+        elif f'{axis}.range' in relayout_data:
+            ranges[axis] = list(relayout_data[f'{axis}.range'])
+            changed = True
+    if not changed:
+        return None
+    return ranges.get('xaxis'), ranges.get('yaxis')
+
+
+def lod_scatter(frame: pd.DataFrame, x: str, y: str, color: str, size: str, hover_data: list, title: str,
+                x_range=None, y_range=None, max_points: int = LOD_MAX_POINTS, bins: int = LOD_BINS):
+    """
+    Returns a level-of-detail scatter plot: the points inside the view drawn with WebGL when there are at most
+    max_points of them, otherwise a 2D histogram of the view binned on the server
+    :param frame: Dataframe with the plotted columns
+    :param x: Column on the x axis
+    :param y: Column on the y axis
+    :param color: Column the points are coloured by
+    :param size: Column the points are sized by
+    :param hover_data: Columns shown when hovering a point
+    :param title: Title of the plot
+    :param x_range: [min, max] of the x axis in view, None for the full extent
+    :param y_range: [min, max] of the y axis in view, None for the full extent
+    :param max_points: Largest number of points drawn individually
+    :param bins: Number of bins per axis of the density
+    :return: The figure
+    """
+    import plotly.express as px
+
+    density = None
+    if x_range is None and y_range is None:
+        with _densities_lock:
+            density = _densities.get((id(frame), x, y))
+    if density is not None:
+        fig = density_figure(*density, x=x, y=y, title=title)
+        fig.update_layout(uirevision=title)
+        return fig
+
+    xs = frame[x].to_numpy(dtype=np.float64)
+    ys = frame[y].to_numpy(dtype=np.float64)
+    in_view = np.isfinite(xs) & np.isfinite(ys)
+    if x_range is not None:
+        in_view &= (xs >= x_range[0]) & (xs <= x_range[1])
+    if y_range is not None:
+        in_view &= (ys >= y_range[0]) & (ys <= y_range[1])
+    count = int(in_view.sum())
+
+    if count <= max_points:
+        fig = px.scatter(frame[in_view], x=x, y=y, color=color, size=size, hover_data=hover_data, title=title,
+                         render_mode='webgl')
+    else:
+        view_x = x_range if x_range is not None else [xs[in_view].min(), xs[in_view].max()]
+        view_y = y_range if y_range is not None else [ys[in_view].min(), ys[in_view].max()]
+        counts, x_edges, y_edges = histogram2d(xs[in_view], ys[in_view], view_x, view_y, bins)
+        fig = density_figure(counts, x_edges, y_edges, x, y, title)
+
+    if x_range is not None:
+        fig.update_xaxes(range=x_range)
+    if y_range is not None:
+        fig.update_yaxes(range=y_range)
+    fig.update_layout(uirevision=title)
+    return fig
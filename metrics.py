@@ -0,0 +1,337 @@
+"""
+Latency histograms, counters and timing spans of the dashboard, exposed in the Prometheus text format.
+
+Metrics are kept per process: behind gunicorn every worker answers /metrics with its own numbers, label
+the scrape target by worker or scrape each one to aggregate them.
+"""
+import bisect
+import cProfile
+import functools
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, one value per label set
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """
+        Increments the counter of a label set
+        :param amount: Increment
+        :param labels: Labels of the series
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(dict(key))} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values with fixed buckets, one per label set
+    """
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """
+        Records a value
+        :param value: Observed value, e.g. a duration in seconds
+        :param labels: Labels of the series
+        """
+        key = tuple(sorted(labels.items()))
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Counts per bucket (the last one is +Inf), sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return 0 if series is None else series[2]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                labels = dict(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{_format_labels(dict(labels, le=_format_value(bound)))} '
+                                 f'{cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics of a process, rendered together in the Prometheus text format
+    """
+
+    def __init__(self, prefix: str = 'fifa_'):
+        """
+        :param prefix: Prefix of every metric name
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, **kwargs):
+        name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {type(metric).__name__}')
+            return metric
+
+    def counter(self, name: str, help: str):
+        """
+        Returns the counter of a name, registering it on first use
+        :param name: Metric name without the registry prefix, ending in _total by convention
+        :param help: Description of the metric
+        :return: The Counter
+        """
+        return self._get_or_create(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        """
+        Returns the histogram of a name, registering it on first use
+        :param name: Metric name without the registry prefix
+        :param help: Description of the metric
+        :param buckets: Upper bounds of the buckets
+        :return: The Histogram
+        """
+        return self._get_or_create(Histogram, name, help, buckets=buckets)
+
+    def add_collector(self, collect):
+        """
+        Registers a function read at every scrape, for values other objects already count (e.g. cache stats)
+        :param collect: Function without arguments returning (name, type, help, value) tuples, the type being
+                        'counter' or 'gauge' and the name given without the registry prefix
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format
+        :return: The exposition text
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, help, value in collect():
+                name = self.prefix + name
+                lines.extend([f'# HELP {name} {help}', f'# TYPE {name} {kind}', f'{name} {_format_value(value)}'])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def span_histogram(registry: MetricsRegistry = None):
+    return (registry or REGISTRY).histogram('span_seconds', 'Duration of instrumented steps in seconds')
+
+
+@contextmanager
+def span(name: str, registry: MetricsRegistry = None, **labels):
+    """
+    Times a block of code into the span_seconds histogram, the block's exceptions included
+    :param name: Name of the step, e.g. 'build' or 'callback'
+    :param registry: Registry of the histogram, the process-wide REGISTRY by default
+    :param labels: Further labels of the series, e.g. figure='best_players'
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_histogram(registry).observe(time.perf_counter() - start, span=name, **labels)
+
+
+def timed(name: str, registry: MetricsRegistry = None, **labels):
+    """
+    Decorator timing every call of a function as a span
+    :param name: Name of the step
+    :param registry: Registry of the histogram, the process-wide REGISTRY by default
+    :param labels: Further labels of the series
+    :return: The decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, registry, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, help: str, amount: float = 1, registry: MetricsRegistry = None, **labels):
+    """
+    Increments a counter of the registry
+    :param name: Metric name without the registry prefix
+    :param help: Description of the metric
+    :param amount: Increment
+    :param registry: Registry of the counter, the process-wide REGISTRY by default
+    :param labels: Labels of the series
+    """
+    (registry or REGISTRY).counter(name, help).inc(amount, **labels)
+
+
+class SlowRequestProfiler:
+    """
+    Profiles a sample of requests with cProfile and keeps the pstats dumps of the slow ones.
+    One request is profiled at a time, cProfile cannot profile concurrent threads separately.
+    """
+
+    def __init__(self, out_dir: str, sample_rate: float = 0.1, slow_seconds: float = 0.5):
+        """
+        :param out_dir: Directory the .pstats dumps are written to
+        :param sample_rate: Share of requests profiled
+        :param slow_seconds: Duration above which a profiled request is dumped
+        """
+        self.out_dir = out_dir
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self._busy = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(out_dir, exist_ok=True)
+
+    def start(self):
+        """
+        Starts profiling the current request if it is sampled and no other request is being profiled
+        """
+        self._local.profile = None
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is active
+            self._busy.release()
+            return
+        self._local.profile = profile
+        self._local.start = time.perf_counter()
+
+    def stop(self, label: str):
+        """
+        Stops profiling the current request and dumps its stats if it was slow
+        :param label: Name of the request, used in the dump file name
+        :return: Path of the dump, or None
+        """
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return None
+        self._local.profile = None
+        try:
+            profile.disable()
+            elapsed = time.perf_counter() - self._local.start
+            if elapsed < self.slow_seconds:
+                return None
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+            path = os.path.join(self.out_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{name}-'
+                                              f'{int(elapsed * 1000)}ms.pstats')
+            profile.dump_stats(path)
+            count('profiles_dumped_total', 'Slow requests whose profile was dumped')
+            return path
+        finally:
+            self._busy.release()
+
+
+def install(server, registry: MetricsRegistry = None, profiler: SlowRequestProfiler = None,
+            route: str = '/metrics'):
+    """
+    Times every request of a Flask server and serves the registry on a route
+    :param server: Flask server, app.server for a Dash app
+    :param registry: Registry to serve, the process-wide REGISTRY by default
+    :param profiler: Optional profiler of slow requests
+    :param route: Path of the metrics endpoint
+    """
+    from flask import Response, g, request
+
+    registry = registry or REGISTRY
+    requests = registry.histogram('http_request_seconds', 'Duration of HTTP requests in seconds')
+
+    @server.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        if profiler is not None and request.path != route:
+            profiler.start()
+
+    @server.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            requests.observe(time.perf_counter() - start, path=rule, status=response.status_code)
+        return response
+
+    if profiler is not None:
+        @server.teardown_request
+        def stop_profiler(_):
+            # Dash serves every callback on one path, the output it updates tells them apart
+            body = request.get_json(silent=True) if request.is_json else None
+            output = body.get('output') if isinstance(body, dict) else None
+            profiler.stop(f'{request.path} {output}' if output else request.path)
+
+    @server.route(route)
+    def serve_metrics():
+        return Response(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
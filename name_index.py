@@ -0,0 +1,189 @@
+import bisect
+import itertools
+import unicodedata
+
+import numpy as np
+
+
+def fold(text: str):
+    """
+    Normalizes a name for matching: accents removed, case folded and whitespace collapsed
+    :param text: Name as written in the roster or typed by the user
+    :return: The folded name
+    """
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.casefold().split())
+
+
+class NameIndex:
+    """
+    Search index over the player names of a roster, mapping folded names to stable player IDs.
+    Supports exact, prefix (of the full name or of any of its words) and substring lookups.
+    """
+
+    def __init__(self, names, ids, rank=None):
+        """
+        :param names: Player names, one per roster row
+        :param ids: Player IDs, one per roster row
+        :param rank: Scores ordering players that match equally well, higher first (e.g. OVA)
+        """
+        self.names = np.asarray(names, dtype=object)
+        self.ids = np.asarray(ids)
+        self.rank = np.zeros(len(self.names)) if rank is None else np.asarray(rank, dtype=np.float64)
+        self.folded = [fold(name) for name in self.names]
+        self._row_of_id = dict(zip(self.ids.tolist(), range(len(self.ids))))
+
+        # Every word start of every name, sorted, for prefix lookups on first, middle or last names
+        keys = self._word_starts(self.folded, 0)
+        keys.sort()
+        self._prefix_keys = [key for key, _, _ in keys]
+        self._prefix_rows = np.array([row for _, row, _ in keys], dtype=np.int64)
+        self._prefix_is_name_start = np.array([is_start for _, _, is_start in keys], dtype=bool)
+        self._lengths = np.array([len(name) for name in self.folded], dtype=np.int64)
+        self._join()
+
+    @staticmethod
+    def _word_starts(folded, first_row: int):
+        keys = []
+        for row, name in enumerate(folded, first_row):
+            start = 0
+            while True:
+                keys.append((name[start:], row, start == 0))
+                start = name.find(' ', start) + 1
+                if start == 0:
+                    break
+        return keys
+
+    def _join(self):
+        # All names in one string, for substring lookups with str.find
+        self._joined = '\n'.join(self.folded)
+        self._offsets = np.concatenate([[0], np.cumsum(self._lengths[:-1] + 1)]).astype(np.int64)
+
+    def updated(self, keep, names, ids, rank=None):
+        """
+        Returns the index of a roster whose rows are the kept rows of this one followed by new rows. Only the
+        new names are folded and their word starts merged into the sorted keys.
+        :param keep: Boolean mask of the rows of this index that are kept
+        :param names: Player names of the new roster
+        :param ids: Player IDs of the new roster
+        :param rank: Scores ordering players that match equally well in the new roster
+        :return: The new NameIndex
+        """
+        keep = np.asarray(keep, dtype=bool)
+        n_kept = int(keep.sum())
+        index = NameIndex.__new__(NameIndex)
+        index.names = np.asarray(names, dtype=object)
+        index.ids = np.asarray(ids)
+        index.rank = np.zeros(len(index.names)) if rank is None else np.asarray(rank, dtype=np.float64)
+        added = [fold(name) for name in index.names[n_kept:]]
+        index.folded = list(itertools.compress(self.folded, keep)) + added
+        index._row_of_id = dict(zip(index.ids.tolist(), range(len(index.ids))))
+
+        new_row = np.cumsum(keep) - 1
+        kept_keys = keep[self._prefix_rows]
+        keys = list(itertools.compress(self._prefix_keys, kept_keys))
+        rows = new_row[self._prefix_rows[kept_keys]]
+        is_start = self._prefix_is_name_start[kept_keys]
+        new_keys = sorted(self._word_starts(added, n_kept))
+        positions = [bisect.bisect_left(keys, key) for key, _, _ in new_keys]
+        merged = []
+        previous = 0
+        for position, (key, _, _) in zip(positions, new_keys):
+            merged.extend(keys[previous:position])
+            merged.append(key)
+            previous = position
+        merged.extend(keys[previous:])
+        index._prefix_keys = merged
+        index._prefix_rows = np.insert(rows, positions, [row for _, row, _ in new_keys]).astype(np.int64)
+        index._prefix_is_name_start = np.insert(is_start, positions, [start for _, _, start in new_keys])
+        index._lengths = np.concatenate([self._lengths[keep], [len(name) for name in added]]).astype(np.int64)
+        index._join()
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, player_id):
+        return int(player_id) in self._row_of_id
+
+    def memory_bytes(self):
+        """
+        Returns a rough estimate of the memory held by the index, mostly its Python strings
+        :return: Size in bytes
+        """
+        return (len(self.folded) * 120 + len(self._prefix_keys) * 80 + len(self._joined)
+                + self._prefix_rows.nbytes + self._lengths.nbytes + self._offsets.nbytes)
+
+    def row_of(self, player_id):
+        """
+        Returns the roster row of a player
+        :param player_id: ID of the player
+        :return: Row index
+        """
+        return self._row_of_id[int(player_id)]
+
+    def _prefix_matches(self, query: str):
+        lo = bisect.bisect_left(self._prefix_keys, query)
+        hi = bisect.bisect_left(self._prefix_keys, query + '\uffff', lo)
+        rows = self._prefix_rows[lo:hi]
+        # 0: exact match, 1: prefix of the name, 2: prefix of a later word
+        quality = np.where(self._prefix_is_name_start[lo:hi], np.where(self._lengths[rows] == len(query), 0, 1), 2)
+        return rows, quality
+
+    def _substring_rows_of(self, query: str, limit: int):
+        rows = []
+        position = self._joined.find(query)
+        while position != -1 and len(rows) < limit:
+            row = int(np.searchsorted(self._offsets, position, side='right')) - 1
+            rows.append(row)
+            position = self._joined.find(query, int(self._offsets[row]) + len(self.folded[row]) + 1)
+        return np.array(rows, dtype=np.int64)
+
+    def search(self, query: str, limit: int = 20):
+        """
+        Returns the rows of the players best matching a query: exact matches first, then name prefixes,
+        then word prefixes, then substrings, each group ordered by rank
+        :param query: Text typed by the user
+        :param limit: Maximum number of rows to return
+        :return: Row indexes
+        """
+        query = fold(query)
+        if not query:
+            return np.argsort(-self.rank, kind='stable')[:limit]
+
+        rows, quality = self._prefix_matches(query)
+        if len(np.unique(rows)) < limit:
+            substring_rows = self._substring_rows_of(query, 10 * limit)
+            rows = np.concatenate([rows, substring_rows])
+            quality = np.concatenate([quality, np.full(len(substring_rows), 3)])
+        if len(rows) == 0:
+            return rows
+
+        order = np.lexsort((-self.rank[rows], quality))
+        rows = rows[order]
+        _, first = np.unique(rows, return_index=True)
+        return rows[np.sort(first)[:limit]]
+
+    def resolve(self, name: str):
+        """
+        Returns the row of the player a name refers to, the highest-ranked one when several players match
+        :param name: Name (or part of the name) of the player
+        :return: Row index
+        """
+        rows = self.search(name, limit=1)
+        if len(rows) == 0:
+            raise KeyError(name)
+        return int(rows[0])
+
+    def options(self, rows, labels=None):
+        """
+        Returns dropdown options for roster rows, valued by player ID. The 'search' text holds the folded name
+        too, so the dropdown's own filtering keeps options matched without accents.
+        :param rows: Row indexes
+        :param labels: Optional label suffix per roster row (e.g. the club), shown to tell namesakes apart
+        :return: List of {'label', 'value', 'search'} dicts
+        """
+        return [{'label': self.names[row] if labels is None else f'{self.names[row]} ({labels[row]})',
+                 'value': int(self.ids[row]),
+                 'search': f'{self.names[row]} {self.folded[row]}'} for row in rows]
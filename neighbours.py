@@ -0,0 +1,137 @@
+"""
+Offline builder of the top-K similar players of every player in a roster.
+
+Run with:
+python neighbours.py assets/cleaned_fifa21_male2.csv --k 10 --memory-mb 256 --workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from dataset import artifact_stem, fingerprint
+from feature_store import load_engine, store_path
+
+_matrix = None
+
+
+def table_path(csv_path: str, table_dir: str = '.neighbours'):
+    """
+    Returns where the neighbour table of a roster is stored, the fingerprint in the name ties it to the CSV content
+    :param csv_path: Path of the roster CSV
+    :param table_dir: Directory of the neighbour tables
+    :return: Path of the .npz table
+    """
+    return os.path.join(table_dir, f'{artifact_stem(csv_path)}-{fingerprint(csv_path)}.npz')
+
+
+def block_rows_for_budget(n_rows: int, memory_mb: float):
+    """
+    Returns how many query rows fit in a memory budget, each row needs a float32 score for every player
+    :param n_rows: Number of players
+    :param memory_mb: Budget of one block in MB
+    :return: Number of rows per block
+    """
+    return max(1, int(memory_mb * 2 ** 20 // (n_rows * 4)))
+
+
+def _init_worker(matrix_path: str):
+    global _matrix
+    _matrix = np.load(matrix_path, mmap_mode='r')
+
+
+def _top_k_block(start: int, stop: int, k: int, matrix: np.ndarray = None):
+    matrix = _matrix if matrix is None else matrix
+    scores = np.asarray(matrix[start:stop]) @ np.asarray(matrix).T
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return start, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def build_neighbours(matrix: np.ndarray, k: int = 10, block_rows: int = 2048, workers: int = 1,
+                     matrix_path: str = None):
+    """
+    Computes the top-k neighbours of every row in blocks of rows, so only a (block_rows, N) score matrix
+    per worker is held in memory
+    :param matrix: L2-normalized row vectors
+    :param k: Number of neighbours per row
+    :param block_rows: Number of query rows per block
+    :param workers: Number of worker processes, 1 computes the blocks in this process
+    :param matrix_path: .npy file holding the matrix (e.g. in a feature store) for the workers to map,
+                        the matrix is written to a temporary file when not given
+    :return: (N, k) int32 neighbour indexes and (N, k) float32 cosine similarities
+    """
+    n_rows = matrix.shape[0]
+    k = min(k, n_rows - 1)
+    indices = np.empty((n_rows, k), dtype=np.int32)
+    scores = np.empty((n_rows, k), dtype=np.float32)
+    blocks = [(start, min(start + block_rows, n_rows)) for start in range(0, n_rows, block_rows)]
+
+    if workers <= 1:
+        results = (_top_k_block(start, stop, k, matrix) for start, stop in blocks)
+        for start, block_indices, block_scores in results:
+            indices[start:start + len(block_indices)] = block_indices
+            scores[start:start + len(block_scores)] = block_scores
+        return indices, scores
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if matrix_path is None:
+            matrix_path = os.path.join(tmp, 'matrix.npy')
+            np.save(matrix_path, matrix)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(matrix_path,)) as pool:
+            futures = [pool.submit(_top_k_block, start, stop, k) for start, stop in blocks]
+            for future in futures:
+                start, block_indices, block_scores = future.result()
+                indices[start:start + len(block_indices)] = block_indices
+                scores[start:start + len(block_scores)] = block_scores
+    return indices, scores
+
+
+def save_table(path: str, indices: np.ndarray, scores: np.ndarray, score_dtype=np.float16):
+    """
+    Writes a neighbour table
+    :param path: Path of the .npz table
+    :param indices: (N, k) neighbour indexes
+    :param scores: (N, k) cosine similarities
+    :param score_dtype: dtype the scores are stored with
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}.npz'
+    np.savez(tmp, indices=indices.astype(np.int32), scores=scores.astype(score_dtype))
+    os.replace(tmp, path)
+
+
+def load_table(path: str):
+    """
+    Reads a neighbour table
+    :param path: Path of the .npz table
+    :return: (N, k) int32 neighbour indexes and (N, k) float32 cosine similarities
+    """
+    with np.load(path) as table:
+        return table['indices'], table['scores'].astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv', help='roster CSV')
+    parser.add_argument('--k', type=int, default=10, help='neighbours per player')
+    parser.add_argument('--memory-mb', type=float, default=256, help='memory budget of one block of scores')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--float32', action='store_true', help='store scores as float32 instead of float16')
+    parser.add_argument('--out', help='output path, defaults to the table path the dashboard looks for')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    engine = load_engine(args.csv)
+    block_rows = block_rows_for_budget(len(engine), args.memory_mb)
+    indices, scores = build_neighbours(engine.matrix, args.k, block_rows, args.workers,
+                                       os.path.join(store_path(args.csv), 'matrix.npy'))
+    out = args.out or table_path(args.csv)
+    save_table(out, indices, scores, np.float32 if args.float32 else np.float16)
+    print(f'{len(engine)} players, k={indices.shape[1]}, {block_rows} rows per block, {args.workers} workers: '
+          f'wrote {out} in {time.perf_counter() - start_time:.2f}s')
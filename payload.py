@@ -0,0 +1,206 @@
+import base64
+import gzip
+import json
+import re
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Arrays shorter than this stay plain JSON lists, encoding them would not pay off
+TYPED_ARRAY_MIN_LENGTH = 8
+
+# Trace attributes a customdata column can duplicate, with the hovertemplate variable showing them
+_HOVER_ALIASES = [(('x',), 'x'), (('y',), 'y'), (('z',), 'z'), (('r',), 'r'), (('theta',), 'theta'),
+                  (('text',), 'text'), (('marker', 'size'), 'marker.size'), (('marker', 'color'), 'marker.color')]
+
+_INT_DTYPES = [('i1', np.int8), ('u1', np.uint8), ('i2', np.int16), ('u2', np.uint16), ('i4', np.int32),
+               ('u4', np.uint32)]
+
+
+def _decode(value):
+    """
+    Returns a numeric array from a JSON list or a typed array spec, or None when the value is not numeric
+    """
+    if isinstance(value, dict) and 'bdata' in value and 'dtype' in value:
+        array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+        if 'shape' in value:
+            shape = value['shape']
+            array = array.reshape([int(n) for n in shape.split(',')] if isinstance(shape, str) else shape)
+        return array
+    if not isinstance(value, list) or len(value) == 0:
+        return None
+    if any(isinstance(item, (str, bool, dict)) for item in value[:TYPED_ARRAY_MIN_LENGTH]):
+        return None
+    try:
+        array = np.asarray(value, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    if array.ndim not in (1, 2):
+        return None
+    return array
+
+
+def typed_array(array: np.ndarray):
+    """
+    Encodes a numeric array as a Plotly typed array spec, with the smallest integer dtype holding its values
+    or float32 otherwise
+    :param array: 1-D or 2-D numeric array
+    :return: Dict with 'dtype', 'bdata' and, for 2-D arrays, 'shape'
+    """
+    array = np.asarray(array)
+    dtype = None
+    if np.all(np.isfinite(array)) and np.all(array == np.round(array)):
+        low, high = array.min(initial=0), array.max(initial=0)
+        for name, candidate in _INT_DTYPES:
+            info = np.iinfo(candidate)
+            if info.min <= low and high <= info.max:
+                dtype = name
+                break
+    if dtype is None:
+        dtype = 'f4'
+    spec = {'dtype': dtype, 'bdata': base64.b64encode(np.ascontiguousarray(array, dtype=dtype)).decode('ascii')}
+    if array.ndim == 2:
+        spec['shape'] = ','.join(str(n) for n in array.shape)
+    return spec
+
+
+def _encode_arrays(node):
+    if isinstance(node, dict):
+        if 'bdata' in node and 'dtype' in node:
+            array = _decode(node)
+            return typed_array(array) if array is not None and array.dtype.kind in 'iuf' else node
+        return {key: _encode_arrays(value) for key, value in node.items()}
+    if isinstance(node, list):
+        array = _decode(node) if len(node) >= TYPED_ARRAY_MIN_LENGTH else None
+        if array is not None:
+            return typed_array(array)
+        return [_encode_arrays(item) for item in node]
+    return node
+
+
+def _get_path(trace: dict, path):
+    for key in path:
+        if not isinstance(trace, dict) or key not in trace:
+            return None
+        trace = trace[key]
+    return trace
+
+
+def dedupe_hover_data(trace: dict):
+    """
+    Drops the customdata columns of a trace that repeat another customdata column or a plotted attribute
+    (x, y, marker size, ...) and points its hovertemplate at the kept values instead
+    :param trace: Trace as a dict
+    :return: The trace
+    """
+    customdata = trace.get('customdata')
+    template = trace.get('hovertemplate')
+    if not isinstance(customdata, list) or not customdata or not isinstance(customdata[0], list) or not template:
+        return trace
+
+    columns = [list(column) for column in zip(*customdata)]
+    replacements = {}
+    kept = []
+    for i, column in enumerate(columns):
+        alias = None
+        for path, variable in _HOVER_ALIASES:
+            value = _get_path(trace, path)
+            if isinstance(value, dict):
+                value = _decode(value)
+                value = value.tolist() if value is not None else None
+            if isinstance(value, list) and value == column:
+                alias = variable
+                break
+        if alias is None:
+            for j in kept:
+                if columns[j] == column:
+                    alias = f'customdata[{kept.index(j)}]'
+                    break
+        if alias is None:
+            replacements[i] = f'customdata[{len(kept)}]'
+            kept.append(i)
+        else:
+            replacements[i] = alias
+
+    if len(kept) == len(columns):
+        return trace
+    trace['hovertemplate'] = re.sub(r'customdata\[(\d+)\]', lambda m: replacements[int(m.group(1))], template)
+    if kept:
+        trace['customdata'] = [list(row) for row in zip(*(columns[i] for i in kept))]
+    else:
+        del trace['customdata']
+    return trace
+
+
+def compact_figure(figure: dict):
+    """
+    Shrinks the JSON of a figure: hover data deduplicated and numeric arrays sent as base64 typed arrays
+    :param figure: Figure as a dict, e.g. json.loads(fig.to_json())
+    :return: The compacted figure dict
+    """
+    figure = dict(figure)
+    figure['data'] = [_encode_arrays(dedupe_hover_data(dict(trace))) for trace in figure.get('data', [])]
+    if figure.get('frames'):
+        figure['frames'] = [dict(frame, data=[_encode_arrays(dedupe_hover_data(dict(trace)))
+                                              for trace in frame.get('data', [])])
+                            for frame in figure['frames']]
+    return figure
+
+
+def figure_size_report(figures: dict):
+    """
+    Returns the payload size of figures as plain JSON, compacted, and compacted then gzipped
+    :param figures: Dict of name to Plotly figure
+    :return: One dict per figure with the sizes in bytes
+    """
+    rows = []
+    for name, fig in figures.items():
+        figure = json.loads(fig.to_json()) if hasattr(fig, 'to_json') else fig
+        plain = json.dumps(figure, separators=(',', ':'), ensure_ascii=False)
+        compact = json.dumps(compact_figure(figure), separators=(',', ':'), ensure_ascii=False)
+        rows.append(dict(figure=name, json_bytes=len(plain.encode('utf-8')),
+                         compact_bytes=len(compact.encode('utf-8')),
+                         gzip_bytes=len(gzip.compress(compact.encode('utf-8'), 6))))
+    return rows
+
+
+_COMPRESSIBLE_TYPES = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript')
+
+
+def enable_compression(server, min_size: int = 1024, level: int = 6):
+    """
+    Compresses the layout, callback and asset responses of a Flask server with brotli (when installed) or gzip,
+    depending on what the client accepts
+    :param server: Flask server, app.server for a Dash app
+    :param min_size: Smallest response body that is compressed
+    :param level: Compression level
+    """
+    from flask import request
+
+    @server.after_request
+    def compress_response(response):
+        accepted = request.headers.get('Accept-Encoding', '')
+        if (response.direct_passthrough or response.status_code < 200 or response.status_code >= 300
+                or 'Content-Encoding' in response.headers
+                or not response.mimetype or not response.mimetype.startswith(_COMPRESSIBLE_TYPES)):
+            return response
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        if brotli is not None and 'br' in accepted:
+            response.set_data(brotli.compress(body, quality=min(level, 11)))
+            response.headers['Content-Encoding'] = 'br'
+        elif 'gzip' in accepted:
+            response.set_data(gzip.compress(body, level))
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            return response
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Content-Length'] = len(response.get_data())
+        return response
+
+    return compress_response
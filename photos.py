@@ -0,0 +1,333 @@
+import argparse
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import count, span
+
+# PIL and urllib.request are imported on first use, the dashboard starts without them
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) ' \
+             'Chrome/58.0.3029.110 Safari/537.36'
+
+# Width and height of the thumbnails, the size the photos of the similar players radar plot are drawn at
+THUMBNAIL_SIZE = 96
+
+_default_service = None
+
+
+def photo_url(player_photo: str):
+    """
+    Returns the URL a player photo is downloaded from
+    :param player_photo: 'Player Photo' column of the roster
+    :return: URL of the photo on the sofifa CDN
+    """
+    parts = player_photo.split('/')
+    parts[2] = 'cdn.sofifa.net'
+    return '/'.join(parts)
+
+
+def photo_version(url: str):
+    """
+    Returns a short digest of a photo URL, put in the thumbnail URLs so they change when the photo of a player does
+    :param url: URL of the photo
+    :return: Hex digest
+    """
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+
+
+def default_photo_service():
+    """
+    Returns the photo service shared by the figures and routes that were not given one
+    :return: The shared PhotoService
+    """
+    global _default_service
+    if _default_service is None:
+        _default_service = PhotoService()
+    return _default_service
+
+
+def placeholder_image(size: int = 120):
+    """
+    Returns the image shown in place of a player photo that could not be fetched
+    :param size: Width and height of the image in pixels
+    :return: A plain grey PIL image
+    """
+    from PIL import Image
+
+    image = Image.new('RGBA', (size, size), (200, 200, 200, 255))
+    image.info['placeholder'] = True
+    return image
+
+
+def _png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class PhotoService:
+    """
+    Fetches player photos in parallel and keeps them in two caches: content-addressed on-disk stores, bounded in
+    bytes with least-recently-used eviction, and an in-memory LRU of decoded images. The thumbnails have their own
+    store, so downloading the originals of a whole roster does not evict them. Concurrent requests for the same URL
+    share a single download.
+    """
+
+    def __init__(self, cache_dir: str = '.photo_cache', max_disk_bytes: int = 256 * 2 ** 20,
+                 max_memory_items: int = 512, max_workers: int = 8, timeout: float = 5.0,
+                 max_thumbnail_bytes: int = 256 * 2 ** 20):
+        """
+        :param cache_dir: Directory of the on-disk cache
+        :param max_disk_bytes: Size of the store of the original photos above which the least recently used ones
+                               are evicted
+        :param max_memory_items: Number of decoded images kept in memory
+        :param max_workers: Number of download threads
+        :param timeout: Timeout of a single download in seconds
+        :param max_thumbnail_bytes: Size of the store of the thumbnails above which the least recently used ones are
+                                    evicted
+        """
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+        self.thumbnails_dir = os.path.join(cache_dir, 'thumbnails')
+        self.refs_dir = os.path.join(cache_dir, 'refs')
+        for directory in [self.objects_dir, self.thumbnails_dir, self.refs_dir]:
+            os.makedirs(directory, exist_ok=True)
+        self.max_disk_bytes = max_disk_bytes
+        self.max_thumbnail_bytes = max_thumbnail_bytes
+        self.max_memory_items = max_memory_items
+        self.timeout = timeout
+
+        self.max_workers = max_workers
+        self._memory = OrderedDict()
+        self._budgets = {self.objects_dir: max_disk_bytes, self.thumbnails_dir: max_thumbnail_bytes}
+        self._disk_bytes = {directory: sum(entry.stat().st_size for entry in os.scandir(directory))
+                            for directory in self._budgets}
+        self._start()
+        # Threads do not survive a fork, a forked worker gets its own pool
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='photos')
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @staticmethod
+    def _digest(data: bytes):
+        return hashlib.sha256(data).hexdigest()
+
+    def _ref_path(self, url: str):
+        return os.path.join(self.refs_dir, self._digest(url.encode('utf-8')))
+
+    def _write_atomic(self, path: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _read_disk(self, url: str, directory: str = None):
+        try:
+            with open(self._ref_path(url)) as f:
+                object_path = os.path.join(directory or self.objects_dir, f.read().strip())
+            with open(object_path, 'rb') as f:
+                data = f.read()
+            # The object may be evicted by another thread or worker meanwhile, that is a miss too
+            os.utime(object_path)
+        except OSError:
+            return None
+        return data
+
+    def _write_disk(self, url: str, data: bytes, directory: str = None):
+        directory = directory or self.objects_dir
+        digest = self._digest(data)
+        object_path = os.path.join(directory, digest)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, data)
+            with self._lock:
+                self._disk_bytes[directory] += len(data)
+        self._write_atomic(self._ref_path(url), digest.encode('ascii'))
+        if self._disk_bytes[directory] > self._budgets[directory]:
+            self._evict(directory)
+
+    def _evict(self, directory: str):
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self._budgets[directory] * 0.9:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._disk_bytes[directory] = total
+
+    def _download(self, url: str):
+        import urllib.request
+
+        req = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+        with span('photo_download'), urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return response.read()
+
+    def _load(self, url: str):
+        from PIL import Image
+
+        data = self._read_disk(url)
+        if data is None:
+            data = self._download(url)
+            self._write_disk(url, data)
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        with self._lock:
+            self._memory[url] = image
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+        return image
+
+    def _forget(self, url: str):
+        with self._lock:
+            self._in_flight.pop(url, None)
+
+    def submit(self, url: str):
+        """
+        Starts fetching a photo, joining the download already in flight for the same URL
+        :param url: URL of the photo
+        :return: A future resolving to the decoded PIL image
+        """
+        with self._lock:
+            future = self._in_flight.get(url)
+            if future is not None:
+                return future
+            future = self._executor.submit(self._load, url)
+            self._in_flight[url] = future
+        # Outside the lock, the callback runs right away in this thread when the download is already done
+        future.add_done_callback(lambda _: self._forget(url))
+        return future
+
+    def get(self, url: str):
+        """
+        Returns a decoded photo from the in-memory cache, or None when it has not been loaded yet
+        :param url: URL of the photo
+        :return: The PIL image or None
+        """
+        with self._lock:
+            image = self._memory.get(url)
+            if image is not None:
+                self._memory.move_to_end(url)
+            return image
+
+    def fetch_all(self, urls):
+        """
+        Fetches several photos in parallel, replacing the ones that fail or time out by placeholders
+        :param urls: URLs of the photos
+        :return: One PIL image per URL, in the same order
+        """
+        with span('photo_fetch'):
+            images = [self.get(url) for url in urls]
+            futures = {i: self.submit(url) for i, url in enumerate(urls) if images[i] is None}
+            wait(futures.values(), timeout=self.timeout)
+            for i, future in futures.items():
+                try:
+                    images[i] = future.result(timeout=0)
+                except Exception:
+                    images[i] = placeholder_image()
+                    count('photo_fetch_failures_total', 'Player photos replaced by a placeholder')
+        return images
+
+    def thumbnail(self, url: str, size: int = THUMBNAIL_SIZE):
+        """
+        Returns a photo scaled down to fit a size x size box, made from the fetched photo on first request and kept
+        in the on-disk cache with the photos
+        :param url: URL of the photo
+        :param size: Largest width and height in pixels
+        :return: (PNG bytes, digest of the bytes usable as a strong ETag)
+        """
+        key = f'{url}#thumbnail={size}'
+        data = self._read_disk(key, self.thumbnails_dir)
+        if data is None:
+            image = self.get(url) or self.submit(url).result(timeout=self.timeout)
+            with span('photo_thumbnail'):
+                image = image.copy() if image.mode in ('RGB', 'RGBA', 'L', 'LA', 'P') else image.convert('RGBA')
+                image.thumbnail((size, size))
+                data = _png(image)
+            self._write_disk(key, data, self.thumbnails_dir)
+        return data, self._digest(data)
+
+    def prewarm(self, urls, size: int = THUMBNAIL_SIZE):
+        """
+        Makes the thumbnails of many photos, e.g. of a whole roster before it is served
+        :param urls: URLs of the photos
+        :param size: Largest width and height in pixels
+        :return: (number of thumbnails ready, URLs that failed)
+        """
+        # The thumbnails wait for downloads running on the service's own pool, so they run on another one
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnails') as executor:
+            futures = {executor.submit(self.thumbnail, url, size): url for url in urls}
+        failed = [url for future, url in futures.items() if future.exception() is not None]
+        return len(futures) - len(failed), failed
+
+
+def install(server, resolve, photos: PhotoService = None, route: str = '/photos/<dataset>/<int:player_id>.png',
+            size: int = THUMBNAIL_SIZE, max_age: int = 365 * 24 * 3600):
+    """
+    Serves player photo thumbnails on a route, so figures reference them by URL rather than inlining them. Responses
+    carry a strong ETag, and are cached by the browser as immutable when the URL holds the photo_version of the photo.
+    :param server: Flask server, app.server for a Dash app
+    :param resolve: Function taking the dataset key and the player ID and returning the photo URL, None for an
+                    unknown player
+    :param photos: Photo service the photos are fetched with, the shared one by default
+    :param route: Path of the thumbnails, with the dataset and player_id variables
+    :param size: Largest width and height of the thumbnails in pixels
+    :param max_age: Seconds the browser keeps a versioned thumbnail
+    """
+    from flask import Response, abort, request
+
+    @server.route(route)
+    def serve_photo(dataset, player_id):
+        url = resolve(dataset, player_id)
+        if url is None:
+            abort(404)
+        try:
+            data, etag = (photos or default_photo_service()).thumbnail(url, size)
+        except Exception:
+            count('photo_fetch_failures_total', 'Player photos replaced by a placeholder')
+            # Not cached, the next request tries the download again
+            response = Response(_png(placeholder_image(size)), mimetype='image/png')
+            response.cache_control.no_store = True
+            return response
+        response = Response(data, mimetype='image/png')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        if request.args.get('v') == photo_version(url):
+            response.cache_control.max_age = max_age
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Pre-warms the photo thumbnails of every player of a roster')
+    parser.add_argument('csv', help='roster CSV')
+    parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE, help='thumbnail width and height in pixels')
+    parser.add_argument('--workers', type=int, default=8, help='download threads')
+    parser.add_argument('--cache-dir', default='.photo_cache', help='photo cache of the dashboard')
+    parser.add_argument('--max-disk-mb', type=float, default=256, help='size of the original photos in the cache')
+    parser.add_argument('--max-thumbnail-mb', type=float, default=256, help='size of the thumbnails in the cache')
+    args = parser.parse_args()
+
+    from dataset import load_dataset
+
+    start_time = time.perf_counter()
+    urls = [photo_url(photo) for photo in load_dataset(args.csv)['Player Photo'].dropna().unique()]
+    service = PhotoService(args.cache_dir, max_disk_bytes=int(args.max_disk_mb * 2 ** 20), max_workers=args.workers,
+                           max_thumbnail_bytes=int(args.max_thumbnail_mb * 2 ** 20))
+    ready, failed = service.prewarm(urls, args.size)
+    print(f'{ready} thumbnails ready, {len(failed)} failed in {time.perf_counter() - start_time:.2f}s')
@@ -0,0 +1,133 @@
+import threading
+
+from metrics import span
+
+
+def placeholder_figure(text: str = 'Loading...'):
+    """
+    Returns a lightweight figure shown until the real one is built
+    :param text: Text displayed in the middle of the plot area
+    :return: Figure as a plain dict
+    """
+    return {
+        'data': [],
+        'layout': {
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'annotations': [{'text': text, 'showarrow': False, 'font': {'size': 16}}],
+        },
+    }
+
+
+class FigureRegistry:
+    """
+    Figures registered by the dashboard sections, built the first time they are requested and then shared
+    by every session
+    """
+
+    def __init__(self, cache=None, fingerprint: str = None):
+        """
+        :param cache: FigureCache the built figures are stored in, so other workers and restarts reuse them
+        :param fingerprint: Fingerprint of the dataset the builders are given, or a function returning it for a
+                            builder name when figures are versioned separately (see incremental.RosterUpdater)
+        """
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self._builders = {}
+        self._figures = {}
+        self._locks = {}
+
+    def register(self, graph_id: str, builder, *args, **kwargs):
+        """
+        Registers the builder of a figure
+        :param graph_id: ID of the graph component the figure is drawn in
+        :param builder: Function returning the figure
+        :param args: Positional arguments of the builder
+        :param kwargs: Keyword arguments of the builder
+        """
+        self._builders[graph_id] = (builder, args, kwargs)
+        self._locks[graph_id] = threading.Lock()
+
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __contains__(self, graph_id: str):
+        return graph_id in self._builders
+
+    def is_built(self, graph_id: str):
+        return graph_id in self._figures
+
+    def get(self, graph_id: str):
+        """
+        Returns a figure, building it if no request has needed it yet. Concurrent first requests wait for a
+        single build.
+        :param graph_id: ID of the graph component
+        :return: The figure
+        """
+        figure = self._figures.get(graph_id)
+        if figure is None:
+            with self._locks[graph_id]:
+                figure = self._figures.get(graph_id)
+                if figure is None:
+                    builder, args, kwargs = self._builders[graph_id]
+                    if self.cache is None:
+                        with span('build', figure=builder.__name__):
+                            figure = builder(*args, **kwargs)
+                    else:
+                        fingerprint = self.fingerprint(builder.__name__) if callable(self.fingerprint) \
+                            else self.fingerprint
+                        figure = self.cache.figure(builder.__name__, {'graph_id': graph_id}, fingerprint,
+                                                   lambda: builder(*args, **kwargs))
+                    self._figures[graph_id] = figure
+        return figure
+
+    def built(self):
+        """
+        Returns the figures built so far
+        :return: Dict of figures by graph ID
+        """
+        return dict(self._figures)
+
+    def preload(self, figures: dict):
+        """
+        Adds figures built elsewhere, e.g. by a previous process (see snapshot.py), for the registered graph IDs
+        :param figures: Dict of figures by graph ID
+        """
+        for graph_id, figure in figures.items():
+            if graph_id in self._builders:
+                self._figures[graph_id] = figure
+
+    def invalidate(self, builder: str = None):
+        """
+        Drops the built figures, or only those of one builder, so the next request rebuilds them
+        :param builder: Name of the figure builder
+        """
+        for graph_id, (registered, _, _) in self._builders.items():
+            if builder is None or registered.__name__ == builder:
+                with self._locks[graph_id]:
+                    self._figures.pop(graph_id, None)
+
+    def rebind(self, old, new, invalidated=(), publish=None):
+        """
+        Replaces an argument of the registered builders, e.g. the roster after an update, and drops the figures of
+        the invalidated builders. No figure is built meanwhile, so none is built from the old arguments with the
+        fingerprint published alongside the new ones.
+        :param old: Argument to replace, matched by identity
+        :param new: Replacement
+        :param invalidated: Names of the figure builders whose figures are dropped
+        :param publish: Function called while the builds are held off, e.g. publishing the new fingerprints
+        """
+        locks = list(self._locks.values())
+        for lock in locks:
+            lock.acquire()
+        try:
+            for graph_id, (builder, args, kwargs) in list(self._builders.items()):
+                self._builders[graph_id] = (builder, tuple(new if arg is old else arg for arg in args),
+                                            {key: new if value is old else value for key, value in kwargs.items()})
+                if builder.__name__ in invalidated:
+                    self._figures.pop(graph_id, None)
+            if publish is not None:
+                publish()
+        finally:
+            for lock in locks:
+                lock.release()
@@ -0,0 +1,410 @@
+import numpy as np
+import pandas as pd
+
+from dataset import PARSED_COLUMNS
+from name_index import NameIndex
+
+# Columns that are not player attributes and are left out of the similarity features
+NON_FEATURE_COLUMNS = ['Age', 'Nationality', 'Club', 'Value', 'Wage', 'Joined', 'Release Clause', 'Height', 'Weight',
+                       'Name', 'Goalkeeping', 'GK Diving', 'GK Handling', 'GK Kicking', 'GK Positioning',
+                       'GK Reflexes', 'Player Photo', 'Club Logo', 'Flag Photo', 'ID', 'OVA', 'BOV', 'BP', 'Position',
+                       'POT', 'Team & Contract', 'foot', 'Growth', 'Loan Date End', 'Contract', 'W/F', 'SM', 'A/W',
+                       'D/W', 'IR', 'PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY', 'Hits', 'LS', 'ST', 'RS', 'LW', 'LF',
+                       'CF', 'RF', 'RW', 'LAM', 'CAM', 'RAM', 'LM', 'LCM', 'CM', 'RCM', 'RM', 'LWB', 'LDM', 'CDM',
+                       'RDM', 'RWB', 'LB', 'LCB', 'CB', 'RCB', 'RB', 'GK', 'Gender', 'Total Stats', 'Base Stats',
+                       'Vision'] + list(PARSED_COLUMNS.values())
+
+
+def top_k(scores: np.ndarray, k: int):
+    """
+    Returns the positions of the k highest scores
+    :param scores: 1-D array of scores
+    :param k: Number of positions to return
+    :return: Positions ordered from the highest to the lowest score
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+# Subtracted from the cosine similarities of the excluded candidates of a batched query: they rank below every allowed
+# candidate without the runs of equal -inf scores that make argpartition an order of magnitude slower
+EXCLUDED_PENALTY = 4.0
+
+
+def top_k_rows(scores: np.ndarray, k: int):
+    """
+    Returns the positions of the k highest scores of every row
+    :param scores: 2-D array of scores
+    :param k: Number of positions to return per row
+    :return: (rows, k) positions, each row ordered from the highest to the lowest score
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+class ExactIndex:
+    """
+    Brute-force cosine search over every row of a normalized matrix
+    """
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = matrix
+
+    def search(self, vector: np.ndarray, k: int, exclude: int = None):
+        """
+        Returns the k rows with the highest cosine similarity to the vector
+        :param vector: L2-normalized query vector
+        :param k: Number of rows to return
+        :param exclude: Row to leave out of the results, usually the query row itself
+        :return: Row indexes and cosine similarities, ordered from the most to the least similar
+        """
+        scores = self.matrix @ vector
+        if exclude is not None:
+            scores[exclude] = -np.inf
+            k = min(k, len(scores) - 1)
+        top = top_k(scores, k)
+        return top, scores[top]
+
+
+class IVFIndex:
+    """
+    Approximate cosine search with an inverted file: rows are bucketed by their nearest k-means centroid and
+    a query only scores the rows of the n_probe buckets whose centroids are closest to it.
+    Raising n_probe trades speed for recall, n_probe == n_lists is an exact search.
+    """
+
+    def __init__(self, matrix: np.ndarray, n_lists: int = None, n_probe: int = 8, n_iter: int = 10,
+                 sample_size: int = 100_000, seed: int = 0):
+        """
+        Trains the coarse quantizer and builds the inverted lists
+        :param matrix: L2-normalized row vectors
+        :param n_lists: Number of buckets, defaults to about sqrt(N)
+        :param n_probe: Number of buckets scored per query
+        :param n_iter: Number of k-means iterations
+        :param sample_size: Number of rows the centroids are trained on
+        :param seed: Seed of the random generator used for sampling
+        """
+        n_rows = matrix.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+        rng = np.random.default_rng(seed)
+
+        sample = matrix[rng.choice(n_rows, size=min(sample_size, n_rows), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=n_lists) == 0
+            sums[empty] = centroids[empty]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(matrix.dtype)
+
+        assign = self._assign(matrix, centroids)
+        order = np.argsort(assign, kind='stable')
+        self.centroids = centroids
+        self.ids = order.astype(np.int64)
+        self.vectors = np.ascontiguousarray(matrix[order])
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_lists))])
+        self.n_probe = n_probe
+
+    @staticmethod
+    def _assign(rows: np.ndarray, centroids: np.ndarray, block: int = 65536):
+        assign = np.empty(len(rows), dtype=np.int64)
+        for start in range(0, len(rows), block):
+            assign[start:start + block] = np.argmax(rows[start:start + block] @ centroids.T, axis=1)
+        return assign
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def search(self, vector: np.ndarray, k: int, exclude: int = None, n_probe: int = None):
+        """
+        Returns (approximately) the k rows with the highest cosine similarity to the vector
+        :param vector: L2-normalized query vector
+        :param k: Number of rows to return
+        :param exclude: Row to leave out of the results, usually the query row itself
+        :param n_probe: Number of buckets to score, defaults to the index setting
+        :return: Row indexes and cosine similarities, ordered from the most to the least similar
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        lists = top_k(self.centroids @ vector, n_probe)
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+        ids = self.ids[positions]
+        scores = self.vectors[positions] @ vector
+        if exclude is not None:
+            scores[ids == exclude] = -np.inf
+        top = top_k(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return ids[top], scores[top]
+
+
+# Search modes selectable for the similar player finder
+INDEXES = {
+    'exact': ExactIndex,
+    'approximate': IVFIndex,
+}
+
+
+class SimilarityEngine:
+    """
+    Holds the min-max scaled and L2-normalized player attribute matrix of a roster, so that the
+    cosine similarity of one player against every other player is a single matrix-vector product.
+    """
+
+    def __init__(self, fifa: pd.DataFrame, **index_params):
+        """
+        Builds the feature matrix once from the roster
+        :param fifa: The dataframe containing the FIFA game data
+        :param index_params: Keyword arguments passed to the approximate index when it is built
+        """
+        features = fifa.drop(columns=NON_FEATURE_COLUMNS, errors='ignore')
+        values = features.to_numpy(dtype=np.float64)
+        # Blank cells are left out of the bounds and scaled to 0, an all blank feature has NaN bounds
+        col_min = np.fmin.reduce(values, axis=0)
+        col_max = np.fmax.reduce(values, axis=0)
+        col_range = col_max - col_min
+        col_range[col_range == 0] = 1.0
+        scaled = np.nan_to_num((values - col_min) / col_range)
+        norms = np.linalg.norm(scaled, axis=1)
+        norms[norms == 0] = 1.0
+
+        self._attach(
+            matrix=np.ascontiguousarray(scaled / norms[:, None], dtype=np.float32),
+            norms=norms.astype(np.float32),
+            feature_names=list(features.columns),
+            names=fifa['Name'].to_numpy(),
+            ids=fifa['ID'].to_numpy(),
+            rank=fifa['OVA'].to_numpy() if 'OVA' in fifa.columns else None,
+            col_min=col_min,
+            col_max=col_max,
+            index_params=index_params,
+        )
+
+    @classmethod
+    def from_arrays(cls, matrix: np.ndarray, norms: np.ndarray, feature_names, names, ids, rank=None,
+                    col_min: np.ndarray = None, col_max: np.ndarray = None, name_index: NameIndex = None,
+                    **index_params):
+        """
+        Creates an engine over prepared arrays, e.g. the memory-mapped arrays of a feature store
+        :param matrix: (N, F) L2-normalized float32 feature matrix
+        :param norms: (N,) norms of the min-max scaled rows
+        :param feature_names: Names of the F features
+        :param names: Player names
+        :param ids: Player IDs
+        :param rank: Scores ordering namesakes in the name index (e.g. OVA)
+        :param col_min: Per-feature minimum used for scaling
+        :param col_max: Per-feature maximum used for scaling
+        :param name_index: Name index of the same players, e.g. from a startup snapshot, built when not given
+        :param index_params: Keyword arguments passed to the approximate index when it is built
+        :return: The engine
+        """
+        engine = cls.__new__(cls)
+        engine._attach(matrix, norms, list(feature_names), names, ids, rank, col_min, col_max, index_params,
+                       name_index)
+        return engine
+
+    def _attach(self, matrix, norms, feature_names, names, ids, rank, col_min, col_max, index_params,
+                name_index=None):
+        self.matrix = matrix
+        self.norms = norms
+        self.feature_names = feature_names
+        # Arrays are kept as given, so those of a feature store stay memory-mapped and shared between the workers
+        self.names = names if isinstance(names, np.ndarray) else np.asarray(names)
+        self.ids = ids if isinstance(ids, np.ndarray) else np.asarray(ids)
+        self.rank = rank
+        self.col_min = col_min
+        self.col_max = col_max
+        self.name_index = NameIndex(self.names, self.ids, rank) if name_index is None else name_index
+        self.index_params = index_params
+        self.indexes = {'exact': ExactIndex(self.matrix)}
+        self.neighbours = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def find(self, player):
+        """
+        Returns the row of a player
+        :param player: ID of the player, or name (or part of the name) resolved with the name index
+        :return: Row index of the player in the roster
+        """
+        if isinstance(player, str):
+            return self.name_index.resolve(player)
+        return self.name_index.row_of(player)
+
+    def scaled_rows(self, indexes):
+        """
+        Returns the min-max scaled attribute values of the given rows
+        :param indexes: Row indexes of the players
+        :return: A (len(indexes), n_features) array with values in [0, 1]
+        """
+        indexes = np.asarray(indexes)
+        return self.matrix[indexes] * self.norms[indexes, None]
+
+    def index(self, mode: str = 'exact'):
+        """
+        Returns the search index of the given mode, building it on first use
+        :param mode: One of the keys of INDEXES
+        :return: The search index
+        """
+        if mode not in self.indexes:
+            self.indexes[mode] = INDEXES[mode](self.matrix, **self.index_params)
+        return self.indexes[mode]
+
+    def attach_neighbours(self, indices: np.ndarray, scores: np.ndarray):
+        """
+        Attaches a precomputed neighbour table (see neighbours.py), exact queries are then answered by a lookup
+        :param indices: (N, K) neighbour indexes, ordered from the most to the least similar
+        :param scores: (N, K) cosine similarities
+        """
+        if len(indices) != len(self):
+            raise ValueError(f'neighbour table has {len(indices)} rows, the roster has {len(self)} players')
+        self.neighbours = (indices, scores)
+
+    def update_rows(self, keep: np.ndarray, removed_values: np.ndarray, added_values: np.ndarray,
+                    fifa: pd.DataFrame):
+        """
+        Returns an engine with rows dropped and appended, without rebuilding the matrix. Kept rows are only rescaled
+        when the minimum or maximum of a feature changes, and then only in the features that changed. This engine
+        is left as it is, so searches running on it meanwhile keep consistent rows. The new engine has no search
+        index or neighbour table yet, they are rebuilt on first use.
+        :param keep: Boolean mask of the current rows that are kept
+        :param removed_values: Raw feature values of the dropped rows, in feature_names order
+        :param added_values: Raw feature values of the appended rows, in feature_names order
+        :param fifa: The roster after the update, its rows being the kept rows followed by the appended ones
+        :return: (the updated engine, names of the rescaled features)
+        """
+        added_values = np.asarray(added_values, dtype=np.float64).reshape(-1, len(self.feature_names))
+        removed_values = np.asarray(removed_values, dtype=np.float64).reshape(-1, len(self.feature_names))
+        col_min = np.asarray(self.col_min, dtype=np.float64)
+        col_max = np.asarray(self.col_max, dtype=np.float64)
+        # Blank cells are left out of the bounds, as in __init__
+        new_min = np.fmin(col_min, np.fmin.reduce(added_values, axis=0, initial=np.nan))
+        new_max = np.fmax(col_max, np.fmax.reduce(added_values, axis=0, initial=np.nan))
+        # A dropped row holding the extreme value of a feature may take the extreme with it
+        for bound, extreme, reduce in [(new_min, col_min, np.fmin.reduce), (new_max, col_max, np.fmax.reduce)]:
+            lost = (removed_values == extreme).any(axis=0) & (bound == extreme)
+            if lost.any():
+                bound[lost] = reduce(fifa[[self.feature_names[j] for j in np.flatnonzero(lost)]]
+                                     .to_numpy(dtype=np.float64), axis=0, initial=np.nan)
+        moved = ((new_min != col_min) | (new_max != col_max)) & ~(np.isnan(new_min) & np.isnan(col_min))
+        rescaled = np.flatnonzero(moved)
+
+        col_range = new_max - new_min
+        col_range[col_range == 0] = 1.0
+        added = np.nan_to_num((added_values - new_min) / col_range)
+        if len(rescaled):
+            kept = self.matrix[keep].astype(np.float64) * self.norms[keep, None]
+            raw = fifa[[self.feature_names[j] for j in rescaled]].to_numpy(dtype=np.float64)[:len(kept)]
+            kept[:, rescaled] = np.nan_to_num((raw - new_min[rescaled]) / col_range[rescaled])
+            scaled = np.concatenate([kept, added])
+            norms = np.linalg.norm(scaled, axis=1)
+            norms[norms == 0] = 1.0
+            matrix = scaled / norms[:, None]
+        else:
+            added_norms = np.linalg.norm(added, axis=1)
+            added_norms[added_norms == 0] = 1.0
+            norms = np.concatenate([self.norms[keep], added_norms])
+            matrix = np.concatenate([self.matrix[keep], added / added_norms[:, None]])
+
+        names = fifa['Name'].to_numpy()
+        ids = fifa['ID'].to_numpy()
+        rank = fifa['OVA'].to_numpy() if 'OVA' in fifa.columns else None
+        engine = self.__class__.__new__(self.__class__)
+        engine._attach(
+            matrix=np.ascontiguousarray(matrix, dtype=np.float32),
+            norms=norms.astype(np.float32),
+            feature_names=self.feature_names,
+            names=names,
+            ids=ids,
+            rank=rank,
+            col_min=new_min,
+            col_max=new_max,
+            index_params=self.index_params,
+            name_index=self.name_index.updated(keep, names, ids, rank),
+        )
+        return engine, [self.feature_names[j] for j in rescaled]
+
+    def query(self, index: int, k: int = 3, mode: str = 'exact'):
+        """
+        Returns the k players most similar to the player at the given row, the player itself excluded
+        :param index: Row index of the player
+        :param k: Number of similar players to return
+        :param mode: Search mode, 'exact' or 'approximate'
+        :return: Row indexes and cosine similarities, ordered from the most to the least similar
+        """
+        if mode == 'exact' and self.neighbours is not None and k <= self.neighbours[0].shape[1]:
+            indices, scores = self.neighbours
+            return indices[index, :k].astype(np.intp), scores[index, :k]
+        return self.index(mode).search(self.matrix[index], k, exclude=index)
+
+    def query_among(self, index: int, candidates: np.ndarray, k: int = 3):
+        """
+        Returns the k players most similar to the player at the given row amongst candidate rows, the player itself
+        excluded. Only the candidates are scored, so k players are returned whenever k candidates exist.
+        :param index: Row index of the player
+        :param candidates: Sorted row indexes of the candidates, e.g. resolved by filters.FilterIndex.mask
+        :param k: Number of similar players to return
+        :return: Row indexes and cosine similarities, ordered from the most to the least similar
+        """
+        candidates = np.asarray(candidates, dtype=np.intp)
+        candidates = candidates[candidates != index]
+        if len(candidates) > len(self) // 4:
+            # Large candidate sets are picked from the scores of every row, a contiguous product cheaper than
+            # gathering their rows of the matrix
+            scores = (self.matrix @ self.matrix[index]).take(candidates)
+        else:
+            scores = self.matrix[candidates] @ self.matrix[index]
+        top = top_k(scores, k)
+        return candidates[top], scores[top]
+
+    def query_batch(self, indexes, k: int = 3, allowed: np.ndarray = None, block: int = 8192):
+        """
+        Returns the k players most similar to each of the players at the given rows, scored with one matrix product
+        per block of candidates. The query players are left out of every result.
+        :param indexes: Row indexes of the players
+        :param k: Number of similar players to return per player
+        :param allowed: Boolean mask of the candidates, (N,) for every player or (len(indexes), N) per player
+        :param block: Number of candidates scored per matrix product, the scores of a block of a full squad stay
+                      in the CPU cache
+        :return: (len(indexes), k) row indexes and cosine similarities, each row ordered from the most to the least
+                 similar. Rows with fewer than k allowed candidates are padded with -1 and -inf.
+        """
+        indexes = np.asarray(indexes, dtype=np.intp)
+        queries = self.matrix[indexes]
+        tops, top_scores = [], []
+        for start in range(0, len(self), block):
+            stop = min(start + block, len(self))
+            scores = queries @ self.matrix[start:stop].T
+            if allowed is not None:
+                scores -= np.float32(EXCLUDED_PENALTY) * ~allowed[..., start:stop]
+            own = (indexes >= start) & (indexes < stop)
+            scores[:, indexes[own] - start] -= np.float32(EXCLUDED_PENALTY)
+            top = top_k_rows(scores, k)
+            tops.append(top + start)
+            top_scores.append(np.take_along_axis(scores, top, axis=1))
+        candidates = np.concatenate(tops, axis=1)
+        scores = np.concatenate(top_scores, axis=1)
+        top = top_k_rows(scores, k)
+        candidates = np.take_along_axis(candidates, top, axis=1)
+        scores = np.take_along_axis(scores, top, axis=1)
+        # Allowed candidates score at least -1 and excluded ones at most 1 - EXCLUDED_PENALTY
+        excluded = scores < -EXCLUDED_PENALTY / 2
+        candidates[excluded] = -1
+        scores[excluded] = -np.inf
+        if candidates.shape[1] < k:
+            padding = k - candidates.shape[1]
+            candidates = np.pad(candidates, ((0, 0), (0, padding)), constant_values=-1)
+            scores = np.pad(scores, ((0, 0), (0, padding)), constant_values=-np.inf)
+        return candidates, scores
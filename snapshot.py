@@ -0,0 +1,121 @@
+"""
+Startup snapshots of the datasets: the parsed roster, its name and filter indexes and its built section figures
+pickled into one file, loaded in one read on the next start instead of being parsed, indexed and rebuilt.
+
+A snapshot starts with a header carrying the snapshot version, the fingerprint of the roster CSV and a digest of
+the dashboard's source files. A snapshot whose header does not match is stale and ignored without unpickling the
+rest, so an edited roster or a deploy of new code starts from the CSV and binary caches again.
+
+Build the snapshots of the configured datasets ahead of a deploy with:
+python snapshot.py
+"""
+import glob
+import hashlib
+import os
+import pickle
+import sys
+
+from dataset import artifact_stem, fingerprint
+
+# Bumped whenever the content of the snapshots changes
+SNAPSHOT_VERSION = 2
+
+_code_digest = None
+
+
+def code_digest():
+    """
+    Returns a digest of the Python sources next to this module, the classes a snapshot unpickles into
+    :return: Hex digest
+    """
+    global _code_digest
+    if _code_digest is None:
+        digest = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+            with open(path, 'rb') as f:
+                digest.update(os.path.basename(path).encode('utf-8') + b'\0' + f.read())
+        _code_digest = digest.hexdigest()[:16]
+    return _code_digest
+
+
+def snapshot_path(csv_path: str, root: str = '.snapshots'):
+    """
+    Returns the path of the snapshot of a roster
+    :param csv_path: Path of the roster CSV
+    :param root: Directory holding the snapshots
+    :return: Path of the snapshot file
+    """
+    return os.path.join(root, f'{artifact_stem(csv_path)}-{fingerprint(csv_path)}.pkl')
+
+
+def _header(csv_path: str):
+    return {'version': SNAPSHOT_VERSION, 'source_fingerprint': fingerprint(csv_path), 'code': code_digest(),
+            'python': list(sys.version_info[:2])}
+
+
+def load_snapshot(csv_path: str, root: str = '.snapshots'):
+    """
+    Loads the snapshot of a roster
+    :param csv_path: Path of the roster CSV
+    :param root: Directory holding the snapshots
+    :return: Dict with the roster 'fifa', its 'name_index' and 'filters', the approximate search 'indexes' by mode
+             and the 'index_params' they were built with, the built 'figures' by graph ID and whether they are
+             'compact' (see figure_cache.FigureCache), or None when there is no current snapshot
+    """
+    try:
+        with open(snapshot_path(csv_path, root), 'rb') as f:
+            if pickle.load(f) != _header(csv_path):
+                return None
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_snapshot(dataset, root: str = '.snapshots'):
+    """
+    Writes the snapshot of a dataset: its roster as loaded, its name and filter indexes and the search indexes and
+    section figures built so far
+    :param dataset: The datasets.Dataset
+    :return: Path of the snapshot, None when delta files were applied to the roster since it was loaded
+    """
+    current = dataset.state
+    if current.fifa is not dataset.fifa:
+        return None
+    state = {
+        'fifa': dataset.fifa,
+        'name_index': current.engine.name_index,
+        'filters': current.filters,
+        'indexes': {mode: index for mode, index in current.engine.indexes.items() if mode != 'exact'},
+        'index_params': current.engine.index_params,
+        'figures': dataset.registry.built(),
+        'compact': getattr(dataset.registry.cache, 'compact', None),
+    }
+    path = snapshot_path(dataset.path, root)
+    os.makedirs(root, exist_ok=True)
+    for stale in glob.glob(os.path.join(glob.escape(root), f'{glob.escape(artifact_stem(dataset.path))}-*.pkl')):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        pickle.dump(_header(dataset.path), f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    return path
+
+
+if __name__ == "__main__":
+    import time
+
+    import app as dashboard
+
+    root = dashboard.datasets.snapshot_dir or '.snapshots'
+    for key in dashboard.datasets:
+        start_time = time.perf_counter()
+        dataset = dashboard.datasets.get(key)
+        for graph_id in dataset.registry:
+            dataset.registry.get(graph_id)
+        dataset.engine.index('approximate')
+        print(f'{key}: wrote {save_snapshot(dataset, root)} in {time.perf_counter() - start_time:.2f}s')
@@ -0,0 +1,78 @@
+"""
+Squad replacement finder: the most similar players to every player of a squad, found with one batched query of the
+similarity engine (see similarity.SimilarityEngine.query_batch) over the candidates within the Value and Wage caps.
+
+An optional total budget is split across the squad in proportion to the Value of its players, and each player's
+replacements cost at most their share, so picking the first replacement of every player stays within the budget.
+The squad players are never offered as replacements for each other.
+"""
+import numpy as np
+import pandas as pd
+
+from similarity import SimilarityEngine
+
+# Largest squad the dashboard panel accepts
+MAX_SQUAD = 25
+
+# Roster columns shown with every replacement
+COLUMNS = ['Name', 'ID', 'Club', 'BP', 'Age', 'OVA', 'Value in €', 'Wage in €']
+
+
+def allocate_budget(values: np.ndarray, budget: float):
+    """
+    Splits a total budget across the players of a squad in proportion to their Value, evenly when the squad is free
+    :param values: Value of the squad players in €, missing values counting as 0
+    :param budget: Total budget in €
+    :return: Budget of every player in €
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    total = values.sum()
+    if total <= 0:
+        return np.full(len(values), budget / max(len(values), 1))
+    return budget * values / total
+
+
+def find_replacements(fifa: pd.DataFrame, engine: SimilarityEngine, squad, k: int = 3, max_value: float = None,
+                      max_wage: float = None, budget: float = None):
+    """
+    Returns the k most similar affordable players to every player of a squad
+    :param fifa: The dataframe containing the FIFA game data, with the parsed columns of dataset.parse_units
+    :param engine: Similarity engine built from the same dataframe
+    :param squad: IDs of the squad players, unknown IDs are left out
+    :param k: Number of replacements per squad player
+    :param max_value: Largest Value of a replacement in €, None for no cap
+    :param max_wage: Largest Wage of a replacement in €, None for no cap
+    :param budget: Total budget of the replacements of the whole squad in €, see allocate_budget
+    :return: One row per squad player and replacement with the 'Player' replaced, its 'Player ID', the 'Budget'
+             allocated to it, the 'Rank' of the replacement, its COLUMNS and 'Similarity'. Squad players with fewer
+             than k affordable candidates have fewer rows.
+    """
+    squad = [player for player in dict.fromkeys(squad) if player in engine.name_index]
+    rows = np.array([engine.name_index.row_of(player) for player in squad], dtype=np.intp)
+    values = fifa['Value in €'].to_numpy(dtype=np.float64)
+
+    # A missing Value or Wage never passes a cap
+    allowed = np.ones(len(fifa), dtype=bool)
+    if max_value is not None:
+        allowed &= values <= max_value
+    if max_wage is not None:
+        allowed &= fifa['Wage in €'].to_numpy(dtype=np.float64) <= max_wage
+    budgets = np.full(len(rows), np.nan)
+    if budget is not None:
+        budgets = allocate_budget(values.take(rows), budget)
+        allowed = allowed[None, :] & (values[None, :] <= budgets[:, None])
+
+    candidates, scores = engine.query_batch(rows, k, allowed=allowed)
+    slot, rank = np.nonzero(candidates >= 0)
+    found = candidates[slot, rank]
+    replacements = {
+        'Player': engine.names[rows.take(slot)],
+        'Player ID': engine.ids[rows.take(slot)],
+        'Budget': budgets.take(slot),
+        'Rank': rank + 1,
+    }
+    for column in COLUMNS:
+        if column in fifa.columns:
+            replacements[column] = fifa[column].take(found).to_numpy()
+    replacements['Similarity'] = scores[slot, rank]
+    return pd.DataFrame(replacements)
@@ -0,0 +1,89 @@
+"""
+Cold-start report of the dashboard: the time spent in every startup phase, marked by app.py and wsgi.py as they
+run, and the slowest imports.
+
+Run python startup.py to start the dashboard in a child interpreter with -X importtime and print both, or
+python startup.py wsgi to include the warm-up of the production server.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import metrics
+
+_last = time.perf_counter()
+
+# (phase, seconds) in the order the phases ended
+PHASES = []
+
+
+def mark(phase: str):
+    """
+    Records the time since the previous mark, or since this module was imported, as a startup phase. Phases are also
+    observed in the span_seconds histogram with span='startup'.
+    :param phase: Name of the phase that just ended
+    """
+    global _last
+    now = time.perf_counter()
+    PHASES.append((phase, now - _last))
+    metrics.span_histogram().observe(now - _last, span='startup', phase=phase)
+    _last = now
+
+
+def phases():
+    """
+    Returns the startup phases recorded so far
+    :return: List of {'phase', 'seconds'} dicts
+    """
+    return [{'phase': phase, 'seconds': round(seconds, 4)} for phase, seconds in PHASES]
+
+
+def parse_importtime(log: str):
+    """
+    Parses the output of python -X importtime
+    :param log: Standard error of the interpreter
+    :return: List of (module, self seconds, cumulative seconds, depth) in import order
+    """
+    imports = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        imports.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return imports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('module', nargs='?', default='app', help='module to start, app or wsgi')
+    parser.add_argument('--top', type=int, default=15, help='number of imports listed')
+    args = parser.parse_args()
+
+    # The dashboard modules are importable from any working directory, the one the roster paths are relative to
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    start_time = time.perf_counter()
+    child = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                            f'import {args.module}, json, startup; print(json.dumps(startup.phases()))'],
+                           capture_output=True, text=True, env=env)
+    total = time.perf_counter() - start_time
+    if child.returncode != 0:
+        sys.exit(child.stderr)
+    imports = parse_importtime(child.stderr)
+
+    print(f'Started {args.module} in {total:.3f}s, interpreter start-up included')
+    print('\nPhases:')
+    for entry in json.loads(child.stdout.strip().splitlines()[-1]):
+        print(f'  {entry["seconds"] * 1000:9.1f} ms  {entry["phase"]}')
+    print(f'\nSlowest packages and modules (cumulative), of {sum(s for _, s, _, _ in imports):.3f}s spent importing:')
+    packages = [i for i in imports if '.' not in i[0] and i[0] not in (args.module, 'startup')]
+    for name, _, cumulative, _ in sorted(packages, key=lambda i: -i[2])[:args.top]:
+        print(f'  {cumulative * 1000:9.1f} ms  {name}')
+    print('\nSlowest modules (self):')
+    for name, own, _, _ in sorted(imports, key=lambda i: -i[1])[:args.top]:
+        print(f'  {own * 1000:9.1f} ms  {name}')
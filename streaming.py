@@ -0,0 +1,287 @@
+"""
+Streaming ingestion of roster files larger than memory. The CSV is read in chunks and every chunk is folded into
+mergeable partial aggregates: the group totals behind the grouped figures, the top rows of the ranked figures and
+the bounds and 2D histograms of the scatter charts. Peak memory depends on the chunk size, not on the file size.
+
+stream_roster returns a small stand-in roster holding only the rows the figures draw, with the full-file
+summaries and densities memoized on it, so the builders of figures.py give the same figures as on the whole file.
+"""
+import numpy as np
+import pandas as pd
+
+import aggregates
+import lod
+from aggregates import MEAN_COLUMNS, group_totals, totals_summary
+from dataset import PARSED_COLUMNS, parse_units
+
+DEFAULT_CHUNKSIZE = 100000
+
+# Position of a row in the file, ties of the ranked figures are kept in file order
+ROW_COLUMN = '_row'
+
+# Ranked figures: (column ranked by, number of players, filter of the eligible players), see figures.best_players
+# and figures.highest_potential
+TOP_ROWS = {
+    'best_players': ('OVA', 100, None),
+    'highest_potential': ('POT', 50, lambda rows: (rows['OVA'] != rows['POT']) & (rows['Age'] < 25)),
+}
+
+# Axes of the scatter charts, see figures.height_vs_weight_variation and figures.distibution_of_market_value_and_wage
+SCATTERS = [('Weight in lb', 'Ht in cm'), ('Value in €', 'Wage in €')]
+
+
+def read_chunks(path: str, chunksize: int = DEFAULT_CHUNKSIZE, usecols=None):
+    """
+    Reads a roster CSV chunk by chunk, with its unit-bearing columns parsed
+    :param path: Path of the CSV file
+    :param chunksize: Number of rows per chunk
+    :param usecols: Columns to read, all of them by default
+    :return: Iterator of parsed dataframes
+    """
+    for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols):
+        yield parse_units(chunk)
+
+
+class GroupTotals:
+    """
+    Totals of a grouping key (see aggregates.group_totals), summed chunk by chunk
+    """
+
+    def __init__(self, key: str):
+        """
+        :param key: Column to group by
+        """
+        self.key = key
+        self.totals = None
+
+    def update(self, rows: pd.DataFrame):
+        """
+        Adds the totals of a chunk
+        :param rows: Parsed chunk of the roster
+        """
+        self.merge_totals(group_totals(rows, self.key))
+
+    def merge_totals(self, totals: pd.DataFrame):
+        """
+        Adds totals computed elsewhere
+        :param totals: Totals of the same key, see aggregates.group_totals
+        """
+        self.totals = totals if self.totals is None else self.totals.add(totals, fill_value=0)
+
+    def summary(self):
+        """
+        Returns the totals in the format of aggregates.group_summary
+        """
+        return totals_summary(self.totals, self.key)
+
+
+class TopRows:
+    """
+    The rows with the largest values of a column, kept in descending order with ties in file order
+    """
+
+    def __init__(self, column: str, n: int, where=None):
+        """
+        :param column: Column ranked by
+        :param n: Number of rows kept
+        :param where: Function returning the mask of the eligible rows of a chunk, all rows by default
+        """
+        self.column = column
+        self.n = n
+        self.where = where
+        self.rows = None
+
+    def update(self, rows: pd.DataFrame):
+        """
+        Merges the top rows of a chunk
+        :param rows: Parsed chunk of the roster, with its ROW_COLUMN
+        """
+        if self.where is not None:
+            rows = rows[self.where(rows)]
+        self.merge_rows(rows.nlargest(self.n, self.column))
+
+    def merge_rows(self, rows: pd.DataFrame):
+        """
+        Merges candidate rows
+        :param rows: Rows with their ROW_COLUMN
+        """
+        if self.rows is not None:
+            rows = pd.concat([self.rows, rows])
+        self.rows = rows.sort_values([self.column, ROW_COLUMN], ascending=[False, True]).head(self.n)
+
+
+class ScatterSketch:
+    """
+    Point count and bounds of a scatter chart, with its points while there are few enough to draw them and,
+    after a second pass over the file, its full-extent density
+    """
+
+    def __init__(self, x: str, y: str, max_points: int = lod.LOD_MAX_POINTS, bins: int = lod.LOD_BINS):
+        """
+        :param x: Column on the x axis
+        :param y: Column on the y axis
+        :param max_points: Largest number of points drawn individually, see lod.lod_scatter
+        :param bins: Number of bins per axis of the density
+        """
+        self.x = x
+        self.y = y
+        self.max_points = max_points
+        self.bins = bins
+        self.count = 0
+        self.bounds = np.array([np.inf, -np.inf, np.inf, -np.inf])
+        self.points = pd.DataFrame()
+        self.counts = None
+        self.edges = None
+
+    def _finite(self, rows: pd.DataFrame):
+        xs = rows[self.x].to_numpy(dtype=np.float64)
+        ys = rows[self.y].to_numpy(dtype=np.float64)
+        finite = np.isfinite(xs) & np.isfinite(ys)
+        return xs[finite], ys[finite], finite
+
+    def update(self, rows: pd.DataFrame):
+        """
+        Adds the points of a chunk
+        :param rows: Parsed chunk of the roster, with its ROW_COLUMN
+        """
+        xs, ys, finite = self._finite(rows)
+        if len(xs):
+            self.merge_sketch(len(xs), np.array([xs.min(), xs.max(), ys.min(), ys.max()]), rows[finite])
+
+    def merge_sketch(self, count: int, bounds: np.ndarray, points):
+        """
+        Adds points summarized elsewhere
+        :param count: Number of points
+        :param bounds: [x min, x max, y min, y max] of the points
+        :param points: Rows of the points with their ROW_COLUMN, None when they were dropped
+        """
+        self.count += count
+        self.bounds = np.array([min(self.bounds[0], bounds[0]), max(self.bounds[1], bounds[1]),
+                                min(self.bounds[2], bounds[2]), max(self.bounds[3], bounds[3])])
+        if self.count > self.max_points:
+            # Drawn as a density, the points are not needed anymore
+            self.points = None
+        elif self.points is not None and points is not None:
+            self.points = pd.concat([self.points, points]) if len(self.points) else points
+
+    @property
+    def needs_density(self):
+        """
+        Whether the chart is drawn as a density, which takes a second pass over the file
+        """
+        return self.count > self.max_points
+
+    def bin(self, rows: pd.DataFrame):
+        """
+        Adds the points of a chunk to the density, in the second pass
+        :param rows: Parsed chunk of the roster, with the scatter columns
+        """
+        xs, ys, _ = self._finite(rows)
+        counts, x_edges, y_edges = lod.histogram2d(xs, ys, self.bounds[:2], self.bounds[2:], self.bins)
+        self.counts = counts if self.counts is None else self.counts + counts
+        self.edges = (x_edges, y_edges)
+
+
+class RosterSummary:
+    """
+    Mergeable partial aggregates of every figure, updated chunk by chunk. Summaries of consecutive parts of a
+    file can be built separately and merged in file order.
+    """
+
+    def __init__(self, keys=tuple(MEAN_COLUMNS), top_rows: dict = None, scatters=None,
+                 max_points: int = lod.LOD_MAX_POINTS, bins: int = lod.LOD_BINS):
+        """
+        :param keys: Columns grouped by
+        :param top_rows: Ranked figures, TOP_ROWS by default
+        :param scatters: Axes of the scatter charts, SCATTERS by default
+        :param max_points: Largest number of points drawn individually, see lod.lod_scatter
+        :param bins: Number of bins per axis of the densities
+        """
+        top_rows = TOP_ROWS if top_rows is None else top_rows
+        self.n_rows = 0
+        self.groups = {key: GroupTotals(key) for key in keys}
+        self.top_rows = {name: TopRows(*spec) for name, spec in top_rows.items()}
+        self.scatters = [ScatterSketch(x, y, max_points, bins) for x, y in (SCATTERS if scatters is None else scatters)]
+
+    def update(self, chunk: pd.DataFrame):
+        """
+        Folds the next chunk of the file into the aggregates
+        :param chunk: Parsed chunk of the roster
+        """
+        chunk = chunk.assign(**{ROW_COLUMN: np.arange(self.n_rows, self.n_rows + len(chunk))})
+        for part in [*self.groups.values(), *self.top_rows.values(), *self.scatters]:
+            part.update(chunk)
+        self.n_rows += len(chunk)
+
+    def merge(self, other):
+        """
+        Merges the summary of the part of the file following the rows summarized so far
+        :param other: RosterSummary with the same keys, ranked figures and scatters
+        """
+        def shifted(rows):
+            return rows if rows is None or not len(rows) else rows.assign(**{ROW_COLUMN: rows[ROW_COLUMN] + self.n_rows})
+
+        for key, group in self.groups.items():
+            if other.groups[key].totals is not None:
+                group.merge_totals(other.groups[key].totals)
+        for name, top in self.top_rows.items():
+            if other.top_rows[name].rows is not None:
+                top.merge_rows(shifted(other.top_rows[name].rows))
+        for scatter, theirs in zip(self.scatters, other.scatters):
+            if theirs.count:
+                scatter.merge_sketch(theirs.count, theirs.bounds, shifted(theirs.points))
+        self.n_rows += other.n_rows
+
+    def density_columns(self):
+        """
+        Returns the CSV columns the second pass has to read, empty when no scatter is drawn as a density
+        """
+        sources = {parsed: column for column, parsed in PARSED_COLUMNS.items()}
+        return sorted({sources.get(axis, axis) for scatter in self.scatters if scatter.needs_density
+                       for axis in [scatter.x, scatter.y]})
+
+    def bin(self, chunk: pd.DataFrame):
+        """
+        Folds the next chunk of the file into the densities, in the second pass
+        :param chunk: Parsed chunk of the roster, with at least the density_columns
+        """
+        for scatter in self.scatters:
+            if scatter.needs_density:
+                scatter.bin(chunk)
+
+    def frame(self):
+        """
+        Returns the stand-in roster: the rows drawn by the ranked and scatter figures in file order, with the
+        summaries of aggregates.group_summary and the densities of lod.lod_scatter memoized on it
+        :return: The dataframe to pass to the figure builders
+        """
+        kept = [top.rows for top in self.top_rows.values() if top.rows is not None]
+        kept += [scatter.points for scatter in self.scatters if scatter.points is not None and len(scatter.points)]
+        fifa = pd.concat(kept).drop_duplicates(ROW_COLUMN).sort_values(ROW_COLUMN) if kept else pd.DataFrame(
+            columns=[ROW_COLUMN])
+        fifa = fifa.drop(columns=ROW_COLUMN).reset_index(drop=True)
+        for key, group in self.groups.items():
+            if group.totals is not None:
+                aggregates.remember(fifa, key, group.summary())
+        for scatter in self.scatters:
+            if scatter.counts is not None:
+                lod.remember_density(fifa, scatter.x, scatter.y, scatter.counts, *scatter.edges)
+        return fifa
+
+
+def stream_roster(path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+    """
+    Summarizes a roster CSV chunk by chunk, in one pass plus a second pass over the scatter columns when a
+    scatter chart has too many points to draw them individually
+    :param path: Path of the CSV file
+    :param chunksize: Number of rows per chunk
+    :return: (stand-in roster for the figure builders, see RosterSummary.frame, the RosterSummary)
+    """
+    summary = RosterSummary()
+    for chunk in read_chunks(path, chunksize):
+        summary.update(chunk)
+    columns = summary.density_columns()
+    if columns:
+        for chunk in read_chunks(path, chunksize, usecols=columns):
+            summary.bin(chunk)
+    return summary.frame(), summary
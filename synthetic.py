@@ -0,0 +1,176 @@
+"""
+Synthetic rosters with the schema and string formats of cleaned_fifa21_male2.csv, for benchmarks.
+
+Run with:
+python synthetic.py 100000 synthetic_100k.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+ATTRIBUTE_COLUMNS = ['Crossing', 'Finishing', 'Heading Accuracy', 'Short Passing', 'Volleys', 'Dribbling', 'Curve',
+                     'FK Accuracy', 'Long Passing', 'Ball Control', 'Acceleration', 'Sprint Speed', 'Agility',
+                     'Reactions', 'Balance', 'Shot Power', 'Jumping', 'Stamina', 'Strength', 'Long Shots',
+                     'Aggression', 'Interceptions', 'Positioning', 'Vision', 'Penalties', 'Composure', 'Marking',
+                     'Standing Tackle', 'Sliding Tackle', 'GK Diving', 'GK Handling', 'GK Kicking', 'GK Positioning',
+                     'GK Reflexes']
+
+# Attribute totals of the CSV, each the sum of its attributes
+TOTAL_COLUMNS = {
+    'Attacking': ['Crossing', 'Finishing', 'Heading Accuracy', 'Short Passing', 'Volleys'],
+    'Skill': ['Dribbling', 'Curve', 'FK Accuracy', 'Long Passing', 'Ball Control'],
+    'Movement': ['Acceleration', 'Sprint Speed', 'Agility', 'Reactions', 'Balance'],
+    'Power': ['Shot Power', 'Jumping', 'Stamina', 'Strength', 'Long Shots'],
+    'Mentality': ['Aggression', 'Interceptions', 'Positioning', 'Vision', 'Penalties', 'Composure'],
+    'Defending': ['Marking', 'Standing Tackle', 'Sliding Tackle'],
+    'Goalkeeping': ['GK Diving', 'GK Handling', 'GK Kicking', 'GK Positioning', 'GK Reflexes'],
+}
+
+POSITION_RATINGS = ['LS', 'ST', 'RS', 'LW', 'LF', 'CF', 'RF', 'RW', 'LAM', 'CAM', 'RAM', 'LM', 'LCM', 'CM', 'RCM',
+                    'RM', 'LWB', 'LDM', 'CDM', 'RDM', 'RWB', 'LB', 'LCB', 'CB', 'RCB', 'RB', 'GK']
+
+COLUMNS = ['ID', 'Name', 'Age', 'OVA', 'Nationality', 'Club', 'BOV', 'BP', 'Position', 'Player Photo', 'Club Logo',
+           'Flag Photo', 'POT', 'Team & Contract', 'Height', 'Weight', 'foot', 'Growth', 'Joined', 'Loan Date End',
+           'Value', 'Wage', 'Release Clause', 'Contract', 'Attacking', 'Crossing', 'Finishing', 'Heading Accuracy',
+           'Short Passing', 'Volleys', 'Skill', 'Dribbling', 'Curve', 'FK Accuracy', 'Long Passing', 'Ball Control',
+           'Movement', 'Acceleration', 'Sprint Speed', 'Agility', 'Reactions', 'Balance', 'Power', 'Shot Power',
+           'Jumping', 'Stamina', 'Strength', 'Long Shots', 'Mentality', 'Aggression', 'Interceptions', 'Positioning',
+           'Vision', 'Penalties', 'Composure', 'Defending', 'Marking', 'Standing Tackle', 'Sliding Tackle',
+           'Goalkeeping', 'GK Diving', 'GK Handling', 'GK Kicking', 'GK Positioning', 'GK Reflexes', 'Total Stats',
+           'Base Stats', 'W/F', 'SM', 'A/W', 'D/W', 'IR', 'PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY', 'Hits'] \
+          + POSITION_RATINGS + ['Gender']
+
+# Best positions with their share of the roster and the attribute groups they are strong in
+_POSITIONS = {
+    'GK': (0.11, ['GK']), 'CB': (0.19, ['DEF', 'PHY']), 'LB': (0.06, ['DEF', 'PAC']), 'RB': (0.06, ['DEF', 'PAC']),
+    'CDM': (0.07, ['DEF', 'PAS']), 'CM': (0.11, ['PAS']), 'CAM': (0.08, ['PAS', 'DRI']),
+    'LM': (0.05, ['PAC', 'DRI']), 'RM': (0.05, ['PAC', 'DRI']), 'LW': (0.02, ['PAC', 'DRI']),
+    'RW': (0.02, ['PAC', 'DRI']), 'ST': (0.17, ['SHO', 'PHY']), 'CF': (0.01, ['SHO', 'DRI']),
+}
+_ATTRIBUTE_GROUPS = {
+    'PAC': ['Acceleration', 'Sprint Speed', 'Agility'],
+    'SHO': ['Finishing', 'Volleys', 'Shot Power', 'Long Shots', 'Positioning', 'Penalties'],
+    'PAS': ['Crossing', 'Short Passing', 'Long Passing', 'Vision', 'Curve', 'FK Accuracy'],
+    'DRI': ['Dribbling', 'Ball Control', 'Balance', 'Agility'],
+    'DEF': ['Marking', 'Standing Tackle', 'Sliding Tackle', 'Interceptions', 'Heading Accuracy'],
+    'PHY': ['Strength', 'Stamina', 'Jumping', 'Aggression'],
+    'GK': ['GK Diving', 'GK Handling', 'GK Kicking', 'GK Positioning', 'GK Reflexes'],
+}
+_FIRST_NAMES = ['Lucas', 'Mateo', 'João', 'Luka', 'Kylian', 'Mohamed', 'Sergio', 'Thomas', 'Jan', 'Ángel', 'Hugo',
+                'Marco', 'Kevin', 'Jesús', 'Noah', 'Ali', 'Kim', 'Ivan', 'Sadio', 'Hakim', 'Raphaël', 'Erling']
+_LAST_SYLLABLES = ['san', 'ko', 'mar', 'tín', 'ez', 'ra', 'vić', 'ller', 'son', 'do', 'ga', 'bé', 'lo', 'ni',
+                   'ber', 'ski', 'ci', 'ño', 'ran', 'de']
+
+
+def _feet_inches(cm: np.ndarray):
+    inches = np.round(cm / 2.54).astype(int)
+    return [f"{i // 12}'{i % 12}\"" for i in inches]
+
+
+def _money(amounts: np.ndarray):
+    values = []
+    for amount in amounts:
+        if amount >= 1e6:
+            values.append(f'€{amount / 1e6:.1f}M'.replace('.0M', 'M'))
+        elif amount >= 1e3:
+            values.append(f'€{amount / 1e3:.0f}K')
+        else:
+            values.append(f'€{amount:.0f}')
+    return values
+
+
+def synthetic_roster(n_rows: int, seed: int = 0):
+    """
+    Generates a roster with the columns and string formats of the FIFA 21 CSV: heights like 5'11", weights like
+    159lbs, and Value, Wage and Release Clause like €110.5M or €560K
+    :param n_rows: Number of players
+    :param seed: Seed of the random generator
+    :return: The dataframe, as pd.read_csv would return it
+    """
+    rng = np.random.default_rng(seed)
+    positions = list(_POSITIONS)
+    weights = np.array([_POSITIONS[p][0] for p in positions])
+    bp = rng.choice(positions, n_rows, p=weights / weights.sum())
+    ova = np.clip(rng.normal(66, 7, n_rows), 45, 93).round().astype(int)
+    age = np.clip(rng.gamma(9, 2.8, n_rows) + 14, 16, 43).astype(int)
+    pot = np.maximum(ova, ova + np.clip((27 - age) * rng.uniform(0.5, 1.5, n_rows), 0, 30)).round().astype(int)
+
+    attributes = {}
+    for attribute in ATTRIBUTE_COLUMNS:
+        attributes[attribute] = ova * 0.75 + rng.normal(0, 8, n_rows) - 5
+    for position in positions:
+        rows = bp == position
+        for group in _POSITIONS[position][1]:
+            for attribute in _ATTRIBUTE_GROUPS[group]:
+                attributes[attribute][rows] += 15
+        if position != 'GK':
+            for attribute in _ATTRIBUTE_GROUPS['GK']:
+                attributes[attribute][rows] = rng.integers(5, 16, rows.sum())
+    attributes = {k: np.clip(v, 5, 97).round().astype(int) for k, v in attributes.items()}
+
+    ids = rng.choice(np.arange(1, max(4 * n_rows, 300000)), n_rows, replace=False)
+    first = rng.choice(_FIRST_NAMES, n_rows)
+    last = [''.join(parts).capitalize() for parts in rng.choice(_LAST_SYLLABLES, (n_rows, 3))]
+    nations = [f'Nation {i}' for i in range(160)]
+    nation_weights = 1 / np.arange(1, 161)
+    clubs = [f'Club {i}' for i in range(max(n_rows // 25, 1))]
+    club = rng.choice(clubs, n_rows)
+    value = np.round(np.exp((ova - 45) / 6.5) * 2e4 * rng.uniform(0.6, 1.4, n_rows), -3)
+    wage = np.round(np.maximum(value / 200 * rng.uniform(0.5, 1.5, n_rows), 500), -2)
+    height = np.clip(rng.normal(181, 7, n_rows), 155, 206)
+    weight = np.clip(rng.normal(165, 15, n_rows) + (height - 181) * 1.5, 110, 240).round().astype(int)
+
+    fifa = pd.DataFrame({
+        'ID': ids,
+        'Name': [f'{f} {l}' for f, l in zip(first, last)],
+        'Age': age,
+        'OVA': ova,
+        'Nationality': rng.choice(nations, n_rows, p=nation_weights / nation_weights.sum()),
+        'Club': club,
+        'BOV': ova,
+        'BP': bp,
+        'Position': bp,
+        'Player Photo': [f'https://cdn.sofifa.com/players/{i // 1000:03d}/{i % 1000:03d}/21_120.png' for i in ids],
+        'Club Logo': 'https://cdn.sofifa.com/teams/1/light_60.png',
+        'Flag Photo': 'https://cdn.sofifa.com/flags/1.png',
+        'POT': pot,
+        'Team & Contract': [f'{c} 2019 ~ 2023' for c in club],
+        'Height': _feet_inches(height),
+        'Weight': [f'{w}lbs' for w in weight],
+        'foot': rng.choice(['Right', 'Left'], n_rows, p=[0.76, 0.24]),
+        'Growth': pot - ova,
+        'Joined': 'Jul 1, 2019',
+        'Loan Date End': 'N/A',
+        'Value': _money(value),
+        'Wage': _money(wage),
+        'Release Clause': _money(np.round(value * rng.uniform(1.5, 2.2, n_rows), -3)),
+        'Contract': '2019 ~ 2023',
+    })
+    for attribute in ATTRIBUTE_COLUMNS:
+        fifa[attribute] = attributes[attribute]
+    for total, parts in TOTAL_COLUMNS.items():
+        fifa[total] = sum(attributes[part] for part in parts)
+    fifa['Total Stats'] = sum(attributes[attribute] for attribute in ATTRIBUTE_COLUMNS)
+    for group in ['PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']:
+        fifa[group] = np.mean([attributes[a] for a in _ATTRIBUTE_GROUPS[group]], axis=0).round().astype(int)
+    fifa['Base Stats'] = fifa[['PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']].sum(axis=1)
+    fifa['W/F'] = rng.integers(1, 6, n_rows).astype(str) + ' ★'
+    fifa['SM'] = rng.integers(1, 6, n_rows).astype(str) + '★'
+    fifa['A/W'] = rng.choice(['High', 'Medium', 'Low'], n_rows)
+    fifa['D/W'] = rng.choice(['High', 'Medium', 'Low'], n_rows)
+    fifa['IR'] = '1 ★'
+    fifa['Hits'] = rng.integers(0, 500, n_rows)
+    for rating in POSITION_RATINGS:
+        fifa[rating] = np.clip(ova + rng.integers(-15, 3, n_rows), 20, 95)
+    fifa['Gender'] = 'Male'
+    return fifa[COLUMNS]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('rows', type=int, help='number of players')
+    parser.add_argument('out', help='output CSV path')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    synthetic_roster(args.rows, args.seed).to_csv(args.out, index=False)
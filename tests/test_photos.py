@@ -0,0 +1,154 @@
+"""
+Tests of photos.PhotoService against a local HTTP server with slow, missing and valid photos
+"""
+import io
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from photos import PhotoService
+
+# Seconds a /slow/ photo takes to be served
+SLOW_SECONDS = 0.5
+
+
+def png(n: int):
+    """
+    Returns a small PNG that differs for every n, so the photos do not share a content-addressed object
+    :param n: Number of the photo
+    :return: PNG bytes
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), (n % 256, (n * 7) % 256, (n * 13) % 256)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class PhotoHandler(BaseHTTPRequestHandler):
+    """
+    Serves /png/<n> at once, /slow/<n> after SLOW_SECONDS, /hang/<n> after 10 seconds and a 404 for anything else
+    """
+    hits = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            self.hits[self.path] += 1
+        kind, _, n = self.path.strip('/').partition('/')
+        if kind not in ('png', 'slow', 'hang'):
+            self.send_error(404)
+            return
+        time.sleep({'png': 0, 'slow': SLOW_SECONDS, 'hang': 10}[kind])
+        data = png(int(n))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), PhotoHandler)
+    httpd.daemon_threads = True
+    PhotoHandler.hits = Counter()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def is_placeholder(image):
+    return image.info.get('placeholder', False)
+
+
+def test_fetch_all_downloads_in_parallel(server, tmp_path):
+    service = PhotoService(str(tmp_path), max_workers=8, timeout=5)
+    urls = [f'{server}/slow/{n}' for n in range(6)]
+    start = time.perf_counter()
+    images = service.fetch_all(urls)
+    elapsed = time.perf_counter() - start
+    assert not any(is_placeholder(image) for image in images)
+    assert [image.getpixel((0, 0))[0] for image in images] == list(range(6))
+    # One after the other they would take 6 * SLOW_SECONDS
+    assert elapsed < 3 * SLOW_SECONDS
+
+
+def test_timeout_falls_back_to_placeholder(server, tmp_path):
+    service = PhotoService(str(tmp_path), timeout=0.3)
+    start = time.perf_counter()
+    image, = service.fetch_all([f'{server}/hang/1'])
+    assert is_placeholder(image)
+    assert time.perf_counter() - start < 2
+
+
+def test_missing_photo_falls_back_to_placeholder(server, tmp_path):
+    service = PhotoService(str(tmp_path))
+    url = f'{server}/missing/1'
+    missing, found = service.fetch_all([url, f'{server}/png/2'])
+    assert is_placeholder(missing) and not is_placeholder(found)
+    # Failures are not cached, the next fetch tries again
+    assert service.get(url) is None
+    service.fetch_all([url])
+    assert PhotoHandler.hits[f'/missing/1'] == 2
+
+
+def test_memory_cache_evicts_least_recently_used(server, tmp_path):
+    service = PhotoService(str(tmp_path), max_memory_items=2)
+    first, second, third = [f'{server}/png/{n}' for n in range(3)]
+    service.fetch_all([first])
+    service.fetch_all([second])
+    assert service.get(first) is not None
+    # first was used last, so second is evicted
+    service.fetch_all([third])
+    assert service.get(first) is not None
+    assert service.get(second) is None
+    assert service.get(third) is not None
+
+
+def test_disk_cache_evicts_least_recently_used(server, tmp_path):
+    sizes = [len(png(n)) for n in range(3)]
+    # Room for the first two photos, and after eviction for the last two
+    service = PhotoService(str(tmp_path), max_disk_bytes=int((sizes[1] + sizes[2]) / 0.9) + 1)
+    urls = [f'{server}/png/{n}' for n in range(3)]
+    for url in urls:
+        service.fetch_all([url])
+        time.sleep(0.05)
+    assert len(os.listdir(service.objects_dir)) == 2
+
+    # A new service starts with an empty memory cache, so only the evicted photo is downloaded again
+    service = PhotoService(str(tmp_path), max_disk_bytes=service.max_disk_bytes)
+    assert not any(is_placeholder(image) for image in service.fetch_all(urls[1:]))
+    assert PhotoHandler.hits['/png/1'] == PhotoHandler.hits['/png/2'] == 1
+    service.fetch_all(urls[:1])
+    assert PhotoHandler.hits['/png/0'] == 2
+
+
+def test_originals_do_not_evict_thumbnails(server, tmp_path):
+    # Room for a single original, so every download evicts the one before
+    service = PhotoService(str(tmp_path), max_disk_bytes=int(len(png(0)) / 0.9) + 1)
+    urls = [f'{server}/png/{n}' for n in range(3)]
+    thumbnails = [service.thumbnail(url) for url in urls]
+    assert len(os.listdir(service.objects_dir)) <= 1
+    assert len(os.listdir(service.thumbnails_dir)) == 3
+    assert [service.thumbnail(url) for url in urls] == thumbnails
+    assert all(PhotoHandler.hits[f'/png/{n}'] == 1 for n in range(3))
+
+
+def test_concurrent_requests_share_one_download(server, tmp_path):
+    service = PhotoService(str(tmp_path))
+    url = f'{server}/slow/1'
+    assert service.submit(url) is service.submit(url)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        images = list(executor.map(lambda _: service.fetch_all([url])[0], range(8)))
+    assert not any(is_placeholder(image) for image in images)
+    assert PhotoHandler.hits['/slow/1'] == 1
@@ -0,0 +1,98 @@
+"""
+Compact extract of the top player charts (figures.best_players and figures.highest_potential) shipped to the
+browser once per dataset and filter selection. Its rows are the only ones any number of players up to MAX_N, any
+age cutoff up to MAX_AGE and any set of positions can select, stored column by column with the strings of the
+categorical columns dictionary-encoded, and with the rows of each chart listed in ranked order. The clientside
+callbacks of assets/top_players.js re-slice and restyle the charts from it without a server round trip.
+"""
+import numpy as np
+import pandas as pd
+
+# Largest number of players and age cutoff the extract answers for
+MAX_N = 200
+MAX_AGE = 30
+
+# Age cutoff of figures.highest_potential
+DEFAULT_AGE_CUTOFF = 25
+
+# Columns of the extract, see figures.best_players and figures.highest_potential
+COLUMNS = ['Name', 'Age', 'OVA', 'POT', 'Value', 'Release Clause']
+CODED_COLUMNS = ['BP', 'Club', 'Nationality']
+
+
+def _json_values(values: pd.Series):
+    # Missing values are sent as null
+    return values.astype(object).where(values.notna(), None).tolist()
+
+
+def _ranked(fifa: pd.DataFrame, column: str, eligible: pd.Series):
+    # Eligible rows in descending order of a column, ties in roster order as with DataFrame.nlargest
+    values = fifa[column].to_numpy(dtype=np.float64)
+    rows = np.flatnonzero(eligible.to_numpy(dtype=bool) & ~np.isnan(values))
+    return rows[np.argsort(-values[rows], kind='stable')]
+
+
+def _position_ranks(positions: np.ndarray):
+    # Rank of every row amongst the rows of its position, for rows in ranked order
+    return pd.Series(positions).groupby(positions).cumcount().to_numpy()
+
+
+def top_players_extract(fifa: pd.DataFrame, max_n: int = MAX_N, max_age: int = MAX_AGE):
+    """
+    Returns the extract of the top player charts. The best players of any set of positions are among the best max_n
+    of each position, and the highest potentials of players younger than a cutoff are among the max_n highest of
+    their position amongst the players of their age or younger.
+    :param fifa: The dataframe containing the FIFA game data
+    :param max_n: Largest number of players drawn
+    :param max_age: Largest age cutoff of the highest potential chart
+    :return: Dict with the 'columns' of the extract, the 'values' of its coded columns ('BP', 'Club' and
+             'Nationality', coded -1 when missing), the rows of 'best_players' and 'highest_potential' in ranked order,
+             'max_n' and 'max_age'
+    """
+    positions = pd.factorize(fifa['BP'])[0]
+
+    best = _ranked(fifa, 'OVA', pd.Series(True, index=fifa.index))
+    best = best[_position_ranks(positions.take(best)) < max_n]
+
+    potential = _ranked(fifa, 'POT', (fifa['OVA'] != fifa['POT']) & (fifa['Age'] < max_age))
+    ages = fifa['Age'].to_numpy(dtype=np.float64).take(potential)
+    ranked_positions = positions.take(potential)
+    keep = np.zeros(len(potential), dtype=bool)
+    for age in np.unique(ages):
+        younger = np.flatnonzero(ages <= age)
+        ranks = _position_ranks(ranked_positions.take(younger))
+        keep[younger[(ages.take(younger) == age) & (ranks < max_n)]] = True
+    potential = potential[keep]
+
+    rows = np.union1d(best, potential)
+    extract = fifa.take(rows)
+    columns = {column: _json_values(extract[column]) for column in COLUMNS}
+    values = {}
+    for column in CODED_COLUMNS:
+        codes, uniques = pd.factorize(extract[column], sort=True)
+        columns[column] = codes.tolist()
+        values[column] = [str(value) for value in uniques]
+    return {
+        'columns': columns,
+        'values': values,
+        'best_players': np.searchsorted(rows, best).tolist(),
+        'highest_potential': np.searchsorted(rows, potential).tolist(),
+        'max_n': max_n,
+        'max_age': max_age,
+    }
+
+
+def chart_template(figure: dict):
+    """
+    Returns a top player chart without its points: the trace style and layout the clientside callbacks draw into
+    :param figure: Figure of figures.best_players or figures.highest_potential
+    :return: Figure dict
+    """
+    if not isinstance(figure, dict):
+        figure = figure.to_plotly_json()
+    traces = []
+    for trace in figure['data'][:1]:
+        trace = {key: value for key, value in trace.items() if key not in ('x', 'y', 'customdata', 'hovertemplate')}
+        trace['marker'] = {key: value for key, value in trace.get('marker', {}).items() if key not in ('color', 'size')}
+        traces.append(trace)
+    return {'data': traces, 'layout': figure['layout']}
@@ -0,0 +1,82 @@
+"""
+WSGI entry point of the dashboard for production servers.
+
+The dataset, similarity indexes and section figures are prepared once at import. With gunicorn's preload_app
+(see gunicorn.conf.py) that happens in the master, and the forked workers share those pages copy-on-write.
+With FIFA_WARMUP_BACKGROUND=1 the app is not preloaded: every worker warms up in a thread after it starts and
+reports not ready meanwhile. Only the section figures and the approximate index are deferred: the default dataset is
+still loaded when the worker imports the app, since the player dropdowns of the layout list its best players, so a
+worker answers no request (not even /healthz) before that load is done.
+
+Run with:
+gunicorn -c gunicorn.conf.py
+"""
+import gc
+import os
+import threading
+import time
+
+from flask import jsonify
+
+import app as dashboard
+import startup
+from snapshot import save_snapshot
+
+application = dashboard.server
+
+_ready = threading.Event()
+_warmup_seconds = None
+
+
+@application.route("/healthz")
+def healthz():
+    """
+    Liveness probe, answers as soon as the process serves requests
+    """
+    return jsonify(status="ok")
+
+
+@application.route("/readyz")
+def readyz():
+    """
+    Readiness probe, answers 503 until the warm-up is done or while the default dataset is not loaded. With
+    preload_app the warm-up is over before the workers are forked, so the probe only reports warming up with
+    FIFA_WARMUP_BACKGROUND=1.
+    """
+    if not _ready.is_set():
+        return jsonify(status="warming up"), 503
+    dataset = dashboard.datasets.peek()
+    if dataset is None:
+        return jsonify(status="default dataset not loaded"), 503
+    return jsonify(status="ready", warmup_seconds=_warmup_seconds, players=len(dataset.roster),
+                   startup=startup.phases())
+
+
+def warm_up():
+    """
+    Builds everything the requests share before the workers are forked: the section figures and the
+    approximate similarity index of the default dataset, the other datasets load on first use. Photos are left to
+    the workers, their download threads cannot be forked. A dataset that did not start from a snapshot writes one,
+    so the next start skips the parsing and the builds.
+    """
+    global _warmup_seconds
+    start = time.perf_counter()
+    # The default dataset is loaded by the app at import, it may only be gone if requests for others evicted it
+    dataset = dashboard.datasets.peek()
+    if dataset is not None:
+        for graph_id in dataset.registry:
+            dataset.registry.get(graph_id)
+        dataset.engine.index('approximate')
+    _warmup_seconds = round(time.perf_counter() - start, 3)
+    startup.mark("warm-up")
+    if dataset is not None and dashboard.datasets.snapshot_dir and not dataset.from_snapshot:
+        save_snapshot(dataset, dashboard.datasets.snapshot_dir)
+    # Objects created so far are left alone by the garbage collector, so it does not write to the shared pages
+    gc.freeze()
+    _ready.set()
+
+
+if os.environ.get("FIFA_WARMUP_BACKGROUND", "0") == "1":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+else:
+    warm_up()